@@ -0,0 +1,90 @@
+# Leitura e gravação dos arquivos JSON da pasta dados/
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+	import fcntl
+except ImportError:  # Windows
+	fcntl = None
+	import msvcrt
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DADOS_DIR = os.path.join(BASE_DIR, 'dados')
+
+def caminho_dados(arquivo):
+	return os.path.join(DADOS_DIR, arquivo)
+
+def ler_json(arquivo):
+	try:
+		with open(caminho_dados(arquivo), 'r', encoding='utf-8') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+	except json.JSONDecodeError as e:
+		print(f"❌ Arquivo {arquivo} inválido ({e}) - tratado como vazio")
+		return {}
+
+def gravar_json(arquivo, dados):
+	"""
+	Grava de forma atômica: escreve num temporário da mesma pasta, faz fsync e
+	substitui o arquivo com os.replace. Leitores veem o conteúdo antigo ou o novo,
+	nunca um arquivo truncado.
+	"""
+	os.makedirs(DADOS_DIR, exist_ok=True)
+	caminho = caminho_dados(arquivo)
+	caminho_tmp = None
+	try:
+		with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=DADOS_DIR, prefix=f'.{arquivo}.', suffix='.tmp', delete=False) as f:
+			caminho_tmp = f.name
+			json.dump(dados, f, ensure_ascii=False, indent=2)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(caminho_tmp, caminho)
+		caminho_tmp = None
+		_sincronizar_pasta()
+		return True
+	except Exception as e:
+		print(f"Erro ao salvar arquivo {arquivo}: {e}")
+		return False
+	finally:
+		if caminho_tmp and os.path.exists(caminho_tmp):
+			os.remove(caminho_tmp)
+
+def _sincronizar_pasta():
+	"""Garante que a troca de nome feita por os.replace chegou ao disco (POSIX)."""
+	if fcntl is None:
+		return
+	fd = os.open(DADOS_DIR, os.O_RDONLY)
+	try:
+		os.fsync(fd)
+	finally:
+		os.close(fd)
+
+@contextmanager
+def bloqueio_arquivo(arquivo):
+	"""
+	Lock exclusivo entre processos (ex.: workers do gunicorn) para ciclos de
+	leitura-alteração-gravação de um arquivo de dados/. Usa dados/.<arquivo>.lock.
+	"""
+	os.makedirs(DADOS_DIR, exist_ok=True)
+	with open(caminho_dados(f'.{arquivo}.lock'), 'a+') as f:
+		if fcntl is not None:
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+		else:
+			f.seek(0)
+			while True:
+				try:
+					msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:
+					continue
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+			else:
+				f.seek(0)
+				msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
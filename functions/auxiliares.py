@@ -0,0 +1,51 @@
+# Funções auxiliares sem dependências de Firestore ou arquivos (usadas também nos
+# processos da exportação em massa, que não devem inicializar o Firebase)
+from datetime import date
+
+def data_br_to_iso(d):
+	d = d.split('/')
+	return f"{d[2]}-{d[1].zfill(2)}-{d[0].zfill(2)}"
+def int_to_roman(num):
+	val = [1000, 900, 500, 400, 100, 90, 50, 40, 10, 9, 5, 4, 1]
+	syms = ['M', 'CM', 'D', 'CD', 'C', 'XC', 'L', 'XL', 'X', 'IX', 'V', 'IV', 'I']
+	roman_num = ''
+	i = 0
+	while num > 0:
+		for _ in range(num // val[i]):
+			roman_num += syms[i]
+			num -= val[i]
+		i += 1
+	return roman_num
+def ordinal_data_br(d):
+	"""DD/MM/YYYY -> número do dia (date.toordinal), para comparar e subtrair datas como inteiros."""
+	dia, mes, ano = d.split('/')
+	return date(int(ano), int(mes), int(dia)).toordinal()
+def indices_no_periodo(m, data_inicio, data_fim):
+	"""
+	range dos índices de m['data'] entre data_inicio e data_fim (YYYY-MM-DD, inclusive).
+	As datas de um mapa são os dias consecutivos do seu mês, então o dia i é
+	primeiro_dia + i: basta converter a primeira data e as duas pontas do período.
+	"""
+	n_dias = len(m.get('data') or [])
+	if not (data_inicio and data_fim):
+		return range(n_dias)
+	if not n_dias:
+		return range(0)
+	primeiro = ordinal_data_br(m['data'][0])
+	inicio = max(0, date.fromisoformat(data_inicio).toordinal() - primeiro)
+	fim = min(n_dias - 1, date.fromisoformat(data_fim).toordinal() - primeiro)
+	return range(inicio, fim + 1)
+def filtro_mapa(m, lote_id, unidades_list, data_inicio, data_fim):
+	if m['lote_id'] != lote_id:
+		return False
+	if unidades_list and m.get('nome_unidade') not in unidades_list:
+		return False
+	if data_inicio and data_fim:
+		# Verifica se há datas dentro do intervalo: como as datas do mapa são dias
+		# consecutivos (DD/MM/YYYY), basta comparar o primeiro e o último dia
+		datas = m.get('data', [])
+		if not datas:
+			return False
+		if data_br_to_iso(datas[-1]) < data_inicio or data_br_to_iso(datas[0]) > data_fim:
+			return False
+	return True
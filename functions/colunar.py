@@ -0,0 +1,128 @@
+# Representação colunar (NumPy) das contagens diárias de refeições
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+# Ordem das colunas em todas as matrizes e vetores de preços
+CAMPOS_REFEICOES = (
+	'cafe_interno', 'cafe_funcionario',
+	'almoco_interno', 'almoco_funcionario',
+	'lanche_interno', 'lanche_funcionario',
+	'jantar_interno', 'jantar_funcionario'
+)
+CAMPOS_SIISP = tuple(f'{campo}_siisp' for campo in CAMPOS_REFEICOES)
+TIPOS_PRECOS = (
+	('cafe', 'interno'), ('cafe', 'funcionario'),
+	('almoco', 'interno'), ('almoco', 'funcionario'),
+	('lanche', 'interno'), ('lanche', 'funcionario'),
+	('jantar', 'interno'), ('jantar', 'funcionario')
+)
+
+# Diferença sobre o SIISP a partir da qual um dia conta como discrepância
+# (internos: acima de 5; funcionários: qualquer excedente), na ordem de CAMPOS_REFEICOES
+LIMITES_DISCREPANCIA = np.array([5, 0, 5, 0, 5, 0, 5, 0], dtype=np.int64)
+
+# refeicoes: matriz (n_dias × 8) int32
+# totais: soma de cada coluna (8,)
+# excedentes: soma, por coluna, dos valores positivos de refeição - n_siisp (8,);
+#             zeros quando o mapa não tem n_siisp compatível
+# discrepancias: dias, por coluna, com diferença acima de LIMITES_DISCREPANCIA (8,)
+# diferencas: matriz (n_dias do SIISP × 8) int64 de refeição - n_siisp, ou None sem SIISP compatível
+# validas: colunas com o mesmo número de dias do SIISP (8,) bool, ou None
+ColunasMapa = namedtuple('ColunasMapa', ['refeicoes', 'totais', 'excedentes', 'discrepancias', 'tem_siisp', 'diferencas', 'validas'])
+
+_MAX_CACHE = 4096
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def vetor_precos(precos):
+	"""Preços do lote no formato {'cafe': {'interno': x, ...}, ...} como vetor (8,)."""
+	return np.array(
+		[(precos.get(ref) or {}).get(tipo) or 0 for ref, tipo in TIPOS_PRECOS],
+		dtype=np.float64
+	)
+
+def matriz_refeicoes(mapa):
+	"""Matriz (n_dias × 8) int32 com as contagens diárias; colunas mais curtas são completadas com zero."""
+	# dict.get: as colunas lidas aqui são sempre gravadas, e um MapaCompacto
+	# (functions/formato_mapas.py) não precisa recalcular data/*_siisp para isso
+	colunas = [dict.get(mapa, campo) or [] for campo in CAMPOS_REFEICOES]
+	n_dias = max(len(c) for c in colunas)
+	matriz = np.zeros((n_dias, len(CAMPOS_REFEICOES)), dtype=np.int32)
+	for j, valores in enumerate(colunas):
+		if valores:
+			matriz[:len(valores), j] = valores
+	return matriz
+
+def _calcular_colunas(mapa):
+	refeicoes = matriz_refeicoes(mapa)
+	totais = refeicoes.sum(axis=0, dtype=np.int64)
+	n_siisp = dict.get(mapa, 'n_siisp') or []
+	excedentes = np.zeros(len(CAMPOS_REFEICOES), dtype=np.int64)
+	discrepancias = np.zeros(len(CAMPOS_REFEICOES), dtype=np.int64)
+	diferencas = validas = None
+	tem_siisp = bool(n_siisp)
+	if tem_siisp:
+		# Só colunas com o mesmo número de dias do SIISP (as demais ficam [] em *_siisp)
+		validas = np.array([len(dict.get(mapa, campo) or []) == len(n_siisp) for campo in CAMPOS_REFEICOES])
+		if validas.any():
+			n_dias = len(n_siisp)
+			diferencas = refeicoes[:n_dias].astype(np.int64) - np.asarray(n_siisp, dtype=np.int64)[:, None]
+			excedentes = np.where(diferencas > 0, diferencas, 0).sum(axis=0) * validas
+			discrepancias = (diferencas > LIMITES_DISCREPANCIA).sum(axis=0) * validas
+		else:
+			validas = None
+	return ColunasMapa(refeicoes, totais, excedentes, discrepancias, tem_siisp, diferencas, validas)
+
+def colunas_mapa(mapa):
+	"""
+	Forma colunar do mapa, em cache por identidade do objeto. Os mapas do
+	repositório não são alterados no lugar (uma alteração gera um novo dict),
+	então a identidade basta para validar o cache.
+	"""
+	chave = id(mapa)
+	with _lock:
+		item = _cache.get(chave)
+		if item is not None and item[0] is mapa:
+			_cache.move_to_end(chave)
+			return item[1]
+	colunas = _calcular_colunas(mapa)
+	with _lock:
+		_cache[chave] = (mapa, colunas)
+		if len(_cache) > _MAX_CACHE:
+			_cache.popitem(last=False)
+	return colunas
+
+def diferencas_siisp(mapa):
+	"""
+	Colunas *_siisp do mapa ({campo_siisp: lista}): refeição - n_siisp dia a dia, ou []
+	quando a coluna não tem o mesmo número de dias do SIISP. Sem n_siisp ou sem
+	refeições, nenhuma coluna. Sai da matriz de diferenças de colunas_mapa, em cache
+	junto com as demais formas colunares do mapa.
+	"""
+	if not dict.get(mapa, 'n_siisp') or not any(dict.get(mapa, campo) for campo in CAMPOS_REFEICOES):
+		return {}
+	try:
+		colunas = colunas_mapa(mapa)
+	except (TypeError, ValueError, OverflowError):
+		# Valores não inteiros nas colunas: não há como derivar as diferenças
+		return {}
+	if colunas.diferencas is None:
+		return {campo_siisp: [] for campo_siisp in CAMPOS_SIISP}
+	return {
+		campo_siisp: colunas.diferencas[:, j].tolist() if colunas.validas[j] else []
+		for j, campo_siisp in enumerate(CAMPOS_SIISP)
+	}
+
+def somar_mapas(mapas):
+	"""
+	Empilha os mapas em duas matrizes (n_mapas × 8) e devolve as somas por coluna:
+	(totais de refeições, excedentes positivos sobre o SIISP).
+	"""
+	if not mapas:
+		vazio = np.zeros(len(CAMPOS_REFEICOES), dtype=np.int64)
+		return vazio, vazio.copy()
+	colunas = [colunas_mapa(m) for m in mapas]
+	totais = np.stack([c.totais for c in colunas]).sum(axis=0)
+	excedentes = np.stack([c.excedentes for c in colunas]).sum(axis=0)
+	return totais, excedentes
@@ -0,0 +1,413 @@
+# Exportação da tabela de mapas para Excel a partir do modelo dados/modelo.xlsx
+import os
+import re
+import itertools
+import tempfile
+import threading
+from copy import copy
+from datetime import date
+from openpyxl import load_workbook, Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet.copier import WorksheetCopy
+from .arquivos import DADOS_DIR
+from .colunar import CAMPOS_REFEICOES, TIPOS_PRECOS
+from .auxiliares import int_to_roman, indices_no_periodo
+
+MODELO_XLSX = os.path.join(DADOS_DIR, 'modelo.xlsx')
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Layout da planilha COMPARATIVO: dados a partir da linha 12 (após o cabeçalho mesclado de 9 a 11)
+PRIMEIRA_LINHA_DADOS = 12
+COLUNA_SIISP = 3           # C
+COLUNA_DATA = 4            # D
+COLUNA_REFEICOES = 5       # E-L, na ordem de CAMPOS_REFEICOES
+COLUNAS_FORMULAS = range(13, 21)  # M-T: diferença mapa x SIISP
+LINHA_PRECOS = 6           # M6-T6
+
+# Referências à linha modelo de dados dentro das fórmulas (ex.: E12, C12)
+PADRAO_LINHA_DADOS = re.compile(r'(\D)' + str(PRIMEIRA_LINHA_DADOS) + r'(\D|$)')
+
+# Acima disso o arquivo gerado sai da memória para um temporário em disco
+LIMITE_MEMORIA_ARQUIVO = 8 * 1024 * 1024
+
+MESES_PT = [
+	'', 'JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+	'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO'
+]
+
+class ErroExportacao(Exception):
+	"""Falha esperada na exportação (filtros sem dados, modelo inválido), com o status HTTP da resposta."""
+
+	def __init__(self, mensagem, status=400):
+		super().__init__(mensagem)
+		self.status = status
+
+class EstilosCompartilhados:
+	"""
+	Um NamedStyle no arquivo de saída para cada combinação de estilo usada do
+	modelo. As células só referenciam o estilo pelo nome, sem copiar fonte,
+	borda e alinhamento célula a célula.
+	"""
+
+	def __init__(self, wb):
+		self.wb = wb
+		self._nomes = {}
+
+	def nome(self, celula, number_format=None):
+		chave = (tuple(celula._style), number_format)
+		nome = self._nomes.get(chave)
+		if nome is None:
+			nome = f'SGMRP {len(self._nomes) + 1}'
+			self.wb.add_named_style(NamedStyle(
+				name=nome,
+				font=copy(celula.font),
+				fill=copy(celula.fill),
+				border=copy(celula.border),
+				alignment=copy(celula.alignment),
+				number_format=number_format or celula.number_format,
+				protection=copy(celula.protection)
+			))
+			self._nomes[chave] = nome
+		return nome
+
+def _celula(ws, valor, estilo):
+	cell = WriteOnlyCell(ws, value=valor)
+	if estilo:
+		cell.style = estilo
+	return cell
+
+def _copiar_layout(origem, destino):
+	"""Propriedades da planilha (dimensões, mesclagens, formatação condicional...) que o modo write-only precisa receber antes das linhas."""
+	destino.sheet_format = copy(origem.sheet_format)
+	destino.sheet_properties = copy(origem.sheet_properties)
+	destino.views = copy(origem.views)
+	destino.page_margins = copy(origem.page_margins)
+	destino.print_options = copy(origem.print_options)
+	destino.page_setup.orientation = origem.page_setup.orientation
+	destino.page_setup.paperSize = origem.page_setup.paperSize
+	destino.page_setup.scale = origem.page_setup.scale
+	for chave, dim in origem.column_dimensions.items():
+		nova = destino.column_dimensions[chave]
+		nova.min, nova.max = dim.min, dim.max
+		nova.hidden = dim.hidden
+		if dim.customWidth:
+			nova.width = dim.width
+	for faixa in origem.merged_cells.ranges:
+		destino.merged_cells.add(faixa.coord)
+	for imagem in origem._images:
+		destino.add_image(imagem)
+
+def _copiar_formatacao_condicional(origem, destino, ultima_linha_dados=None):
+	"""
+	Uma entrada por faixa do modelo; com ultima_linha_dados, as faixas que cobrem a
+	linha modelo de dados (12) passam a ir até a última linha gerada (ex.: M12:T500).
+	"""
+	for faixa in origem.conditional_formatting:
+		coordenadas = []
+		for intervalo in faixa.sqref.ranges:
+			if ultima_linha_dados and intervalo.min_row <= PRIMEIRA_LINHA_DADOS <= intervalo.max_row < ultima_linha_dados:
+				intervalo = CellRange(
+					min_col=intervalo.min_col, min_row=intervalo.min_row,
+					max_col=intervalo.max_col, max_row=ultima_linha_dados
+				)
+			coordenadas.append(intervalo.coord)
+		for regra in faixa.rules:
+			destino.conditional_formatting.add(' '.join(coordenadas), regra)
+
+def _copiar_linhas(origem, destino, estilos, ultima_linha, substituicoes=None):
+	"""
+	Reescreve as linhas 1..ultima_linha da planilha do modelo (valores, estilos e alturas).
+	substituicoes: {(linha, coluna): (valor, number_format)} gravados no lugar do valor do modelo.
+	"""
+	substituicoes = substituicoes or {}
+	for numero, linha in enumerate(origem.iter_rows(min_row=1, max_row=ultima_linha), start=1):
+		dim = origem.row_dimensions.get(numero)
+		if dim is not None and (dim.ht or dim.hidden):
+			destino.row_dimensions[numero].height = dim.ht
+			destino.row_dimensions[numero].hidden = dim.hidden
+		celulas = []
+		for cell in linha:
+			substituta = substituicoes.get((numero, cell.column))
+			if substituta is not None:
+				valor, number_format = substituta
+				celulas.append(_celula(destino, valor, estilos.nome(cell, number_format)))
+			elif cell.value is not None or cell.has_style:
+				celulas.append(_celula(destino, cell.value, estilos.nome(cell) if cell.has_style else None))
+			else:
+				celulas.append(None)
+		destino.append(celulas)
+
+def _preencher_resumo(ws, lote, lote_id, mapas_filtrados, nomes_unidades):
+	"""Planilha RESUMO (poucas linhas: uma por unidade + totais), editada no modelo em modo normal."""
+	precos = lote.get('precos', {}) if lote else {}
+	ws['B8'] = f"CONTRATO : {lote.get('contrato', '') if lote else ''}"
+	empresa_nome = lote.get('empresa', '') if lote else ''
+	mes = ano = None
+	if mapas_filtrados:
+		mes = mapas_filtrados[0].get('mes')
+		ano = mapas_filtrados[0].get('ano')
+	mes_nome = MESES_PT[mes] if mes and 1 <= mes <= 12 else ''
+	lote_romano = int_to_roman(lote_id) if lote_id else ''
+	ws['B7'] = f"RESUMO FINAL LOTE {lote_romano} - EMPRESA {empresa_nome} - {mes_nome} {ano}".upper()
+
+	# Desmesclar as células B a K da linha 13 em diante: os totais descem uma linha por unidade extra
+	for faixa in list(ws.merged_cells.ranges):
+		if faixa.max_row >= 13 and faixa.min_col >= 2 and faixa.max_col <= 11:
+			ws.unmerge_cells(str(faixa))
+
+	quantidade_unidades = max(len(nomes_unidades), 1)
+	estilo_b11 = ws['B11']
+	if quantidade_unidades > 1:
+		ws.insert_rows(11, amount=quantidade_unidades - 1)
+
+	# Um mapa por unidade (o primeiro encontrado), como na tabela do sistema
+	mapa_por_unidade = {}
+	for mapa in mapas_filtrados:
+		mapa_por_unidade.setdefault(mapa.get('nome_unidade'), mapa)
+
+	somas = [0] * len(CAMPOS_REFEICOES)
+	for idx in range(quantidade_unidades):
+		nome_unidade = nomes_unidades[idx] if idx < len(nomes_unidades) else ''
+		mapa_ref = mapa_por_unidade.get(nome_unidade)
+		refeicoes = [sum(mapa_ref.get(campo, []) or []) if mapa_ref else 0 for campo in CAMPOS_REFEICOES]
+		somas = [s + r for s, r in zip(somas, refeicoes)]
+		# B: ordem, C: unidade, D-K: refeições
+		for col, valor in enumerate([idx + 1, nome_unidade] + refeicoes, start=2):
+			cell = ws.cell(row=11 + idx, column=col, value=valor)
+			cell._style = copy(estilo_b11._style)
+
+	# Valor unitário, quantidade parcial, valor parcial e valor total
+	linha_precos = 13 + quantidade_unidades - 1
+	ws.merge_cells(start_row=linha_precos, start_column=2, end_row=linha_precos + 3, end_column=2)
+	estilo_preco = ws.cell(row=linha_precos, column=4)
+	total = 0
+	for col_offset, (ref, tipo) in enumerate(TIPOS_PRECOS):
+		col = 4 + col_offset  # D=4, ..., K=11
+		preco = precos.get(ref, {}).get(tipo, None)
+		cell = ws.cell(row=linha_precos, column=col, value=preco)
+		cell._style = copy(estilo_preco._style)
+		ws.cell(row=linha_precos + 1, column=col, value=somas[col_offset])
+		produto = (preco if preco else 0) * somas[col_offset]
+		ws.cell(row=linha_precos + 2, column=col, value=produto)
+		total += produto
+	ws.merge_cells(start_row=linha_precos + 3, start_column=4, end_row=linha_precos + 3, end_column=11)
+	ws.cell(row=linha_precos + 3, column=4, value=total)
+
+def _localizar_cabecalho(ws):
+	"""(linha, coluna LOCAÇÃO, coluna UNIDADE ou None) nas 20 primeiras linhas, colunas a partir de 1."""
+	for r in range(1, 21):
+		valores = [cell.value for cell in ws[r]]
+		if 'LOCAÇÃO' in valores:
+			col_unidade = next(
+				(i + 1 for i, v in enumerate(valores) if v and str(v).strip().upper() == 'UNIDADE'),
+				None
+			)
+			return r, valores.index('LOCAÇÃO') + 1, col_unidade
+	raise ErroExportacao("Cabeçalho LOCAÇÃO não encontrado no modelo.", 400)
+
+def _modelo_formula(formula):
+	"""Fórmula da linha modelo com as referências à linha 12 trocadas por {0}, pronta para .format(linha)."""
+	escapada = formula.replace('{', '{{').replace('}', '}}')
+	return PADRAO_LINHA_DADOS.sub(lambda m: m.group(1) + '{0}' + m.group(2), escapada)
+
+def _assinatura_modelo(caminho):
+	st = os.stat(caminho)
+	return (st.st_mtime_ns, st.st_size)
+
+class ModeloExportacao:
+	"""
+	modelo.xlsx já analisado: posição do cabeçalho, células de estilo da linha de
+	dados (A12), fórmulas de M12:T12 e regras de formatação condicional por coluna.
+	O workbook carregado é mantido só para leitura e compartilhado entre as
+	exportações; a única planilha alterada por exportação (RESUMO) é clonada em
+	memória por clonar_resumo().
+	"""
+
+	def __init__(self, caminho, assinatura):
+		self.assinatura = assinatura
+		self.workbook = load_workbook(caminho)
+		if 'COMPARATIVO' in self.workbook.sheetnames:
+			self.comparativo = self.workbook['COMPARATIVO']
+		else:
+			self.comparativo = self.workbook.active
+			self.comparativo.title = 'COMPARATIVO'
+		self.resumo = self.workbook['RESUMO'] if 'RESUMO' in self.workbook.sheetnames else None
+
+		# Materializa as células de todas as planilhas: iter_rows cria as que faltam,
+		# e as leituras das exportações concorrentes não devem alterar o modelo
+		for ws in self.workbook.worksheets:
+			for _ in ws.iter_rows():
+				pass
+
+		try:
+			self.cabecalho = _localizar_cabecalho(self.comparativo)
+		except ErroExportacao:
+			self.cabecalho = None
+		self.celula_dados = self.comparativo.cell(row=PRIMEIRA_LINHA_DADOS, column=1)
+		# (coluna, valor, fórmula pré-compilada ou None, célula de estilo) de M12:T12
+		self.formulas = []
+		for col in COLUNAS_FORMULAS:
+			cell = self.comparativo.cell(row=PRIMEIRA_LINHA_DADOS, column=col)
+			modelo = _modelo_formula(cell.value) if cell.data_type == 'f' else None
+			self.formulas.append((col, cell.value, modelo, cell))
+		# merge_cells no clone registra bordas nas tabelas de estilo do workbook compartilhado
+		self._lock = threading.Lock()
+
+	def clonar_resumo(self, preencher):
+		"""Cópia da planilha RESUMO (células, dimensões, mesclagens, layout) passada a preencher(ws)."""
+		with self._lock:
+			ws = Worksheet(self.workbook)
+			WorksheetCopy(self.resumo, ws).copy_worksheet()
+			ws.views = self.resumo.views
+			ws.conditional_formatting = self.resumo.conditional_formatting
+			ws._images = list(self.resumo._images)
+			preencher(ws)
+			return ws
+
+_modelo = None
+_modelo_lock = threading.Lock()
+
+def carregar_modelo():
+	"""Descritor do modelo.xlsx, analisado uma vez por processo e refeito quando o arquivo muda (mtime/tamanho)."""
+	global _modelo
+	assinatura = _assinatura_modelo(MODELO_XLSX)
+	with _modelo_lock:
+		if _modelo is None or _modelo.assinatura != assinatura:
+			_modelo = ModeloExportacao(MODELO_XLSX, assinatura)
+			print(f"📄 Modelo de exportação carregado ({os.path.basename(MODELO_XLSX)})")
+		return _modelo
+
+def _linhas_comparativo(mapas_filtrados, unidades_list, data_inicio, data_fim):
+	"""Gera (unidade, n_siisp, data, [refeições]) por dia dentro dos filtros, sem montar listas."""
+	for mapa in mapas_filtrados:
+		unidade_nome = mapa.get('nome_unidade', '')
+		if unidades_list and unidade_nome not in unidades_list:
+			continue
+		datas = mapa.get('data', [])
+		n_siisp = mapa.get('n_siisp', [])
+		colunas = [mapa.get(campo, []) for campo in CAMPOS_REFEICOES]
+		# Dias do período por deslocamento a partir do primeiro dia; valores SIISP além das datas entram sem data
+		periodo = indices_no_periodo(mapa, data_inicio, data_fim)
+		dias = itertools.chain(range(periodo.start, min(periodo.stop, len(n_siisp))), range(len(datas), len(n_siisp)))
+		for i in dias:
+			data_val = datas[i] if i < len(datas) else ''
+			yield unidade_nome, n_siisp[i], data_val, [col[i] if i < len(col) else None for col in colunas]
+
+def _escrever_comparativo(modelo, ws, estilos, lote_id, precos, linhas):
+	"""Escreve o cabeçalho do modelo e, em streaming, uma linha por dia. Retorna a última linha de dados."""
+	ws_modelo = modelo.comparativo
+	_, col_locacao, col_unidade = modelo.cabecalho
+	_copiar_layout(ws_modelo, ws)
+	# Preços do lote em M6:T6
+	substituicoes = {
+		(LINHA_PRECOS, COLUNAS_FORMULAS[0] + idx): (precos.get(ref, {}).get(tipo, None), 'General')
+		for idx, (ref, tipo) in enumerate(TIPOS_PRECOS)
+	}
+	_copiar_linhas(ws_modelo, ws, estilos, PRIMEIRA_LINHA_DADOS - 1, substituicoes)
+
+	estilo_texto = estilos.nome(modelo.celula_dados)
+	estilo_numero = estilos.nome(modelo.celula_dados, 'General')
+	estilo_data = estilos.nome(modelo.celula_dados, 'DD/MM/YYYY')
+	modelos_formula = [(valor, modelo_formula, estilos.nome(cell)) for _, valor, modelo_formula, cell in modelo.formulas]
+	total_colunas = COLUNAS_FORMULAS[-1]
+	lote_nome = f"LOTE {lote_id}"
+
+	linha = PRIMEIRA_LINHA_DADOS
+	for unidade_nome, siisp, data_val, refeicoes in linhas:
+		celulas = [None] * total_colunas
+		celulas[col_locacao - 1] = _celula(ws, lote_nome, estilo_texto)
+		if col_unidade is not None:
+			celulas[col_unidade - 1] = _celula(ws, unidade_nome, estilo_texto)
+		celulas[COLUNA_SIISP - 1] = _celula(ws, siisp, estilo_numero)
+		celulas[COLUNA_DATA - 1] = _celula(ws, data_val, estilo_data)
+		for offset, valor in enumerate(refeicoes):
+			celulas[COLUNA_REFEICOES - 1 + offset] = _celula(ws, valor, estilo_numero)
+		for col, (valor, modelo_formula, estilo) in zip(COLUNAS_FORMULAS, modelos_formula):
+			if modelo_formula is not None:
+				valor = modelo_formula.format(linha)
+			celulas[col - 1] = _celula(ws, valor, estilo)
+		ws.append(celulas)
+		linha += 1
+	ultima_linha = linha - 1
+
+	# Regras de M12:T12 estendidas numa única faixa até a última linha de dados
+	_copiar_formatacao_condicional(ws_modelo, ws, ultima_linha)
+	return ultima_linha
+
+def gerar_planilha(lote, lote_id, mapas_filtrados, nomes_unidades, unidades_list, data_inicio, data_fim):
+	"""
+	Monta a planilha a partir do descritor do modelo (carregar_modelo): RESUMO é
+	preenchida num clone da planilha do modelo (modo normal, poucas células) e as
+	planilhas são regravadas num Workbook write-only, com as linhas diárias da
+	COMPARATIVO geradas em streaming. O resultado vai para um SpooledTemporaryFile
+	(em disco acima de LIMITE_MEMORIA_ARQUIVO), já no início.
+	"""
+	modelo = carregar_modelo()
+
+	# Erros de filtro/modelo são detectados antes de começar a gravar a saída
+	if modelo.cabecalho is None:
+		raise ErroExportacao("Cabeçalho LOCAÇÃO não encontrado no modelo.", 400)
+	linhas = _linhas_comparativo(mapas_filtrados, unidades_list, data_inicio, data_fim)
+	primeira = next(linhas, None)
+	if primeira is None:
+		raise ErroExportacao("Nenhum dado SIISP encontrado para os filtros selecionados.", 404)
+
+	resumo = None
+	if modelo.resumo is not None:
+		resumo = modelo.clonar_resumo(
+			lambda ws: _preencher_resumo(ws, lote, lote_id, mapas_filtrados, nomes_unidades)
+		)
+
+	saida = Workbook(write_only=True)
+	saida.loaded_theme = modelo.workbook.loaded_theme
+	estilos = EstilosCompartilhados(saida)
+	precos = lote.get('precos', {}) if lote else {}
+	for ws_modelo in modelo.workbook.worksheets:
+		ws = saida.create_sheet(ws_modelo.title)
+		if ws_modelo is modelo.comparativo:
+			_escrever_comparativo(modelo, ws, estilos, lote_id, precos, itertools.chain([primeira], linhas))
+		else:
+			origem = resumo if ws_modelo is modelo.resumo else ws_modelo
+			_copiar_layout(origem, ws)
+			_copiar_linhas(origem, ws, estilos, origem.max_row)
+			_copiar_formatacao_condicional(origem, ws)
+
+	arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_ARQUIVO)
+	saida.save(arquivo)
+	arquivo.seek(0)
+	return arquivo
+
+def validar_periodo(data_inicio, data_fim):
+	"""O filtro de período (YYYY-MM-DD) só vale com as duas datas; ErroExportacao 400 se alguma for inválida."""
+	if data_inicio and data_fim:
+		try:
+			date.fromisoformat(data_inicio)
+			date.fromisoformat(data_fim)
+		except ValueError:
+			raise ErroExportacao("Período inválido: use datas no formato AAAA-MM-DD.", 400)
+
+def nome_arquivo_exportacao(lote_id, data_inicio, data_fim, extensao='xlsx'):
+	nome = f"tabela_lote_{lote_id}"
+	if data_inicio and data_fim:
+		nome += f"_{data_inicio}_a_{data_fim}"
+	return f"{nome}.{extensao}"
+
+def exportar_tabela_lote(lote_id, data_inicio=None, data_fim=None, unidades_list=None):
+	"""
+	Exportação de /exportar-tabela: carrega lote e mapas, aplica os filtros e gera
+	a planilha. Retorna (arquivo, nome_arquivo); ErroExportacao com status 400/404.
+	"""
+	# Import local: gerar_planilha roda também nos processos da exportação em massa,
+	# que importam este módulo sem carregar utils (e o Firebase)
+	from .utils import carregar_lotes, obter_mapas_do_lote, obter_unidades_do_lote, filtro_mapa
+	unidades_list = unidades_list or []
+	validar_periodo(data_inicio, data_fim)
+	lote = next((l for l in carregar_lotes() if l['id'] == lote_id), None)
+	mapas = obter_mapas_do_lote(lote_id)
+	mapas_filtrados = [m for m in mapas if filtro_mapa(m, lote_id, unidades_list, data_inicio, data_fim)]
+	nomes_unidades = unidades_list if unidades_list else obter_unidades_do_lote(lote_id)
+	arquivo = gerar_planilha(lote, lote_id, mapas_filtrados, nomes_unidades, unidades_list, data_inicio, data_fim)
+	return arquivo, nome_arquivo_exportacao(lote_id, data_inicio, data_fim)
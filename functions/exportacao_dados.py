@@ -0,0 +1,101 @@
+# Exportação dos dados brutos (CSV e Parquet), sem o modelo Excel, para ferramentas de análise
+import io
+import csv
+from datetime import date
+from .colunar import CAMPOS_REFEICOES, colunas_mapa
+from .exportacao import ErroExportacao, nome_arquivo_exportacao, validar_periodo
+from .utils import obter_mapas_do_lote, filtro_mapa, indices_no_periodo, ordinal_data_br
+
+FORMATOS_DADOS = ('csv', 'parquet')
+# O Flask acrescenta '; charset=utf-8' aos mimetypes text/*
+MIMETYPE_CSV = 'text/csv'
+MIMETYPE_PARQUET = 'application/vnd.apache.parquet'
+
+# Uma linha por unidade e dia; data em AAAA-MM-DD e n_siisp vazio quando o mapa não tem SIISP
+COLUNAS_DADOS = ('lote_id', 'nome_unidade', 'data', 'n_siisp') + CAMPOS_REFEICOES
+
+def _mapas_filtrados(lote_id, data_inicio, data_fim, unidades_list):
+	validar_periodo(data_inicio, data_fim)
+	mapas = [m for m in obter_mapas_do_lote(lote_id) if filtro_mapa(m, lote_id, unidades_list, data_inicio, data_fim)]
+	if not mapas:
+		raise ErroExportacao("Nenhum dado encontrado para os filtros selecionados.", 404)
+	return mapas
+
+def _dias_do_mapa(mapa, refeicoes, data_inicio, data_fim):
+	"""[(índice, data AAAA-MM-DD)] dos dias do mapa dentro do período e da matriz de refeições."""
+	periodo = indices_no_periodo(mapa, data_inicio, data_fim)
+	if not periodo:
+		return []
+	# Dia i = primeiro dia + i: só a primeira data é convertida
+	primeiro = ordinal_data_br(mapa['data'][0])
+	return [
+		(i, date.fromordinal(primeiro + i).isoformat())
+		for i in range(periodo.start, min(periodo.stop, refeicoes.shape[0]))
+	]
+
+def _gerar_csv(mapas, data_inicio, data_fim):
+	buffer = io.StringIO()
+	escritor = csv.writer(buffer)
+
+	def linha(valores):
+		escritor.writerow(valores)
+		texto = buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate()
+		return texto
+
+	yield linha(COLUNAS_DADOS)
+	for mapa in mapas:
+		refeicoes = colunas_mapa(mapa).refeicoes
+		n_siisp = mapa.get('n_siisp') or []
+		lote_id = mapa.get('lote_id')
+		unidade = mapa.get('nome_unidade')
+		for i, data_iso in _dias_do_mapa(mapa, refeicoes, data_inicio, data_fim):
+			siisp = n_siisp[i] if i < len(n_siisp) else ''
+			yield linha([lote_id, unidade, data_iso, siisp] + refeicoes[i].tolist())
+
+def exportar_csv_lote(lote_id, data_inicio=None, data_fim=None, unidades_list=None):
+	"""
+	(gerador de linhas CSV, nome_arquivo) para uma resposta em streaming: cada
+	linha é produzida ao ser enviada, sem montar o arquivo em memória.
+	"""
+	mapas = _mapas_filtrados(lote_id, data_inicio, data_fim, unidades_list or [])
+	return _gerar_csv(mapas, data_inicio, data_fim), nome_arquivo_exportacao(lote_id, data_inicio, data_fim, 'csv')
+
+def exportar_parquet_lote(lote_id, data_inicio=None, data_fim=None, unidades_list=None):
+	"""
+	(arquivo, nome_arquivo) em Parquet, montado a partir das matrizes de refeições
+	(functions/colunar.py) de cada mapa. Requer pandas e pyarrow.
+	"""
+	try:
+		import pandas as pd
+	except ImportError:
+		raise ErroExportacao("Exportação Parquet indisponível: instale pandas e pyarrow.", 501)
+	mapas = _mapas_filtrados(lote_id, data_inicio, data_fim, unidades_list or [])
+
+	partes = []
+	for mapa in mapas:
+		refeicoes = colunas_mapa(mapa).refeicoes
+		dias = _dias_do_mapa(mapa, refeicoes, data_inicio, data_fim)
+		if not dias:
+			continue
+		indices = [i for i, _ in dias]
+		n_siisp = mapa.get('n_siisp') or []
+		parte = pd.DataFrame(refeicoes[indices], columns=list(CAMPOS_REFEICOES))
+		parte.insert(0, 'lote_id', mapa.get('lote_id'))
+		parte.insert(1, 'nome_unidade', mapa.get('nome_unidade'))
+		parte.insert(2, 'data', pd.to_datetime([d for _, d in dias]))
+		parte.insert(3, 'n_siisp', pd.array([n_siisp[i] if i < len(n_siisp) else None for i in indices], dtype='Int32'))
+		partes.append(parte)
+	if partes:
+		dados = pd.concat(partes, ignore_index=True)
+	else:
+		dados = pd.DataFrame(columns=list(COLUNAS_DADOS))
+
+	arquivo = io.BytesIO()
+	try:
+		dados.to_parquet(arquivo, index=False)
+	except ImportError:
+		raise ErroExportacao("Exportação Parquet indisponível: instale pyarrow.", 501)
+	arquivo.seek(0)
+	return arquivo, nome_arquivo_exportacao(lote_id, data_inicio, data_fim, 'parquet')
@@ -0,0 +1,107 @@
+# Exportação em massa (fechamento mensal): vários lotes e meses num único arquivo ZIP
+import calendar
+import zipfile
+import tempfile
+from datetime import date
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from .exportacao import ErroExportacao, LIMITE_MEMORIA_ARQUIVO, nome_arquivo_exportacao
+from .processos_exportacao import gerar_arquivo, novo_pool, pool_compartilhado, descartar_pool
+from .utils import carregar_lotes, obter_mapas_do_lote, obter_unidades_do_lote, filtro_mapa
+
+MIMETYPE_ZIP = 'application/zip'
+
+def meses_do_periodo(data_inicio, data_fim):
+	"""[(ano, mes, inicio, fim)] de cada mês entre as datas YYYY-MM-DD, com o primeiro e o último mês recortados."""
+	try:
+		inicio = date.fromisoformat(data_inicio)
+		fim = date.fromisoformat(data_fim)
+	except (TypeError, ValueError):
+		raise ErroExportacao("Período inválido: informe data_inicio e data_fim no formato AAAA-MM-DD.", 400)
+	if inicio > fim:
+		raise ErroExportacao("data_inicio deve ser anterior ou igual a data_fim.", 400)
+	meses = []
+	ano, mes = inicio.year, inicio.month
+	while (ano, mes) <= (fim.year, fim.month):
+		primeiro = max(inicio, date(ano, mes, 1))
+		ultimo = min(fim, date(ano, mes, calendar.monthrange(ano, mes)[1]))
+		meses.append((ano, mes, primeiro.isoformat(), ultimo.isoformat()))
+		ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+	return meses
+
+def preparar_exportacoes(lote_ids, data_inicio, data_fim):
+	"""
+	Carrega lotes, unidades e mapas uma única vez, no processo principal, e monta
+	um pedido por lote e mês com dados: (caminho no ZIP, argumentos de gerar_planilha).
+	Cada planilha cobre um só mês, para o cabeçalho da RESUMO (mês/ano) ser o dela.
+	"""
+	meses = meses_do_periodo(data_inicio, data_fim)
+	lotes = {l['id']: l for l in carregar_lotes()}
+	if not lote_ids:
+		lote_ids = sorted(lotes)
+	pedidos = []
+	for lote_id in lote_ids:
+		lote = lotes.get(lote_id)
+		if lote is None:
+			raise ErroExportacao(f"Lote {lote_id} não encontrado.", 404)
+		mapas = obter_mapas_do_lote(lote_id)
+		nomes_unidades = obter_unidades_do_lote(lote_id)
+		for ano, mes, inicio, fim in meses:
+			mapas_mes = [
+				m for m in mapas
+				if m.get('ano') == ano and m.get('mes') == mes and filtro_mapa(m, lote_id, [], inicio, fim)
+			]
+			if mapas_mes:
+				caminho = f"lote_{lote_id}/{nome_arquivo_exportacao(lote_id, inicio, fim)}"
+				pedidos.append((caminho, (lote, lote_id, mapas_mes, nomes_unidades, [], inicio, fim)))
+	return pedidos
+
+def nome_zip_exportacao(data_inicio, data_fim):
+	return f"exportacao_lotes_{data_inicio}_a_{data_fim}.zip"
+
+def exportar_lotes_zip(lote_ids, data_inicio, data_fim, max_processos=None):
+	"""
+	Gera as planilhas (lote × mês) em paralelo nos processos de functions/processos_exportacao.py
+	e as grava num ZIP à medida que ficam prontas. Sem lote_ids, exporta todos os lotes.
+	Sem max_processos, usa o pool compartilhado do servidor; com ele (linha de comando),
+	um pool próprio desse tamanho.
+	Retorna (arquivo, nome_arquivo, quantidade de planilhas); ErroExportacao com status 400/404.
+	"""
+	pedidos = preparar_exportacoes(lote_ids, data_inicio, data_fim)
+	if not pedidos:
+		raise ErroExportacao("Nenhum dado encontrado para os lotes e o período selecionados.", 404)
+
+	proprio = max_processos is not None
+	pool = novo_pool(min(max_processos, len(pedidos))) if proprio else pool_compartilhado()
+	arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_ARQUIVO)
+	futuros = {}
+	geradas = 0
+	try:
+		# .xlsx já é compactado: ZIP_STORED só agrupa os arquivos
+		with zipfile.ZipFile(arquivo, 'w', zipfile.ZIP_STORED) as zf:
+			futuros = {pool.submit(gerar_arquivo, *args): caminho for caminho, args in pedidos}
+			for futuro in as_completed(futuros):
+				conteudo = futuro.result()
+				if conteudo is None:
+					continue
+				zf.writestr(futuros[futuro], conteudo)
+				geradas += 1
+	except BaseException as e:
+		# O erro volta na hora: as planilhas que faltam são canceladas, sem esperar as que estão rodando
+		if proprio:
+			pool.shutdown(wait=False, cancel_futures=True)
+		else:
+			for futuro in futuros:
+				futuro.cancel()
+			if isinstance(e, BrokenProcessPool):
+				descartar_pool(pool)
+		arquivo.close()
+		raise
+	if proprio:
+		pool.shutdown()
+	if not geradas:
+		arquivo.close()
+		raise ErroExportacao("Nenhum dado SIISP encontrado para os lotes e o período selecionados.", 404)
+	arquivo.seek(0)
+	print(f"📦 Exportação em massa: {geradas} planilhas ({data_inicio} a {data_fim})")
+	return arquivo, nome_zip_exportacao(data_inicio, data_fim), geradas
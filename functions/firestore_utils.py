@@ -1,42 +1,166 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
 import os
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore import transactional
 
-# Inicialização do Firebase (garante que só inicializa uma vez)
-if not firebase_admin._apps:
-    BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    DADOS_DIR = os.path.join(BASE_DIR, 'dados')
-    cred_path = os.path.join(DADOS_DIR, "serviceAccountKey.json")
-    cred = credentials.Certificate(cred_path)
-    firebase_admin.initialize_app(cred)
+if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+    # Emulador local do Firestore (desenvolvimento e testes): dispensa a chave de serviço
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore as cloud_firestore
+    db = cloud_firestore.Client(
+        project=os.environ.get('GCLOUD_PROJECT', 'sgmrp-local'),
+        credentials=AnonymousCredentials()
+    )
+else:
+    # Inicialização do Firebase (garante que só inicializa uma vez)
+    if not firebase_admin._apps:
+        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        DADOS_DIR = os.path.join(BASE_DIR, 'dados')
+        cred_path = os.path.join(DADOS_DIR, "serviceAccountKey.json")
+        cred = credentials.Certificate(cred_path)
+        firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+    db = firestore.client()
+
+# Operações por WriteBatch (limite do Firestore)
+LIMITE_LOTE = 500
+
+# Lotes enviados ao mesmo tempo por gravar_em_massa
+MAX_LOTES_PARALELOS = int(os.environ.get('SGMRP_FIRESTORE_LOTES_PARALELOS', 4))
+
+# Coleção dos contadores de sequência (ex.: contadores/usuarios guarda o último id de usuário)
+COLECAO_CONTADORES = 'contadores'
+
+def _documento_para_dict(doc):
+    # O campo 'id' gravado no documento (ex.: id inteiro do usuário) prevalece sobre o id do documento
+    return {'id': doc.id} | doc.to_dict() | {'firestore_id': doc.id}
 
 def carregar_firestore(nome_colecao):
     """
     Carrega todos os documentos de uma coleção do Firestore e retorna como lista de dicts (JSON).
+    O id do documento vem em 'firestore_id' (e em 'id' só se o documento não tiver esse campo).
     """
     colecao_ref = db.collection(nome_colecao)
-    return [doc.to_dict() | {'id': doc.id} for doc in colecao_ref.stream()]
+    return [_documento_para_dict(doc) for doc in colecao_ref.stream()]
+
+def buscar_firestore(nome_colecao, campo, valor, limite=1):
+    """
+    Consulta indexada por igualdade (campo == valor), lendo no máximo 'limite'
+    documentos. Retorna lista de dicts no mesmo formato de carregar_firestore.
+    """
+    consulta = db.collection(nome_colecao).where(campo, '==', valor).limit(limite)
+    return [_documento_para_dict(doc) for doc in consulta.stream()]
+
+def _enviar_lote(colecao_ref, operacoes):
+    """Envia um WriteBatch; devolve a mensagem de erro (o lote inteiro falha junto) ou None."""
+    lote = db.batch()
+    for doc_id, dados in operacoes:
+        doc_ref = colecao_ref.document(doc_id)
+        if dados is None:
+            lote.delete(doc_ref)
+        else:
+            lote.set(doc_ref, dados)
+    try:
+        lote.commit()
+    except Exception as e:
+        return str(e)
+    return None
+
+def gravar_em_massa(nome_colecao, gravacoes=(), exclusoes=(), max_paralelos=MAX_LOTES_PARALELOS):
+    """
+    Grava e exclui documentos da coleção em WriteBatch de até LIMITE_LOTE
+    operações (um round trip por lote), com até max_paralelos lotes enviados ao
+    mesmo tempo numa pool de threads.
+    gravacoes: lista de (doc_id, dados), com doc_id None para gerar um id automático;
+    exclusoes: lista de doc_ids.
+    Retorna, na ordem das operações, [{'id': doc_id, 'erro': None ou mensagem}].
+    """
+    colecao_ref = db.collection(nome_colecao)
+    operacoes = [(doc_id or colecao_ref.document().id, dados) for doc_id, dados in gravacoes]
+    operacoes += [(doc_id, None) for doc_id in exclusoes]
+    lotes = [operacoes[inicio:inicio + LIMITE_LOTE] for inicio in range(0, len(operacoes), LIMITE_LOTE)]
+    if len(lotes) > 1 and max_paralelos > 1:
+        with ThreadPoolExecutor(max_workers=min(max_paralelos, len(lotes)), thread_name_prefix='firestore') as pool:
+            erros = list(pool.map(lambda lote: _enviar_lote(colecao_ref, lote), lotes))
+    else:
+        erros = [_enviar_lote(colecao_ref, lote) for lote in lotes]
+    return [
+        {'id': doc_id, 'erro': erro}
+        for lote, erro in zip(lotes, erros)
+        for doc_id, _ in lote
+    ]
 
 def salvar_firestore(nome_colecao, dados):
     """
     Salva um documento na coleção do Firestore.
-    Se 'dados' for uma lista, salva cada item como documento separado.
+    Se 'dados' for uma lista, salva cada item como documento separado (em lotes, ver gravar_em_massa).
     Se 'dados' for dict, salva como um único documento (gera id automático).
     Retorna lista de ids dos documentos salvos.
     """
-    colecao_ref = db.collection(nome_colecao)
-    ids = []
     if isinstance(dados, list):
-        for item in dados:
-            doc_ref = colecao_ref.document()
-            doc_ref.set(item)
-            ids.append(doc_ref.id)
+        itens = dados
     elif isinstance(dados, dict):
-        doc_ref = colecao_ref.document()
-        doc_ref.set(dados)
-        ids.append(doc_ref.id)
+        itens = [dados]
     else:
         raise ValueError("Dados devem ser dict ou lista de dicts")
-    return ids
+    resultados = gravar_em_massa(nome_colecao, [(None, item) for item in itens])
+    erros = [r for r in resultados if r['erro'] is not None]
+    if erros:
+        print(f"❌ Erro ao salvar {len(erros)} documentos em {nome_colecao}: {erros[0]['erro']}")
+    return [r['id'] for r in resultados if r['erro'] is None]
+
+@transactional
+def _incrementar_contador(transacao, contador_ref):
+    snapshot = contador_ref.get(transaction=transacao)
+    if not snapshot.exists:
+        return None
+    valor = snapshot.get('valor') + 1
+    transacao.update(contador_ref, {'valor': valor})
+    return valor
+
+def proximo_valor_contador(nome, valor_inicial=0):
+    """
+    Incrementa o contador contadores/<nome> numa transação e devolve o novo valor:
+    chamadas simultâneas (inclusive de outros processos) nunca recebem o mesmo valor.
+    valor_inicial (ou função que o calcula) é usado só na criação do contador.
+    """
+    contador_ref = db.collection(COLECAO_CONTADORES).document(nome)
+    valor = _incrementar_contador(db.transaction(), contador_ref)
+    if valor is None:
+        inicial = valor_inicial() if callable(valor_inicial) else valor_inicial
+        try:
+            contador_ref.create({'valor': inicial})
+        except AlreadyExists:
+            # Outro processo criou o contador primeiro
+            pass
+        valor = _incrementar_contador(db.transaction(), contador_ref)
+    return valor
+
+@transactional
+def _elevar_contador(transacao, contador_ref, minimo):
+    snapshot = contador_ref.get(transaction=transacao)
+    if not snapshot.exists:
+        transacao.set(contador_ref, {'valor': minimo})
+    elif snapshot.get('valor') < minimo:
+        transacao.update(contador_ref, {'valor': minimo})
+
+def elevar_valor_contador(nome, minimo):
+    """
+    Garante, numa transação, que o contador contadores/<nome> valha pelo menos
+    'minimo' (ex.: depois de gravar registros com ids escolhidos fora do contador).
+    """
+    _elevar_contador(db.transaction(), db.collection(COLECAO_CONTADORES).document(nome), minimo)
+
+def criar_firestore(nome_colecao, doc_id, dados):
+    """
+    Cria o documento doc_id na coleção, sem nunca sobrescrever um existente.
+    Retorna False se o documento já existe.
+    """
+    try:
+        db.collection(nome_colecao).document(doc_id).create(dados)
+    except AlreadyExists:
+        return False
+    return True
+
@@ -0,0 +1,169 @@
+# Formato compacto dos mapas em disco (schema 2) e leitura transparente dos registros antigos
+import base64
+import calendar
+from functools import lru_cache
+import numpy as np
+from .colunar import CAMPOS_REFEICOES, CAMPOS_SIISP, diferencas_siisp
+
+# Colunas diárias gravadas como int32 little-endian em base64, dentro de registro['colunas']
+CAMPOS_COMPACTOS = CAMPOS_REFEICOES + ('n_siisp',)
+_INT32 = np.dtype('<i4')
+
+@lru_cache(maxsize=256)
+def _datas_do_mes(mes, ano):
+	# Mesmo formato de utils.gerar_datas_do_mes (DD/MM/AAAA, todos os dias do mês)
+	return tuple(f"{dia:02d}/{mes:02d}/{ano}" for dia in range(1, calendar.monthrange(ano, mes)[1] + 1))
+
+def datas_do_mes(mes, ano):
+	"""Lista das datas do mês, ou None se mês/ano não são válidos."""
+	try:
+		return list(_datas_do_mes(int(mes), int(ano)))
+	except (TypeError, ValueError, calendar.IllegalMonthError):
+		return None
+
+def _empacotar(valores):
+	"""Lista de inteiros int32 -> base64; None se a lista tiver outro tipo de valor (fica como lista)."""
+	if not isinstance(valores, list) or not all(type(v) is int for v in valores):
+		return None
+	try:
+		vetor = np.array(valores, dtype=np.int64)
+	except OverflowError:
+		return None
+	if vetor.size and (vetor.min() < np.iinfo(_INT32).min or vetor.max() > np.iinfo(_INT32).max):
+		return None
+	return base64.b64encode(vetor.astype(_INT32).tobytes()).decode('ascii')
+
+def _desempacotar(texto):
+	return np.frombuffer(base64.b64decode(texto), dtype=_INT32).tolist()
+
+def compactar_registro(mapa):
+	"""
+	Registro para gravação no schema 2: colunas diárias empacotadas em 'colunas' e,
+	quando idênticas ao que seria recalculado, sem 'data' e sem as colunas *_siisp.
+	Valores fora do padrão continuam gravados como estão (sem perda).
+	"""
+	if 'colunas' in mapa:
+		return mapa
+	registro = {}
+	colunas = {}
+	for chave, valor in mapa.items():
+		if chave in CAMPOS_COMPACTOS:
+			empacotado = _empacotar(valor)
+			if empacotado is not None:
+				colunas[chave] = empacotado
+				continue
+		registro[chave] = valor
+	if registro.get('data') == datas_do_mes(mapa.get('mes'), mapa.get('ano')):
+		del registro['data']
+	derivadas = diferencas_siisp(mapa)
+	for campo_siisp in CAMPOS_SIISP:
+		if campo_siisp in registro and registro[campo_siisp] == derivadas.get(campo_siisp):
+			del registro[campo_siisp]
+	registro['colunas'] = colunas
+	return registro
+
+def ler_registro(registro):
+	"""Registro lido do disco: os do schema 2 viram MapaCompacto; os antigos (listas completas) passam direto."""
+	if 'colunas' not in registro:
+		return registro
+	mapa = MapaCompacto((chave, valor) for chave, valor in registro.items() if chave != 'colunas')
+	for campo, texto in registro['colunas'].items():
+		dict.__setitem__(mapa, campo, _desempacotar(texto))
+	return mapa
+
+class MapaCompacto(dict):
+	"""
+	Mapa lido do schema 2. 'data' e as colunas *_siisp não gravadas são recalculadas
+	no primeiro acesso a elas: 'data' sozinha (listagens e filtros por período não
+	calculam diferenças), as *_siisp a partir da matriz em cache de colunas_mapa.
+	Uma visão completa do dict (iteração, items(), cópia, JSON, pickle) completa
+	tudo. Como os demais mapas do repositório, não deve ser alterado no lugar.
+	"""
+	__slots__ = ('_com_datas', '_com_siisp')
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self._com_datas = False
+		self._com_siisp = False
+
+	def _completar_datas(self):
+		if not dict.__contains__(self, 'data'):
+			datas = datas_do_mes(dict.get(self, 'mes'), dict.get(self, 'ano'))
+			if datas is not None:
+				dict.setdefault(self, 'data', datas)
+		self._com_datas = True
+
+	def _completar_siisp(self):
+		for campo_siisp, valores in diferencas_siisp(self).items():
+			dict.setdefault(self, campo_siisp, valores)
+		self._com_siisp = True
+
+	def _completar(self):
+		if not self._com_datas:
+			self._completar_datas()
+		if not self._com_siisp:
+			self._completar_siisp()
+
+	def _completar_chave(self, chave):
+		if dict.__contains__(self, chave):
+			return
+		if chave == 'data':
+			if not self._com_datas:
+				self._completar_datas()
+		elif chave in CAMPOS_SIISP and not self._com_siisp:
+			self._completar_siisp()
+
+	def __getitem__(self, chave):
+		self._completar_chave(chave)
+		return dict.__getitem__(self, chave)
+
+	def get(self, chave, padrao=None):
+		self._completar_chave(chave)
+		return dict.get(self, chave, padrao)
+
+	def __contains__(self, chave):
+		self._completar_chave(chave)
+		return dict.__contains__(self, chave)
+
+	def __iter__(self):
+		self._completar()
+		return dict.__iter__(self)
+
+	def __len__(self):
+		self._completar()
+		return dict.__len__(self)
+
+	def keys(self):
+		self._completar()
+		return dict.keys(self)
+
+	def values(self):
+		self._completar()
+		return dict.values(self)
+
+	def items(self):
+		self._completar()
+		return dict.items(self)
+
+	def copy(self):
+		self._completar()
+		return dict(dict.items(self))
+
+	def __eq__(self, outro):
+		self._completar()
+		if isinstance(outro, MapaCompacto):
+			outro._completar()
+		return dict.__eq__(self, outro)
+
+	def __ne__(self, outro):
+		return not self == outro
+
+	__hash__ = None
+
+	def __repr__(self):
+		self._completar()
+		return dict.__repr__(self)
+
+	def __reduce__(self):
+		# Pickle (ex.: pool de processos) recebe um dict comum, já completo
+		return (dict, (self.copy(),))
@@ -0,0 +1,102 @@
+# Indicadores (KPIs) dos lotes exibidos na página /lotes
+from .colunar import vetor_precos
+from .resumos import resumos_mapas, somar_resumos, valores_resumo, resumir_mapa
+
+def agrupar_mapas_por_lote(mapas):
+	"""Uma única passada sobre os mapas: {lote_id: [mapas]}."""
+	por_lote = {}
+	for mapa in mapas:
+		por_lote.setdefault(mapa.get('lote_id'), []).append(mapa)
+	return por_lote
+
+def indicadores_lote(lote, resumos_lote):
+	"""
+	KPIs de um lote a partir dos resumos dos seus mapas (functions/resumos.py):
+	meses_cadastrados, desvio_mes, conformidade, refeicoes_mes e custo_mes.
+	Valores mensais são médias sobre os meses (MM/AAAA) distintos com mapa.
+	"""
+	meses_distintos = set()
+	for resumo in resumos_lote:
+		mes = resumo.mes
+		ano = resumo.ano
+		if mes and ano:
+			meses_distintos.add((ano, mes))
+	n_meses = len(meses_distintos)
+
+	totais, excedentes = somar_resumos(resumos_lote)
+	valor_total, valor_desvio, conformidade = valores_resumo(totais, excedentes, vetor_precos(lote.get('precos', {})))
+	total_refeicoes = int(totais.sum())
+
+	return {
+		'meses_cadastrados': n_meses,
+		'desvio_mes': round(valor_desvio / n_meses, 2) if n_meses else 0,
+		'conformidade': conformidade if conformidade is not None else 'N/A',
+		'refeicoes_mes': int(total_refeicoes / n_meses) if n_meses else 0,
+		'custo_mes': round(valor_total / n_meses, 2) if n_meses else 0
+	}
+
+def calcular_indicadores_lotes(lotes, mapas=None):
+	"""
+	Calcula os KPIs de todos os lotes de uma vez e os grava em cada dict de lote.
+	Sem mapas informados, usa os resumos materializados (uma linha por mapa);
+	com mapas, resume-os e agrupa por lote numa única passada.
+	"""
+	if mapas is None:
+		por_lote = resumos_mapas.por_lote()
+	else:
+		por_lote = {
+			lote_id: [resumir_mapa(m) for m in mapas_lote]
+			for lote_id, mapas_lote in agrupar_mapas_por_lote(mapas).items()
+		}
+	for lote in lotes:
+		lote.update(indicadores_lote(lote, por_lote.get(lote.get('id'), [])))
+	return lotes
+
+def resumo_dashboard(lotes, mes=None, ano=None, lote_id=None):
+	"""
+	Números do dashboard para o período/lote filtrado: resumo geral e um item
+	por lote (cards). Soma apenas as linhas de resumo dos mapas (uma por
+	lote/unidade/mês), sem percorrer os valores diários.
+	"""
+	por_lote = {}
+	for resumo in resumos_mapas.listar(lote_id):
+		if mes is not None and resumo.mes != mes:
+			continue
+		if ano is not None and resumo.ano != ano:
+			continue
+		por_lote.setdefault(resumo.lote_id, []).append(resumo)
+
+	itens = []
+	valor_total_geral = 0.0
+	valor_desvio_geral = 0.0
+	for lote in lotes:
+		resumos_lote = por_lote.get(lote.get('id'), [])
+		totais, excedentes = somar_resumos(resumos_lote)
+		valor_total, valor_desvio, conformidade = valores_resumo(totais, excedentes, vetor_precos(lote.get('precos', {})))
+		valor_total_geral += valor_total
+		valor_desvio_geral += valor_desvio
+		itens.append({
+			'lote_id': lote.get('id'),
+			'unidades': len(lote.get('unidades', [])),
+			'refeicoes': int(totais.sum()),
+			'discrepancias': sum(int(r.discrepancias.sum()) for r in resumos_lote),
+			'conformidade': conformidade if conformidade is not None else 0.0
+		})
+
+	if lote_id is not None:
+		unidades = sum(i['unidades'] for i in itens if i['lote_id'] == lote_id)
+	else:
+		unidades = sum(i['unidades'] for i in itens)
+	if valor_total_geral > 0:
+		conformidade_geral = round(max(0, (valor_total_geral - valor_desvio_geral) / valor_total_geral * 100), 1)
+	else:
+		conformidade_geral = 0.0
+	return {
+		'resumo': {
+			'unidades': unidades,
+			'refeicoes': sum(i['refeicoes'] for i in itens),
+			'discrepancias': sum(i['discrepancias'] for i in itens),
+			'conformidade': conformidade_geral
+		},
+		'lotes': itens
+	}
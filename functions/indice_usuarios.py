@@ -0,0 +1,98 @@
+# Índice em memória dos campos únicos de usuários (validação do cadastro sem ler a coleção)
+import os
+import time
+import threading
+from .firestore_utils import carregar_firestore
+
+# Recarga completa a partir do Firestore depois deste tempo (segundos): traz os
+# cadastros feitos por outros workers, que não passam por este processo
+TTL_INDICE_USUARIOS = float(os.environ.get('SGMRP_INDICE_USUARIOS_TTL', 60))
+
+def _minusculas(valor):
+	return str(valor or '').strip().lower()
+
+def _sem_espacos(valor):
+	return str(valor or '').strip()
+
+# Campo -> normalização (a mesma de adicionar_usuario)
+CAMPOS_UNICOS = {
+	'email': _minusculas,
+	'cpf': _sem_espacos,
+	'usuario': _minusculas,
+	'matricula': _sem_espacos,
+	'telefone': _sem_espacos
+}
+
+class IndiceUsuarios:
+	"""
+	Para cada campo de CAMPOS_UNICOS, valor normalizado -> ids dos usuários que o
+	usam. Carregado da coleção 'usuarios' na primeira consulta e recarregado a cada
+	TTL_INDICE_USUARIOS segundos; cadastros e alterações deste processo entram
+	na hora (registrar).
+	"""
+
+	def __init__(self, ttl=TTL_INDICE_USUARIOS):
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._valores = None
+		self._por_id = {}
+		self._carregado_em = 0.0
+
+	def _garantir_carregado(self):
+		"""Chamar com o lock."""
+		if self._valores is not None and time.monotonic() - self._carregado_em < self.ttl:
+			return
+		usuarios = carregar_firestore('usuarios')
+		self._valores = {campo: {} for campo in CAMPOS_UNICOS}
+		self._por_id = {}
+		for usuario in usuarios:
+			self._incluir(usuario)
+		self._carregado_em = time.monotonic()
+
+	def _incluir(self, usuario):
+		id_usuario = usuario.get('id')
+		chaves = {}
+		for campo, normalizar in CAMPOS_UNICOS.items():
+			valor = normalizar(usuario.get(campo))
+			if valor:
+				self._valores[campo].setdefault(valor, set()).add(id_usuario)
+				chaves[campo] = valor
+		self._por_id[id_usuario] = chaves
+
+	def _retirar(self, id_usuario):
+		for campo, valor in self._por_id.pop(id_usuario, {}).items():
+			ids = self._valores[campo].get(valor)
+			if ids is not None:
+				ids.discard(id_usuario)
+				if not ids:
+					del self._valores[campo][valor]
+
+	def existe(self, campo, valor, ignorar_id=None):
+		"""True se outro usuário (id diferente de ignorar_id) já usa o valor no campo."""
+		normalizar = CAMPOS_UNICOS.get(campo)
+		if normalizar is None:
+			return False
+		valor = normalizar(valor)
+		if not valor:
+			return False
+		with self._lock:
+			self._garantir_carregado()
+			ids = self._valores[campo].get(valor, ())
+			return any(id_usuario != ignorar_id for id_usuario in ids)
+
+	def registrar(self, usuario):
+		"""Inclui ou atualiza um usuário (com o 'id' do documento) no índice já carregado."""
+		with self._lock:
+			if self._valores is None:
+				return
+			self._retirar(usuario.get('id'))
+			self._incluir(usuario)
+
+	def invalidar(self):
+		"""Força a recarga completa na próxima consulta."""
+		with self._lock:
+			self._valores = None
+			self._por_id = {}
+
+# Instância única do processo
+indice_usuarios = IndiceUsuarios()
@@ -0,0 +1,83 @@
+# Migrações versionadas do arquivo mapas.json
+from .utils import carregar_dados_json, salvar_dados_json, calcular_colunas_siisp
+from .arquivos import bloqueio_arquivo
+from .repositorio_mapas import VERSAO_SCHEMA_MAPAS, RepositorioMapas
+from .formato_mapas import compactar_registro, ler_registro
+
+def _migracao_colunas_siisp(dados):
+	"""
+	Versão 1: calcula uma única vez as colunas *_siisp de todos os mapas
+	(antes eram recalculadas em toda leitura por carregar_mapas).
+	"""
+	for mapa in dados.get('mapas', []):
+		calcular_colunas_siisp(mapa)
+
+def _migracao_formato_compacto(dados):
+	"""
+	Versão 2: grava as colunas diárias empacotadas (functions/formato_mapas.py),
+	sem 'data' e sem as colunas *_siisp quando são as recalculáveis.
+	"""
+	dados['mapas'] = [compactar_registro(mapa) for mapa in dados.get('mapas', [])]
+
+# (versão de destino, função) em ordem crescente
+MIGRACOES_MAPAS = [
+	(1, _migracao_colunas_siisp),
+	(2, _migracao_formato_compacto),
+]
+
+def _aplicar_migracoes(dados, versao):
+	# As migrações recebem os mapas completos, mesmo que o journal já tenha gravado registros compactos
+	dados['mapas'] = [ler_registro(mapa) for mapa in dados.get('mapas', [])]
+	for destino, migracao in MIGRACOES_MAPAS:
+		if versao < destino:
+			print(f"🔄 Migrando mapas.json: versão {versao} → {destino}...")
+			migracao(dados)
+			versao = destino
+	return versao
+
+def migrar_mapas():
+	"""
+	Aplica em mapas.json as migrações ainda não executadas e grava a nova versão.
+	Deve rodar na inicialização ou via `flask --app main migrar-dados`, nunca numa requisição.
+	"""
+	# Consolida o journal no snapshot antes de migrar o arquivo
+	RepositorioMapas().compactar()
+	with bloqueio_arquivo('mapas.json'):
+		dados = carregar_dados_json('mapas.json')
+		if not dados:
+			print("ℹ️ mapas.json inexistente ou vazio - nada para migrar")
+			return True
+		versao = dados.get('versao_schema', 0)
+		if versao >= VERSAO_SCHEMA_MAPAS:
+			print(f"ℹ️ mapas.json já está na versão {versao} do schema")
+			return True
+		versao = _aplicar_migracoes(dados, versao)
+		dados['versao_schema'] = versao
+		if salvar_dados_json('mapas.json', dados):
+			print(f"✅ mapas.json migrado para a versão {versao} do schema")
+			return True
+		print("❌ Erro ao salvar mapas.json migrado")
+		return False
+
+def importar_json_para_sqlite():
+	"""
+	Importação única de dados/mapas.json, lotes.json e unidades.json para dados/sgmrp.db.
+	Os mapas são migrados em memória para a versão atual do schema antes da gravação.
+	"""
+	from .repositorio_sqlite import RepositorioMapasSQLite
+	RepositorioMapas().compactar()
+	dados_mapas = carregar_dados_json('mapas.json')
+	versao = dados_mapas.get('versao_schema', 0)
+	_aplicar_migracoes(dados_mapas, versao)
+	mapas = dados_mapas.get('mapas', [])
+	lotes = carregar_dados_json('lotes.json').get('lotes', [])
+	unidades = carregar_dados_json('unidades.json').get('unidades', [])
+	repositorio = RepositorioMapasSQLite()
+	print(f"🔄 Importando {len(mapas)} mapas, {len(lotes)} lotes e {len(unidades)} unidades para {repositorio.caminho}...")
+	try:
+		repositorio.importar(mapas, lotes, unidades)
+	except Exception as e:
+		print(f"❌ Erro na importação para SQLite: {e}")
+		return False
+	print("✅ Importação concluída. Defina SGMRP_BACKEND=sqlite para usar o banco.")
+	return True
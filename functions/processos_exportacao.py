@@ -0,0 +1,55 @@
+# Processos que geram as planilhas da exportação em massa (functions/exportacao_lotes.py).
+# Este módulo é o que os processos filhos importam: só depende de functions.exportacao,
+# sem functions.utils, então os filhos não inicializam o Firebase nem carregam os mapas.
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from .exportacao import ErroExportacao, carregar_modelo, gerar_planilha
+
+# Processos do pool compartilhado por todas as exportações do servidor
+MAX_PROCESSOS = int(os.environ.get('SGMRP_EXPORT_PROCESSES', os.cpu_count() or 2))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _iniciar_processo():
+	# Modelo analisado uma vez por processo e reaproveitado por todas as planilhas que ele gerar
+	carregar_modelo()
+
+def gerar_arquivo(*args):
+	"""Executada nos processos do pool: a planilha em bytes, ou None quando não há dados SIISP."""
+	try:
+		arquivo = gerar_planilha(*args)
+	except ErroExportacao as e:
+		if e.status == 404:
+			return None
+		raise
+	with arquivo:
+		return arquivo.read()
+
+def novo_pool(max_processos):
+	# 'spawn': o processo do servidor tem várias threads (e locks), que um fork copiaria no meio do uso
+	return ProcessPoolExecutor(
+		max_workers=max(1, max_processos), mp_context=multiprocessing.get_context('spawn'),
+		initializer=_iniciar_processo
+	)
+
+def pool_compartilhado():
+	"""
+	Pool único do processo, criado no primeiro uso com MAX_PROCESSOS processos:
+	exportações simultâneas dividem os mesmos processos em vez de criar os seus.
+	"""
+	global _pool
+	with _pool_lock:
+		if _pool is None:
+			_pool = novo_pool(MAX_PROCESSOS)
+		return _pool
+
+def descartar_pool(pool):
+	"""Troca o pool compartilhado na próxima exportação (ex.: um processo filho morreu: BrokenProcessPool)."""
+	global _pool
+	with _pool_lock:
+		if _pool is pool:
+			_pool = None
+	pool.shutdown(wait=False, cancel_futures=True)
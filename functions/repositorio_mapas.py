@@ -0,0 +1,342 @@
+# Repositório em memória dos mapas de refeições (mapas.json)
+import os
+import json
+import threading
+from .arquivos import caminho_dados, ler_json, gravar_json, bloqueio_arquivo
+from .formato_mapas import compactar_registro, ler_registro
+
+# Versão atual do schema de mapas.json (ver functions/migracoes.py)
+VERSAO_SCHEMA_MAPAS = 2
+
+# Armazenamento dos dados de domínio: 'json' (dados/*.json) ou 'sqlite' (dados/sgmrp.db)
+BACKEND = os.environ.get('SGMRP_BACKEND', 'json').strip().lower()
+
+# Tamanho do journal que dispara a compactação em segundo plano
+LIMITE_JOURNAL_BYTES = int(os.environ.get('SGMRP_JOURNAL_MAX_BYTES', 4 * 1024 * 1024))
+
+def _assinatura_arquivo(caminho):
+	try:
+		st = os.stat(caminho)
+	except FileNotFoundError:
+		return None
+	return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def chave_mapa(lote_id, ano, mes, nome_unidade):
+	"""Chave primária de um mapa: um registro por lote/ano/mês/unidade."""
+	return (lote_id, ano, mes, nome_unidade)
+
+def _chave_do_registro(mapa):
+	return chave_mapa(mapa.get('lote_id'), mapa.get('ano'), mapa.get('mes'), mapa.get('nome_unidade'))
+
+class RepositorioMapas:
+	"""
+	Mantém os mapas em memória, indexados pela chave (lote_id, ano, mes, nome_unidade)
+	e por lote.
+
+	Em disco, os dados ficam num snapshot (mapas.json) mais um journal de operações
+	(mapas.journal.jsonl, uma linha JSON por upsert/exclusão). Cada gravação só
+	acrescenta uma linha ao journal; quando ele passa de LIMITE_JOURNAL_BYTES, uma
+	thread em segundo plano consolida tudo num novo snapshot (compactar()).
+	A leitura reaplica o journal sobre o snapshot; gravações de outros processos
+	são acompanhadas lendo apenas as linhas novas do journal.
+
+	Os dicionários de mapa devolvidos são compartilhados entre requisições e não
+	devem ser alterados: para modificar um mapa, copie-o e use salvar_mapa().
+	"""
+	backend = 'json'
+
+	def __init__(self, arquivo='mapas.json'):
+		self.arquivo = arquivo
+		self.caminho = caminho_dados(arquivo)
+		self.caminho_journal = caminho_dados(os.path.splitext(arquivo)[0] + '.journal.jsonl')
+		self._lock = threading.RLock()
+		self._carregado = False
+		self._assinatura = None
+		self._versao_schema = VERSAO_SCHEMA_MAPAS
+		self._indice = {}
+		self._por_lote = {}
+		self._maior_id = 0
+		self._lista = None
+		self._offset_journal = 0
+		self._compactando = False
+		self._hits = 0
+		self._misses = 0
+		self._compactacoes = 0
+		self._observadores = []
+
+	def _assinatura_atual(self):
+		"""Identifica a versão dos dados em disco (mtime, tamanho e inode do snapshot e do journal)."""
+		return (_assinatura_arquivo(self.caminho), _assinatura_arquivo(self.caminho_journal))
+
+	def _indexar(self, dados):
+		self._indice = {}
+		self._por_lote = {}
+		self._maior_id = 0
+		self._lista = None
+		self._notificar('reset', None, None)
+		# Registros compactos (schema 2) e antigos convivem: o formato é detectado por registro
+		for mapa in dados.get('mapas', []):
+			self._incluir(ler_registro(mapa))
+		# Arquivo inexistente equivale a uma base vazia já na versão atual
+		self._versao_schema = dados.get('versao_schema', 0 if dados else VERSAO_SCHEMA_MAPAS)
+		if dados and self._versao_schema < VERSAO_SCHEMA_MAPAS:
+			print(f"⚠️ {self.arquivo} está na versão {self._versao_schema} do schema (atual: {VERSAO_SCHEMA_MAPAS}). Execute 'flask --app main migrar-dados'.")
+
+	def _incluir(self, mapa):
+		chave = _chave_do_registro(mapa)
+		self._indice[chave] = mapa
+		self._por_lote.setdefault(chave[0], {})[chave] = mapa
+		id_mapa = mapa.get('id')
+		if isinstance(id_mapa, int) and id_mapa > self._maior_id:
+			self._maior_id = id_mapa
+		self._lista = None
+		self._notificar('upsert', chave, mapa)
+
+	def _retirar(self, chave):
+		mapa = self._indice.pop(chave, None)
+		if mapa is not None:
+			do_lote = self._por_lote.get(chave[0], {})
+			do_lote.pop(chave, None)
+			if not do_lote:
+				self._por_lote.pop(chave[0], None)
+			self._lista = None
+			self._notificar('delete', chave, mapa)
+		return mapa
+
+	def _notificar(self, evento, chave, mapa):
+		for observador in self._observadores:
+			try:
+				observador(evento, chave, mapa)
+			except Exception as e:
+				print(f"⚠️ Erro no observador de {self.arquivo} ({evento}): {e}")
+
+	def adicionar_observador(self, observador):
+		"""
+		Registra observador(evento, chave, mapa), chamado (com o lock) a cada mudança
+		no índice em memória: 'upsert' e 'delete' para um mapa, 'reset' antes de uma
+		releitura completa. Vale para gravações locais e para as de outros processos
+		(aplicadas via journal/banco). Se os dados já estão carregados, o observador
+		recebe o estado atual como 'reset' + 'upsert' de cada mapa.
+		"""
+		with self._lock:
+			self._observadores.append(observador)
+			if self._carregado:
+				observador('reset', None, None)
+				for chave, mapa in self._indice.items():
+					observador('upsert', chave, mapa)
+
+	def _garantir_atualizado(self):
+		"""Relê os dados se mudaram desde a última leitura (chamar com o lock)."""
+		# A assinatura é lida antes dos arquivos: se eles mudarem no meio da leitura,
+		# a próxima chamada enxerga outra assinatura e recarrega.
+		assinatura = self._assinatura_atual()
+		if self._carregado and assinatura == self._assinatura:
+			self._hits += 1
+			return
+		self._misses += 1
+		if not (self._carregado and self._acompanhar(assinatura)):
+			self._recarregar()
+		self._assinatura = assinatura
+		self._carregado = True
+
+	def _recarregar(self):
+		"""Leitura completa: snapshot + todas as operações do journal."""
+		self._indexar(ler_json(self.arquivo))
+		self._offset_journal = 0
+		self._reproduzir_journal()
+
+	def _acompanhar(self, assinatura):
+		"""
+		Se só o journal cresceu (mesmo snapshot, mesmo arquivo de journal), aplica
+		apenas as linhas novas. Retorna False quando é preciso recarregar tudo.
+		"""
+		snapshot, journal = assinatura
+		snapshot_anterior, journal_anterior = self._assinatura
+		if snapshot != snapshot_anterior or journal is None or journal_anterior is None:
+			return False
+		if journal[2] != journal_anterior[2] or journal[1] < self._offset_journal:
+			return False
+		self._reproduzir_journal()
+		return True
+
+	def _reproduzir_journal(self):
+		"""Aplica as linhas completas do journal a partir de _offset_journal."""
+		try:
+			with open(self.caminho_journal, 'rb') as f:
+				f.seek(self._offset_journal)
+				conteudo = f.read()
+		except FileNotFoundError:
+			return
+		fim = conteudo.rfind(b'\n') + 1
+		for linha in conteudo[:fim].splitlines():
+			if not linha.strip():
+				continue
+			try:
+				operacao = json.loads(linha)
+			except json.JSONDecodeError:
+				print(f"⚠️ Linha inválida ignorada no journal de {self.arquivo}")
+				continue
+			if operacao.get('op') == 'upsert':
+				self._incluir(ler_registro(operacao['mapa']))
+			elif operacao.get('op') == 'delete':
+				self._retirar(tuple(operacao['chave']))
+		# Uma linha incompleta no final (gravação em andamento) fica para a próxima leitura
+		self._offset_journal += fim
+
+	def _registrar(self, operacao):
+		"""Acrescenta uma operação ao journal com fsync (chamar com os locks)."""
+		linha = json.dumps(operacao, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+		try:
+			os.makedirs(os.path.dirname(self.caminho_journal), exist_ok=True)
+			with open(self.caminho_journal, 'a+b') as f:
+				f.seek(0, os.SEEK_END)
+				if f.tell() > 0:
+					# Se uma gravação anterior foi interrompida, isola a linha incompleta
+					f.seek(-1, os.SEEK_END)
+					if f.read(1) != b'\n':
+						linha = b'\n' + linha
+				f.write(linha)
+				f.flush()
+				os.fsync(f.fileno())
+				self._offset_journal = f.tell()
+		except OSError as e:
+			print(f"Erro ao gravar journal de {self.arquivo}: {e}")
+			# Memória e disco divergiram: força releitura na próxima consulta
+			self.invalidar()
+			return False
+		self._assinatura = self._assinatura_atual()
+		if self._offset_journal > LIMITE_JOURNAL_BYTES:
+			self._agendar_compactacao()
+		return True
+
+	def _agendar_compactacao(self):
+		if self._compactando:
+			return
+		self._compactando = True
+		threading.Thread(target=self.compactar, args=(False,), name='compactacao-mapas', daemon=True).start()
+
+	def compactar(self, forcar=True):
+		"""
+		Consolida snapshot + journal num novo snapshot e esvazia o journal.
+		Se o processo cair entre as duas etapas, reaplicar o journal sobre o novo
+		snapshot é inofensivo (upserts e exclusões são idempotentes).
+		Com forcar=False (compactação automática), não faz nada se o journal já
+		estiver abaixo do limite.
+		"""
+		try:
+			with self._lock, bloqueio_arquivo(self.arquivo):
+				self._garantir_atualizado()
+				if not forcar and self._offset_journal <= LIMITE_JOURNAL_BYTES:
+					# Outro processo já compactou enquanto esperávamos o lock
+					return True
+				dados = {'versao_schema': self._versao_schema, 'mapas': [compactar_registro(m) for m in self._listar()]}
+				if not gravar_json(self.arquivo, dados):
+					return False
+				if os.path.exists(self.caminho_journal):
+					open(self.caminho_journal, 'wb').close()
+				self._offset_journal = 0
+				self._assinatura = self._assinatura_atual()
+				self._compactacoes += 1
+				print(f"🗜️ Journal de {self.arquivo} compactado ({len(self._indice)} mapas no snapshot)")
+				return True
+		finally:
+			self._compactando = False
+
+	def _listar(self):
+		if self._lista is None:
+			self._lista = list(self._indice.values())
+		return self._lista
+
+	# ----- Consultas -----
+
+	def listar(self):
+		"""Todos os mapas, na ordem de gravação."""
+		with self._lock:
+			self._garantir_atualizado()
+			return self._listar()
+
+	def mapas_do_lote(self, lote_id):
+		with self._lock:
+			self._garantir_atualizado()
+			return list(self._por_lote.get(lote_id, {}).values())
+
+	def obter(self, lote_id, ano, mes, nome_unidade):
+		with self._lock:
+			self._garantir_atualizado()
+			return self._indice.get(chave_mapa(lote_id, ano, mes, nome_unidade))
+
+	# ----- Gravações -----
+
+	def salvar_mapa(self, registro):
+		"""
+		Insere ou substitui o mapa de mesma chave e registra a operação no journal.
+		Substituições mantêm o id e a posição do registro existente; inserções
+		recebem maior id + 1.
+		Retorna o registro salvo ou None em caso de erro de gravação.
+		"""
+		with self._lock, bloqueio_arquivo(self.arquivo):
+			# Com o lock entre processos, gravações de outros workers já estão no
+			# arquivo e são recarregadas antes da alteração (sem perda de atualização)
+			self._garantir_atualizado()
+			existente = self._indice.get(_chave_do_registro(registro))
+			if existente is not None:
+				registro['id'] = existente.get('id', 1)
+			elif not isinstance(registro.get('id'), int):
+				registro['id'] = self._maior_id + 1
+			self._incluir(registro)
+			return registro if self._registrar({'op': 'upsert', 'mapa': compactar_registro(registro)}) else None
+
+	def excluir_mapa(self, lote_id, ano, mes, nome_unidade):
+		"""
+		Remove o mapa da chave informada e registra a operação no journal.
+		Retorna o registro removido, None se não existir ou False em caso de erro de gravação.
+		"""
+		with self._lock, bloqueio_arquivo(self.arquivo):
+			self._garantir_atualizado()
+			chave = chave_mapa(lote_id, ano, mes, nome_unidade)
+			removido = self._retirar(chave)
+			if removido is None:
+				return None
+			return removido if self._registrar({'op': 'delete', 'chave': list(chave)}) else False
+
+	def sincronizar(self):
+		"""Aplica alterações gravadas por outros processos desde a última leitura."""
+		with self._lock:
+			self._garantir_atualizado()
+
+	def versao(self):
+		"""Identificador opaco da versão dos dados; muda a cada gravação (de qualquer processo)."""
+		with self._lock:
+			self._garantir_atualizado()
+			return repr(self._assinatura)
+
+	def invalidar(self):
+		"""Descarta o cache (chamado após gravações feitas fora do repositório)."""
+		with self._lock:
+			self._carregado = False
+			self._assinatura = None
+
+	def estatisticas(self):
+		with self._lock:
+			total = self._hits + self._misses
+			return {
+				'backend': self.backend,
+				'arquivo': self.arquivo,
+				'hits': self._hits,
+				'misses': self._misses,
+				'taxa_acerto': round(self._hits / total * 100, 1) if total else None,
+				'em_memoria': self._carregado,
+				'total_mapas': len(self._indice),
+				'total_lotes': len(self._por_lote),
+				'journal_bytes': self._offset_journal,
+				'compactacoes': self._compactacoes
+			}
+
+def _criar_repositorio():
+	if BACKEND == 'sqlite':
+		from .repositorio_sqlite import RepositorioMapasSQLite
+		return RepositorioMapasSQLite()
+	return RepositorioMapas()
+
+# Instância única compartilhada pela aplicação
+repositorio_mapas = _criar_repositorio()
@@ -0,0 +1,167 @@
+# Backend SQLite (opcional) para mapas, lotes e unidades
+import os
+import json
+import sqlite3
+import threading
+from .arquivos import DADOS_DIR
+from .repositorio_mapas import RepositorioMapas, VERSAO_SCHEMA_MAPAS, chave_mapa, _chave_do_registro
+from .formato_mapas import compactar_registro, ler_registro
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mapas (
+	id INTEGER PRIMARY KEY,
+	lote_id INTEGER NOT NULL,
+	ano INTEGER NOT NULL,
+	mes INTEGER NOT NULL,
+	nome_unidade TEXT NOT NULL,
+	dados TEXT NOT NULL,
+	UNIQUE (lote_id, ano, mes, nome_unidade)
+);
+CREATE TABLE IF NOT EXISTS lotes (id INTEGER PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS unidades (id INTEGER PRIMARY KEY, dados TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta (chave, valor) VALUES ('versao_dados', 0);
+CREATE TRIGGER IF NOT EXISTS mapas_versao_insert AFTER INSERT ON mapas
+	BEGIN UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_dados'; END;
+CREATE TRIGGER IF NOT EXISTS mapas_versao_update AFTER UPDATE ON mapas
+	BEGIN UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_dados'; END;
+CREATE TRIGGER IF NOT EXISTS mapas_versao_delete AFTER DELETE ON mapas
+	BEGIN UPDATE meta SET valor = valor + 1 WHERE chave = 'versao_dados'; END;
+"""
+
+SQL_UPSERT_MAPA = """
+	INSERT INTO mapas (id, lote_id, ano, mes, nome_unidade, dados) VALUES (?, ?, ?, ?, ?, ?)
+	ON CONFLICT (lote_id, ano, mes, nome_unidade) DO UPDATE SET dados = excluded.dados
+"""
+
+def _linha_mapa(mapa):
+	return (
+		mapa.get('id'), mapa.get('lote_id'), mapa.get('ano'), mapa.get('mes'), mapa.get('nome_unidade'),
+		json.dumps(compactar_registro(mapa), ensure_ascii=False)
+	)
+
+class RepositorioMapasSQLite(RepositorioMapas):
+	"""
+	Mesma API do RepositorioMapas, gravando cada mapa como uma linha em dados/sgmrp.db.
+	Salvar ou excluir um mês toca uma única linha; o cache em memória é validado
+	pelo contador meta.versao_dados, incrementado por gatilhos a cada alteração.
+	"""
+	backend = 'sqlite'
+
+	def __init__(self, arquivo='sgmrp.db'):
+		super().__init__(arquivo)
+		self._local = threading.local()
+		self._conexao().executescript(SCHEMA)
+
+	def _conexao(self):
+		# sqlite3 não compartilha conexões entre threads: uma por thread
+		conexao = getattr(self._local, 'conexao', None)
+		if conexao is None:
+			os.makedirs(DADOS_DIR, exist_ok=True)
+			conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+			conexao.execute('PRAGMA journal_mode=WAL')
+			conexao.execute('PRAGMA synchronous=NORMAL')
+			self._local.conexao = conexao
+		return conexao
+
+	def _assinatura_atual(self):
+		linha = self._conexao().execute("SELECT valor FROM meta WHERE chave = 'versao_dados'").fetchone()
+		return linha[0] if linha else None
+
+	def _recarregar(self):
+		mapas = []
+		for id_mapa, dados in self._conexao().execute('SELECT id, dados FROM mapas ORDER BY id'):
+			mapa = ler_registro(json.loads(dados))
+			mapa['id'] = id_mapa
+			mapas.append(mapa)
+		self._indexar({'versao_schema': VERSAO_SCHEMA_MAPAS, 'mapas': mapas})
+
+	def _acompanhar(self, assinatura):
+		# O contador de versão não diz o que mudou: sempre recarrega tudo
+		return False
+
+	def compactar(self):
+		# Sem journal: o próprio SQLite (WAL) cuida da consolidação
+		return True
+
+	def _transacao(self, operacao):
+		"""
+		Executa operacao(conexao) dentro de BEGIN IMMEDIATE, com o cache já
+		sincronizado com o banco. Retorna (resultado, ok).
+		"""
+		conexao = self._conexao()
+		try:
+			conexao.execute('BEGIN IMMEDIATE')
+			self._garantir_atualizado()
+			resultado = operacao(conexao)
+			assinatura = self._assinatura_atual()
+			conexao.execute('COMMIT')
+		except sqlite3.Error as e:
+			if conexao.in_transaction:
+				conexao.execute('ROLLBACK')
+			print(f"Erro ao gravar em {self.arquivo}: {e}")
+			self.invalidar()
+			return None, False
+		self._assinatura = assinatura
+		return resultado, True
+
+	def salvar_mapa(self, registro):
+		with self._lock:
+			def upsert(conexao):
+				existente = self._indice.get(_chave_do_registro(registro))
+				if existente is not None:
+					registro['id'] = existente.get('id', 1)
+				elif not isinstance(registro.get('id'), int):
+					registro['id'] = self._maior_id + 1
+				conexao.execute(SQL_UPSERT_MAPA, _linha_mapa(registro))
+			_, ok = self._transacao(upsert)
+			if not ok:
+				return None
+			self._incluir(registro)
+			return registro
+
+	def excluir_mapa(self, lote_id, ano, mes, nome_unidade):
+		chave = chave_mapa(lote_id, ano, mes, nome_unidade)
+		with self._lock:
+			def delete(conexao):
+				cursor = conexao.execute(
+					'DELETE FROM mapas WHERE lote_id = ? AND ano = ? AND mes = ? AND nome_unidade = ?', chave
+				)
+				return cursor.rowcount
+			removidos, ok = self._transacao(delete)
+			if not ok:
+				return False
+			if not removidos:
+				return None
+			return self._retirar(chave)
+
+	def listar_lotes(self):
+		return [json.loads(dados) for (dados,) in self._conexao().execute('SELECT dados FROM lotes ORDER BY id')]
+
+	def listar_unidades(self):
+		return [json.loads(dados) for (dados,) in self._conexao().execute('SELECT dados FROM unidades ORDER BY id')]
+
+	def importar(self, mapas, lotes, unidades):
+		"""Substitui todo o conteúdo do banco pelos registros informados (importação única)."""
+		with self._lock:
+			conexao = self._conexao()
+			try:
+				conexao.execute('BEGIN IMMEDIATE')
+				conexao.execute('DELETE FROM mapas')
+				conexao.execute('DELETE FROM lotes')
+				conexao.execute('DELETE FROM unidades')
+				conexao.executemany(SQL_UPSERT_MAPA, [_linha_mapa(m) for m in mapas])
+				conexao.executemany(
+					'INSERT OR REPLACE INTO lotes (id, dados) VALUES (?, ?)',
+					[(l.get('id'), json.dumps(l, ensure_ascii=False)) for l in lotes]
+				)
+				conexao.executemany(
+					'INSERT OR REPLACE INTO unidades (id, dados) VALUES (?, ?)',
+					[(u.get('id'), json.dumps(u, ensure_ascii=False)) for u in unidades]
+				)
+				conexao.execute('COMMIT')
+			except sqlite3.Error:
+				if conexao.in_transaction:
+					conexao.execute('ROLLBACK')
+				raise
+			self.invalidar()
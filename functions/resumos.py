@@ -0,0 +1,159 @@
+# Resumos materializados dos mapas por (lote, unidade, ano, mês)
+import threading
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from .colunar import CAMPOS_REFEICOES, colunas_mapa, vetor_precos
+from .arquivos import caminho_dados, gravar_json
+from .repositorio_mapas import repositorio_mapas, _assinatura_arquivo
+
+# Marcador em dados/ regravado a cada pedido de reconstrução: cada processo (workers
+# do servidor, comando da linha de comando) compara a assinatura e reconstrói os seus
+ARQUIVO_RECONSTRUCAO = 'resumos_reconstrucao.json'
+
+# totais, excedentes e discrepancias: vetores (8,) na ordem de CAMPOS_REFEICOES
+ResumoMapa = namedtuple('ResumoMapa', [
+	'lote_id', 'nome_unidade', 'ano', 'mes', 'dias', 'totais', 'excedentes', 'discrepancias', 'tem_siisp'
+])
+
+def resumir_mapa(mapa):
+	colunas = colunas_mapa(mapa)
+	return ResumoMapa(
+		mapa.get('lote_id'), mapa.get('nome_unidade'), mapa.get('ano'), mapa.get('mes'),
+		colunas.refeicoes.shape[0], colunas.totais, colunas.excedentes, colunas.discrepancias, colunas.tem_siisp
+	)
+
+def somar_resumos(resumos):
+	"""(totais, excedentes) somados de uma lista de resumos."""
+	totais = np.zeros(len(CAMPOS_REFEICOES), dtype=np.int64)
+	excedentes = np.zeros(len(CAMPOS_REFEICOES), dtype=np.int64)
+	for resumo in resumos:
+		totais += resumo.totais
+		excedentes += resumo.excedentes
+	return totais, excedentes
+
+def valores_resumo(totais, excedentes, precos):
+	"""Custo, desvio e conformidade (%) a partir das contagens e do vetor de preços do lote."""
+	valor_total = float(totais @ precos)
+	valor_desvio = float(excedentes @ precos)
+	conformidade = round(max(0, (valor_total - valor_desvio) / valor_total * 100), 1) if valor_total > 0 else None
+	return valor_total, valor_desvio, conformidade
+
+class ResumosMapas:
+	"""
+	Uma linha por mapa com as somas por tipo de refeição e os excedentes sobre o
+	SIISP, mantida pelos eventos do repositório: cada salvar_mapa/excluir_mapa
+	(inclusive de outros processos) atualiza só a linha do mapa alterado.
+
+	Custo e conformidade dependem dos preços do lote, que podem mudar em
+	lotes.json; por isso são calculados na leitura (produto escalar por linha),
+	sem precisar reconstruir os resumos quando um preço é alterado.
+
+	Os resumos ficam na memória de cada processo; uma reconstrução pedida em
+	qualquer processo regrava ARQUIVO_RECONSTRUCAO e todos os outros se
+	reconstroem na consulta seguinte.
+	"""
+
+	def __init__(self, repositorio):
+		self.repositorio = repositorio
+		self._lock = threading.Lock()
+		self._resumos = {}
+		self._por_lote = {}
+		self._reconstrucoes = 0
+		self._marcador = _assinatura_arquivo(caminho_dados(ARQUIVO_RECONSTRUCAO))
+		repositorio.adicionar_observador(self._ao_alterar)
+
+	def _sincronizar(self):
+		"""Reconstrói se outro processo pediu reconstrução; depois aplica as alterações dos mapas."""
+		marcador = _assinatura_arquivo(caminho_dados(ARQUIVO_RECONSTRUCAO))
+		if marcador != self._marcador:
+			self._marcador = marcador
+			self.repositorio.invalidar()
+		self.repositorio.sincronizar()
+
+	def _ao_alterar(self, evento, chave, mapa):
+		with self._lock:
+			if evento == 'reset':
+				self._resumos = {}
+				self._por_lote = {}
+				self._reconstrucoes += 1
+			elif evento == 'upsert':
+				resumo = resumir_mapa(mapa)
+				self._resumos[chave] = resumo
+				self._por_lote.setdefault(chave[0], {})[chave] = resumo
+			elif evento == 'delete':
+				self._resumos.pop(chave, None)
+				do_lote = self._por_lote.get(chave[0], {})
+				do_lote.pop(chave, None)
+				if not do_lote:
+					self._por_lote.pop(chave[0], None)
+
+	def reconstruir(self):
+		"""
+		Descarta tudo e recalcula a partir dos mapas em disco (recuperação), neste
+		processo e, na próxima consulta de cada um, nos demais.
+		"""
+		gravar_json(ARQUIVO_RECONSTRUCAO, {'solicitada_em': datetime.now().isoformat()})
+		self._marcador = _assinatura_arquivo(caminho_dados(ARQUIVO_RECONSTRUCAO))
+		self.repositorio.invalidar()
+		self.repositorio.sincronizar()
+		with self._lock:
+			return len(self._resumos)
+
+	def listar(self, lote_id=None):
+		"""Resumos de todos os mapas ou só dos de um lote."""
+		self._sincronizar()
+		with self._lock:
+			if lote_id is None:
+				return list(self._resumos.values())
+			return list(self._por_lote.get(lote_id, {}).values())
+
+	def por_lote(self):
+		"""{lote_id: [resumos]} com os dados já sincronizados."""
+		self._sincronizar()
+		with self._lock:
+			return {lote_id: list(linhas.values()) for lote_id, linhas in self._por_lote.items()}
+
+	def linhas(self, lotes, lote_id=None, ano=None, mes=None):
+		"""
+		Resumos como dicts (refeições por campo, custo, desvio e conformidade),
+		usando os preços atuais de cada lote. Filtros opcionais por lote, ano e mês.
+		"""
+		precos_por_lote = {l.get('id'): vetor_precos(l.get('precos', {})) for l in lotes}
+		sem_precos = vetor_precos({})
+		linhas = []
+		for resumo in self.listar(lote_id):
+			if ano is not None and resumo.ano != ano:
+				continue
+			if mes is not None and resumo.mes != mes:
+				continue
+			valor_total, valor_desvio, conformidade = valores_resumo(
+				resumo.totais, resumo.excedentes, precos_por_lote.get(resumo.lote_id, sem_precos)
+			)
+			linha = {
+				'lote_id': resumo.lote_id,
+				'nome_unidade': resumo.nome_unidade,
+				'ano': resumo.ano,
+				'mes': resumo.mes,
+				'dias': resumo.dias,
+				'tem_siisp': resumo.tem_siisp,
+				'valor_total': round(valor_total, 2),
+				'valor_desvio': round(valor_desvio, 2),
+				'conformidade': conformidade,
+				'discrepancias': int(resumo.discrepancias.sum())
+			}
+			linha.update({campo: int(resumo.totais[i]) for i, campo in enumerate(CAMPOS_REFEICOES)})
+			linha.update({f'{campo}_excedente': int(resumo.excedentes[i]) for i, campo in enumerate(CAMPOS_REFEICOES)})
+			linhas.append(linha)
+		return linhas
+
+	def estatisticas(self):
+		with self._lock:
+			return {
+				'total_resumos': len(self._resumos),
+				'total_lotes': len(self._por_lote),
+				'reconstrucoes': self._reconstrucoes
+			}
+
+# Instância única, alimentada pelo repositório compartilhado
+resumos_mapas = ResumosMapas(repositorio_mapas)
@@ -0,0 +1,286 @@
+# Exportações em segundo plano: POST cria a tarefa, o cliente consulta o status e baixa o arquivo
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .arquivos import DADOS_DIR
+from .repositorio_mapas import repositorio_mapas
+from .utils import carregar_lotes
+from .exportacao import ErroExportacao, carregar_modelo, exportar_tabela_lote, nome_arquivo_exportacao
+from .exportacao_lotes import exportar_lotes_zip, meses_do_periodo, nome_zip_exportacao
+
+# Gerações simultâneas (cada uma ocupa uma thread, não um worker do servidor web)
+MAX_TRABALHADORES = int(os.environ.get('SGMRP_EXPORT_WORKERS', 2))
+
+# Arquivos prontos (.xlsx de um lote, .zip da exportação em massa), nomeados pela
+# chave da exportação (ver chave_exportacao e chave_exportacao_lotes), e o
+# estado de cada tarefa em <id>.json, para qualquer worker responder status e download
+PASTA_CACHE = os.environ.get('SGMRP_EXPORT_CACHE_DIR', os.path.join(DADOS_DIR, 'exportacoes'))
+MAX_ARQUIVOS_CACHE = int(os.environ.get('SGMRP_EXPORT_CACHE_MAX', 50))
+
+# Tarefas finalizadas ficam consultáveis por este tempo (segundos)
+RETENCAO_TAREFAS = 3600
+
+PENDENTE = 'pendente'
+PROCESSANDO = 'processando'
+CONCLUIDA = 'concluida'
+ERRO = 'erro'
+
+PADRAO_ID_TAREFA = re.compile(r'[0-9a-f]{32}')
+
+def chave_exportacao(lote, lote_id, data_inicio, data_fim, unidades_list):
+	"""
+	Identifica o conteúdo do arquivo: filtros, versão dos mapas (repositorio_mapas.versao),
+	dados do lote (preços, contrato, empresa) e versão do modelo.xlsx.
+	"""
+	partes = [
+		lote_id, data_inicio or None, data_fim or None, list(unidades_list or []),
+		repositorio_mapas.versao(), lote, list(carregar_modelo().assinatura)
+	]
+	return hashlib.sha1(json.dumps(partes, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def chave_exportacao_lotes(lotes, lote_ids, data_inicio, data_fim):
+	"""Como chave_exportacao, para o ZIP de functions/exportacao_lotes.py (lotes exportados e seus dados)."""
+	partes = [
+		'lotes', lote_ids, data_inicio, data_fim,
+		repositorio_mapas.versao(), lotes, list(carregar_modelo().assinatura)
+	]
+	return hashlib.sha1(json.dumps(partes, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class FilaExportacoes:
+	"""
+	Executa exportar_tabela_lote (ou exportar_lotes_zip, nas tarefas de formato 'zip')
+	num ThreadPoolExecutor e guarda o resultado em
+	PASTA_CACHE. Pedidos com a mesma chave reaproveitam o arquivo já gerado ou a
+	tarefa ainda em andamento, sem gerar a planilha de novo.
+	O estado de cada tarefa também é gravado em PASTA_CACHE/<id>.json: com vários
+	workers, o status e o download podem ser pedidos a um processo que não criou a tarefa.
+	"""
+
+	def __init__(self, pasta=PASTA_CACHE, max_trabalhadores=MAX_TRABALHADORES):
+		self.pasta = pasta
+		self._executor = ThreadPoolExecutor(max_workers=max_trabalhadores, thread_name_prefix='exportacao')
+		self._lock = threading.Lock()
+		self._tarefas = {}
+		self._em_andamento = {}
+		self._acertos_cache = 0
+		self._geradas = 0
+
+	def _caminho(self, chave, formato='xlsx'):
+		return os.path.join(self.pasta, f'{chave}.{formato}')
+
+	def _caminho_tarefa(self, tarefa_id):
+		return os.path.join(self.pasta, f'{tarefa_id}.json')
+
+	def _gravar_tarefa(self, tarefa):
+		"""Grava o estado da tarefa de forma atômica (chamar com o lock)."""
+		caminho_tmp = None
+		try:
+			os.makedirs(self.pasta, exist_ok=True)
+			with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.pasta, prefix='.tarefa.', suffix='.tmp', delete=False) as f:
+				caminho_tmp = f.name
+				json.dump(tarefa, f, ensure_ascii=False)
+			os.replace(caminho_tmp, self._caminho_tarefa(tarefa['id']))
+			caminho_tmp = None
+		except OSError as e:
+			print(f"⚠️ Não foi possível gravar o estado da exportação {tarefa['id']}: {e}")
+		finally:
+			if caminho_tmp and os.path.exists(caminho_tmp):
+				os.remove(caminho_tmp)
+
+	def _ler_tarefa(self, tarefa_id):
+		"""Estado gravado por qualquer worker, ou None se não existe ou já expirou."""
+		try:
+			with open(self._caminho_tarefa(tarefa_id), 'r', encoding='utf-8') as f:
+				tarefa = json.load(f)
+		except (OSError, ValueError):
+			return None
+		if tarefa['status'] in (CONCLUIDA, ERRO) and tarefa['atualizada_em'] < time.time() - RETENCAO_TAREFAS:
+			return None
+		return tarefa
+
+	def _limpar_tarefas(self):
+		limite = time.time() - RETENCAO_TAREFAS
+		for tarefa_id, tarefa in list(self._tarefas.items()):
+			if tarefa['status'] in (CONCLUIDA, ERRO) and tarefa['atualizada_em'] < limite:
+				del self._tarefas[tarefa_id]
+
+	def _limpar_cache(self):
+		"""
+		Mantém só os MAX_ARQUIVOS_CACHE arquivos mais recentes (versões antigas dos dados
+		saem primeiro) e remove os estados de tarefas sem alteração há RETENCAO_TAREFAS.
+		"""
+		try:
+			nomes = os.listdir(self.pasta)
+		except FileNotFoundError:
+			return
+		limite = time.time() - RETENCAO_TAREFAS
+		for nome in nomes:
+			if nome.endswith('.json'):
+				caminho = os.path.join(self.pasta, nome)
+				try:
+					if os.path.getmtime(caminho) < limite:
+						os.remove(caminho)
+				except OSError:
+					pass
+		arquivos = [os.path.join(self.pasta, nome) for nome in nomes if nome.endswith(('.xlsx', '.zip'))]
+		arquivos.sort(key=lambda caminho: os.path.getmtime(caminho), reverse=True)
+		for caminho in arquivos[MAX_ARQUIVOS_CACHE:]:
+			try:
+				os.remove(caminho)
+			except OSError:
+				pass
+
+	def enviar(self, lote_id, data_inicio=None, data_fim=None, unidades_list=None, usuario_id=None):
+		"""Cria a tarefa e devolve seu estado (já 'concluida' quando o arquivo está em cache)."""
+		unidades_list = unidades_list or []
+		lote = next((l for l in carregar_lotes() if l['id'] == lote_id), None)
+		chave = chave_exportacao(lote, lote_id, data_inicio, data_fim, unidades_list)
+		return self._enviar(chave, usuario_id, {
+			'formato': 'xlsx',
+			'lote_id': lote_id,
+			'data_inicio': data_inicio,
+			'data_fim': data_fim,
+			'unidades': unidades_list,
+			'nome_arquivo': nome_arquivo_exportacao(lote_id, data_inicio, data_fim)
+		})
+
+	def enviar_lotes(self, lote_ids, data_inicio, data_fim, usuario_id=None):
+		"""
+		Cria a tarefa do ZIP de vários lotes e meses (functions/exportacao_lotes.py); sem
+		lote_ids, todos os lotes. ErroExportacao (400/404) para período ou lote inválido.
+		"""
+		meses_do_periodo(data_inicio, data_fim)
+		lotes = {l['id']: l for l in carregar_lotes()}
+		lote_ids = sorted(set(lote_ids)) if lote_ids else sorted(lotes)
+		for lote_id in lote_ids:
+			if lote_id not in lotes:
+				raise ErroExportacao(f"Lote {lote_id} não encontrado.", 404)
+		chave = chave_exportacao_lotes([lotes[i] for i in lote_ids], lote_ids, data_inicio, data_fim)
+		return self._enviar(chave, usuario_id, {
+			'formato': 'zip',
+			'lote_ids': lote_ids,
+			'data_inicio': data_inicio,
+			'data_fim': data_fim,
+			'nome_arquivo': nome_zip_exportacao(data_inicio, data_fim)
+		})
+
+	def _enviar(self, chave, usuario_id, parametros):
+		agora = time.time()
+		tarefa = {
+			'id': uuid.uuid4().hex,
+			'status': PENDENTE,
+			'chave': chave,
+			**parametros,
+			'usuario_id': usuario_id,
+			'erro': None,
+			'criada_em': agora,
+			'atualizada_em': agora
+		}
+		with self._lock:
+			self._limpar_tarefas()
+			self._tarefas[tarefa['id']] = tarefa
+			if os.path.exists(self._caminho(chave, tarefa['formato'])):
+				tarefa['status'] = CONCLUIDA
+				self._acertos_cache += 1
+				self._gravar_tarefa(tarefa)
+				return dict(tarefa)
+			self._gravar_tarefa(tarefa)
+			futuro = self._em_andamento.get(chave)
+			if futuro is None:
+				futuro = self._executor.submit(self._gerar, tarefa)
+				self._em_andamento[chave] = futuro
+		futuro.add_done_callback(lambda f: self._finalizar(tarefa['id'], f))
+		return self.consultar(tarefa['id'])
+
+	def _gerar(self, tarefa):
+		with self._lock:
+			for t in self._tarefas.values():
+				if t['chave'] == tarefa['chave'] and t['status'] == PENDENTE:
+					t['status'] = PROCESSANDO
+					t['atualizada_em'] = time.time()
+					self._gravar_tarefa(t)
+		if tarefa['formato'] == 'zip':
+			arquivo, _, _ = exportar_lotes_zip(tarefa['lote_ids'], tarefa['data_inicio'], tarefa['data_fim'])
+		else:
+			arquivo, _ = exportar_tabela_lote(tarefa['lote_id'], tarefa['data_inicio'], tarefa['data_fim'], tarefa['unidades'])
+		os.makedirs(self.pasta, exist_ok=True)
+		caminho_tmp = None
+		try:
+			with tempfile.NamedTemporaryFile('wb', dir=self.pasta, prefix='.exportacao.', suffix='.tmp', delete=False) as f:
+				caminho_tmp = f.name
+				while True:
+					bloco = arquivo.read(1024 * 1024)
+					if not bloco:
+						break
+					f.write(bloco)
+			os.replace(caminho_tmp, self._caminho(tarefa['chave'], tarefa['formato']))
+			caminho_tmp = None
+		finally:
+			arquivo.close()
+			if caminho_tmp and os.path.exists(caminho_tmp):
+				os.remove(caminho_tmp)
+		with self._lock:
+			self._geradas += 1
+		self._limpar_cache()
+
+	def _finalizar(self, tarefa_id, futuro):
+		with self._lock:
+			tarefa = self._tarefas.get(tarefa_id)
+			if tarefa is None:
+				return
+			if self._em_andamento.get(tarefa['chave']) is futuro:
+				del self._em_andamento[tarefa['chave']]
+			erro = futuro.exception()
+			if erro is None:
+				tarefa['status'] = CONCLUIDA
+			else:
+				tarefa['status'] = ERRO
+				tarefa['erro'] = str(erro)
+				if not isinstance(erro, ErroExportacao):
+					print(f"❌ Erro na exportação {tarefa_id}: {erro}")
+			tarefa['atualizada_em'] = time.time()
+			self._gravar_tarefa(tarefa)
+
+	def consultar(self, tarefa_id):
+		"""
+		Cópia do estado da tarefa, ou None se não existe (ou já expirou). Tarefas
+		criadas por outro worker são lidas de PASTA_CACHE/<id>.json.
+		"""
+		if not PADRAO_ID_TAREFA.fullmatch(tarefa_id or ''):
+			return None
+		with self._lock:
+			tarefa = self._tarefas.get(tarefa_id)
+			if tarefa is not None:
+				return dict(tarefa)
+		return self._ler_tarefa(tarefa_id)
+
+	def arquivo(self, tarefa_id):
+		"""(caminho, nome_arquivo) de uma tarefa concluída cujo arquivo ainda está em cache; senão None."""
+		tarefa = self.consultar(tarefa_id)
+		if tarefa is None or tarefa['status'] != CONCLUIDA:
+			return None
+		caminho = self._caminho(tarefa['chave'], tarefa.get('formato', 'xlsx'))
+		if not os.path.exists(caminho):
+			return None
+		return caminho, tarefa['nome_arquivo']
+
+	def estatisticas(self):
+		with self._lock:
+			por_status = {}
+			for tarefa in self._tarefas.values():
+				por_status[tarefa['status']] = por_status.get(tarefa['status'], 0) + 1
+			return {
+				'tarefas': por_status,
+				'em_andamento': len(self._em_andamento),
+				'geradas': self._geradas,
+				'acertos_cache': self._acertos_cache
+			}
+
+# Instância única do processo
+fila_exportacoes = FilaExportacoes()
@@ -2,122 +2,58 @@
 def calcular_conformidade_lote(lote, mapas=None):
 	"""
 	Calcula a conformidade do lote considerando os mapas e preços.
-	Se mapas não for fornecido, carrega todos os mapas do sistema.
+	Se mapas não for fornecido, usa os resumos materializados do lote (functions/resumos.py).
+	Valor total = refeições × preços; desvio = excedentes positivos sobre o SIISP × preços,
+	ambos como produtos escalares sobre a forma colunar dos mapas (functions/colunar.py).
 	"""
-	if mapas is None:
-		mapas = carregar_mapas()
 	lote_id = lote.get('id')
-	mapas_lote = [m for m in mapas if m.get('lote_id') == lote_id]
-	precos = lote.get('precos', {})
-	valor_total = 0
-	valor_desvio = 0
-	for mapa in mapas_lote:
-		# Soma valores esperados multiplicados pelo preço
-		campos_precos = [
-			('cafe_interno', precos.get('cafe', {}).get('interno', 0)),
-			('cafe_funcionario', precos.get('cafe', {}).get('funcionario', 0)),
-			('almoco_interno', precos.get('almoco', {}).get('interno', 0)),
-			('almoco_funcionario', precos.get('almoco', {}).get('funcionario', 0)),
-			('lanche_interno', precos.get('lanche', {}).get('interno', 0)),
-			('lanche_funcionario', precos.get('lanche', {}).get('funcionario', 0)),
-			('jantar_interno', precos.get('jantar', {}).get('interno', 0)),
-			('jantar_funcionario', precos.get('jantar', {}).get('funcionario', 0)),
-		]
-		for campo, preco in campos_precos:
-			valores = mapa.get(campo, [])
-			valor_total += sum(valores) * preco if valores else 0
-		# Soma desvios SIISP multiplicados pelo preço (considera todos tipos)
-		n_siisp = mapa.get('n_siisp', [])
-		# Para desvio, soma todos os n_siisp multiplicados pelo preço médio das refeições
-		# (No detalhe, soma por tipo, mas aqui só tem n_siisp total, então usa média dos preços)
-		if n_siisp:
-			# Se possível, soma por tipo igual ao esperado
-			# Aqui, para cada campo, se houver campo_siisp, soma os excedentes multiplicados pelo preço
-			for idx, campo in enumerate(['cafe_interno', 'cafe_funcionario', 'almoco_interno', 'almoco_funcionario', 'lanche_interno', 'lanche_funcionario', 'jantar_interno', 'jantar_funcionario']):
-				campo_siisp = f"{campo}_siisp"
-				siisp_vals = mapa.get(campo_siisp, [])
-				preco = 0
-				if 'cafe' in campo:
-					preco = precos.get('cafe', {}).get('interno' if 'interno' in campo else 'funcionario', 0)
-				elif 'almoco' in campo:
-					preco = precos.get('almoco', {}).get('interno' if 'interno' in campo else 'funcionario', 0)
-				elif 'lanche' in campo:
-					preco = precos.get('lanche', {}).get('interno' if 'interno' in campo else 'funcionario', 0)
-				elif 'jantar' in campo:
-					preco = precos.get('jantar', {}).get('interno' if 'interno' in campo else 'funcionario', 0)
-				if siisp_vals:
-					# Só soma excedentes positivos
-					valor_desvio += sum([v for v in siisp_vals if v > 0]) * preco
-		# Se não houver campos_siisp, soma n_siisp total multiplicado pelo preço médio
-		elif n_siisp:
-			precos_lista = [p for _, p in campos_precos if p > 0]
-			preco_medio = sum(precos_lista) / len(precos_lista) if precos_lista else 1
-			valor_desvio += sum(n_siisp) * preco_medio
-	if valor_total > 0:
-		conformidade = ((valor_total - valor_desvio) / valor_total) * 100
-		return round(max(0, conformidade), 1)
-	return None
-def data_br_to_iso(d):
-	d = d.split('/')
-	return f"{d[2]}-{d[1].zfill(2)}-{d[0].zfill(2)}"
-def int_to_roman(num):
-	val = [1000, 900, 500, 400, 100, 90, 50, 40, 10, 9, 5, 4, 1]
-	syms = ['M', 'CM', 'D', 'CD', 'C', 'XC', 'L', 'XL', 'X', 'IX', 'V', 'IV', 'I']
-	roman_num = ''
-	i = 0
-	while num > 0:
-		for _ in range(num // val[i]):
-			roman_num += syms[i]
-			num -= val[i]
-		i += 1
-	return roman_num
-def filtro_mapa(m, lote_id, unidades_list, data_inicio, data_fim):
-	if m['lote_id'] != lote_id:
-		return False
-	if unidades_list and m.get('nome_unidade') not in unidades_list:
-		return False
-	if data_inicio and data_fim:
-		# Verifica se há datas dentro do intervalo
-		datas = m.get('data', [])
-		if not datas:
-			return False
-		# Assume datas no formato DD/MM/YYYY
-		def data_br_to_iso(d):
-			d = d.split('/')
-			return f"{d[2]}-{d[1].zfill(2)}-{d[0].zfill(2)}"
-		datas_iso = [data_br_to_iso(d) for d in datas]
-		if not any(data_inicio <= d <= data_fim for d in datas_iso):
-			return False
-	return True
+	if mapas is None:
+		totais, excedentes = somar_resumos(resumos_mapas.listar(lote_id))
+	else:
+		totais, excedentes = somar_mapas([m for m in mapas if m.get('lote_id') == lote_id])
+	_, _, conformidade = valores_resumo(totais, excedentes, vetor_precos(lote.get('precos', {})))
+	return conformidade
 # Funções auxiliares movidas de main.py
 import os
 import json
+import base64
+import bisect
 import calendar
-from datetime import datetime
-from .firestore_utils import carregar_firestore, salvar_firestore
+import time
+import threading
+from datetime import datetime, date
+from .firestore_utils import (
+	carregar_firestore, buscar_firestore, gravar_em_massa, criar_firestore,
+	proximo_valor_contador, elevar_valor_contador
+)
+from .indice_usuarios import indice_usuarios
+from .arquivos import ler_json, gravar_json, caminho_dados, bloqueio_arquivo
+from .auxiliares import data_br_to_iso, int_to_roman, ordinal_data_br, indices_no_periodo, filtro_mapa
+from .repositorio_mapas import repositorio_mapas, RepositorioMapas, VERSAO_SCHEMA_MAPAS, BACKEND
+from .colunar import CAMPOS_REFEICOES, vetor_precos, somar_mapas, diferencas_siisp
+from .formato_mapas import compactar_registro
+from .resumos import resumos_mapas, somar_resumos, valores_resumo
 
 def carregar_dados_json(arquivo):
-	DADOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dados')
-	caminho = os.path.join(DADOS_DIR, arquivo)
-	try:
-		with open(caminho, 'r', encoding='utf-8') as f:
-			return json.load(f)
-	except FileNotFoundError:
-		return {}
-	except json.JSONDecodeError:
-		return {}
+	return ler_json(arquivo)
 
 def salvar_dados_json(arquivo, dados):
-	DADOS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dados')
-	os.makedirs(DADOS_DIR, exist_ok=True)
-	caminho = os.path.join(DADOS_DIR, arquivo)
-	try:
-		with open(caminho, 'w', encoding='utf-8') as f:
-			json.dump(dados, f, ensure_ascii=False, indent=2)
-		return True
-	except Exception as e:
-		print(f"Erro ao salvar arquivo {arquivo}: {e}")
+	if not gravar_json(arquivo, dados):
 		return False
+	if arquivo == repositorio_mapas.arquivo:
+		repositorio_mapas.invalidar()
+	return True
+
+# Cache do login: identificador normalizado -> (expira_em, usuário). TTL curto porque
+# alterações feitas por outro worker (ex.: liberação de acesso) não o invalidam aqui
+TTL_CACHE_USUARIOS = float(os.environ.get('SGMRP_USUARIOS_CACHE_TTL', 30))
+_MAX_CACHE_USUARIOS = 1024
+_cache_usuarios = {}
+_cache_usuarios_lock = threading.Lock()
+
+def invalidar_cache_usuarios():
+	with _cache_usuarios_lock:
+		_cache_usuarios.clear()
 
 def carregar_usuarios():
 	"""
@@ -125,26 +61,65 @@ def carregar_usuarios():
 	"""
 	return carregar_firestore('usuarios')
 
+# Campos consultados no login, gravados sem espaços e em minúsculas
+CAMPOS_LOGIN = ('email', 'usuario')
+
 def salvar_usuarios(usuarios):
 	"""
-	Salva lista de usuários na coleção 'usuarios' do Firestore.
-	Remove todos os documentos existentes e insere os novos.
+	Sincroniza a coleção 'usuarios' do Firestore com a lista: grava só os usuários
+	novos ou alterados e remove os que não estão nela (firestore_utils.gravar_em_massa).
+	Cada usuário fica no documento de id str(usuario['id']), com o campo 'id' gravado
+	como está (inteiro), então salvar de novo a lista de carregar_usuarios não grava nada.
+	Email e usuário são normalizados (CAMPOS_LOGIN). Retorna os ids dos documentos, na
+	ordem da lista, ou None se alguma gravação falhar.
 	"""
-	# Para garantir que não haja duplicidade, pode-se apagar todos e inserir novamente (alternativamente, atualizar individualmente)
-	# Aqui, para simplificar, remove todos e insere todos (pode ser otimizado depois)
 	from .firestore_utils import db
 	colecao_ref = db.collection('usuarios')
-	# Apaga todos os documentos existentes
-	for doc in colecao_ref.stream():
-		colecao_ref.document(doc.id).delete()
-	# Insere todos os usuários
-	return salvar_firestore('usuarios', usuarios)
+	ids = []
+	gravacoes = {}
+	for usuario in usuarios:
+		doc_id = str(usuario['id']) if usuario.get('id') is not None else colecao_ref.document().id
+		if doc_id in gravacoes:
+			# Dois usuários no mesmo documento: um deles seria perdido
+			raise ValueError(f"Id de usuário duplicado: {usuario['id']}")
+		dados = {campo: valor for campo, valor in usuario.items() if campo != 'firestore_id'}
+		# Mesma normalização de adicionar_usuario: o login busca email/usuário por igualdade
+		for campo in CAMPOS_LOGIN:
+			if isinstance(dados.get(campo), str):
+				dados[campo] = dados[campo].strip().lower()
+		gravacoes[doc_id] = dados
+		ids.append(doc_id)
+	# Ids escolhidos fora do contador: os próximos cadastros começam depois deles
+	maior_id = max((i for i in map(_id_inteiro, usuarios) if i is not None), default=None)
+	if maior_id is not None:
+		elevar_valor_contador('usuarios', maior_id)
+	# Documentos fora da lista (inclusive os de id automático, de antes dos ids estáveis) são removidos
+	existentes = {doc.id: doc.to_dict() for doc in colecao_ref.stream()}
+	exclusoes = [doc_id for doc_id in existentes if doc_id not in gravacoes]
+	gravacoes = [(doc_id, dados) for doc_id, dados in gravacoes.items() if existentes.get(doc_id) != dados]
+	# Gravações antes das exclusões: a coleção nunca fica sem os usuários (login continua funcionando)
+	resultados = gravar_em_massa('usuarios', gravacoes)
+	erros = [r for r in resultados if r['erro'] is not None]
+	if not erros:
+		resultados += gravar_em_massa('usuarios', exclusoes=exclusoes)
+		erros = [r for r in resultados if r['erro'] is not None]
+	invalidar_cache_usuarios()
+	indice_usuarios.invalidar()
+	if erros:
+		print(f"❌ Erro ao sincronizar {len(erros)} usuários: {erros[0]['erro']}")
+		return None
+	print(f"👥 Usuários sincronizados: {len(gravacoes)} gravados, {len(exclusoes)} removidos")
+	return ids
 
 def carregar_lotes():
+	if BACKEND == 'sqlite':
+		return repositorio_mapas.listar_lotes()
 	dados = carregar_dados_json('lotes.json')
 	return dados.get('lotes', [])
 
 def carregar_unidades():
+	if BACKEND == 'sqlite':
+		return repositorio_mapas.listar_unidades()
 	dados = carregar_dados_json('unidades.json')
 	return dados.get('unidades', [])
 
@@ -256,112 +231,78 @@ def processar_dados_siisp(texto_siisp, dias_esperados):
 	return resultado
 
 def migrar_dados_existentes():
+	"""
+	Leva os registros de mapas_teste.json para o repositório de mapas, um a um por
+	repositorio_mapas.salvar_mapa (lock entre processos e journal, como qualquer
+	outra gravação). Mapas que já existem com a mesma chave não são alterados.
+	"""
 	try:
 		dados_teste = carregar_dados_json('mapas_teste.json')
 		if not dados_teste or 'registros' not in dados_teste or not dados_teste['registros']:
 			print("ℹ️ Nenhum dado de teste encontrado para migrar")
 			return True
 		print(f"🔄 Migrando {len(dados_teste['registros'])} registros de mapas_teste.json para mapas.json...")
-		dados_mapas = carregar_dados_json('mapas.json')
-		if 'mapas' not in dados_mapas:
-			dados_mapas['mapas'] = []
 		registros_migrados = 0
 		for registro in dados_teste['registros']:
-			ja_existe = any(
-				m.get('id') == registro.get('id') and 
-				m.get('nome_unidade') == registro.get('nome_unidade') and
-				m.get('mes') == registro.get('mes') and
-				m.get('ano') == registro.get('ano') and
-				m.get('lote_id') == registro.get('lote_id')
-				for m in dados_mapas['mapas']
-			)
+			ja_existe = repositorio_mapas.obter(
+				registro.get('lote_id'), registro.get('ano'), registro.get('mes'), registro.get('nome_unidade')
+			) is not None
 			if not ja_existe:
-				if 'data_criacao' in registro:
-					del registro['data_criacao']
-				dados_mapas['mapas'].append(registro)
+				registro.pop('data_criacao', None)
+				# O id do arquivo de teste pode já estar em uso: o repositório atribui um novo
+				registro.pop('id', None)
+				if repositorio_mapas.salvar_mapa(registro) is None:
+					print("❌ Erro ao salvar dados migrados")
+					return False
 				registros_migrados += 1
 				print(f"   ✅ Migrado: {registro.get('nome_unidade')} - {registro.get('mes')}/{registro.get('ano')}")
 			else:
 				print(f"   ⚠️ Já existe: {registro.get('nome_unidade')} - {registro.get('mes')}/{registro.get('ano')}")
 		if registros_migrados > 0:
-			if salvar_dados_json('mapas.json', dados_mapas):
-				print(f"✅ {registros_migrados} registros migrados com sucesso!")
-				import os
-				caminho_teste = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dados', 'mapas_teste.json')
-				try:
-					os.remove(caminho_teste)
-					print("🗑️ Arquivo mapas_teste.json removido com sucesso!")
-				except OSError:
-					print("⚠️ Não foi possível remover mapas_teste.json")
-				return True
-			else:
-				print("❌ Erro ao salvar dados migrados")
-				return False
+			print(f"✅ {registros_migrados} registros migrados com sucesso!")
 		else:
 			print("ℹ️ Nenhum registro novo para migrar")
-			return True
+		caminho_teste = caminho_dados('mapas_teste.json')
+		try:
+			os.remove(caminho_teste)
+			print("🗑️ Arquivo mapas_teste.json removido com sucesso!")
+		except OSError:
+			print("⚠️ Não foi possível remover mapas_teste.json")
+		return True
 	except Exception as e:
 		print(f"❌ Erro na migração: {e}")
 		return False
 
 def calcular_colunas_siisp(mapa):
-	n_siisp = mapa.get('n_siisp', [])
-	campos_base = [
-		'cafe_interno', 'cafe_funcionario',
-		'almoco_interno', 'almoco_funcionario', 
-		'lanche_interno', 'lanche_funcionario',
-		'jantar_interno', 'jantar_funcionario'
-	]
-	tamanho_lista = 0
-	for campo in campos_base:
-		valores = mapa.get(campo, [])
-		if valores and len(valores) > tamanho_lista:
-			tamanho_lista = len(valores)
-	if not n_siisp and tamanho_lista > 0:
-		n_siisp = [0] * tamanho_lista
-		mapa['n_siisp'] = n_siisp
-		print(f"🔢 Criada lista de zeros para n_siisp: {len(n_siisp)} valores")
-	if not n_siisp or tamanho_lista == 0:
-		return mapa
-	for campo in campos_base:
-		campo_siisp = f"{campo}_siisp"
-		valores_originais = mapa.get(campo, [])
-		if valores_originais and len(valores_originais) == len(n_siisp):
-			diferencas = [valores_originais[i] - n_siisp[i] for i in range(len(n_siisp))]
-			mapa[campo_siisp] = diferencas
-		else:
-			mapa[campo_siisp] = []
+	"""
+	Grava no mapa as colunas *_siisp (ver colunar.diferencas_siisp), criando
+	n_siisp com zeros quando o mapa tem refeições mas ainda não tem SIISP.
+	"""
+	tamanho_lista = max(len(mapa.get(campo) or []) for campo in CAMPOS_REFEICOES)
+	if not mapa.get('n_siisp') and tamanho_lista > 0:
+		mapa['n_siisp'] = [0] * tamanho_lista
+		print(f"🔢 Criada lista de zeros para n_siisp: {tamanho_lista} valores")
+	mapa.update(diferencas_siisp(mapa))
 	return mapa
 
 def salvar_mapas_atualizados(mapas):
-	dados = {'mapas': mapas}
-	return salvar_dados_json('mapas.json', dados)
+	"""
+	Regrava mapas.json inteiro com a lista, sob o lock do arquivo e com o journal já
+	consolidado (senão ele seria reaplicado sobre a lista). Para alterar mapas
+	avulsos, use repositorio_mapas.salvar_mapa.
+	"""
+	RepositorioMapas().compactar()
+	dados = {'versao_schema': VERSAO_SCHEMA_MAPAS, 'mapas': [compactar_registro(m) for m in mapas]}
+	with bloqueio_arquivo('mapas.json'):
+		return salvar_dados_json('mapas.json', dados)
 
 def carregar_mapas():
-	dados = carregar_dados_json('mapas.json')
-	mapas = dados.get('mapas', [])
-	mapas_atualizados = []
-	houve_alteracoes = False
-	for mapa in mapas:
-		mapa_original = mapa.copy()
-		mapa_calculado = calcular_colunas_siisp(mapa)
-		mapas_atualizados.append(mapa_calculado)
-		campos_siisp = [
-			'cafe_interno_siisp', 'cafe_funcionario_siisp',
-			'almoco_interno_siisp', 'almoco_funcionario_siisp',
-			'lanche_interno_siisp', 'lanche_funcionario_siisp', 
-			'jantar_interno_siisp', 'jantar_funcionario_siisp'
-		]
-		for campo in campos_siisp:
-			if mapa_original.get(campo, []) != mapa_calculado.get(campo, []):
-				houve_alteracoes = True
-				break
-	if houve_alteracoes:
-		if salvar_mapas_atualizados(mapas_atualizados):
-			print("✅ Colunas SIISP calculadas e salvas automaticamente!")
-		else:
-			print("❌ Erro ao salvar colunas SIISP calculadas")
-	return mapas_atualizados
+	"""
+	Retorna os mapas do cache em memória, sem cópias nem gravações.
+	As colunas *_siisp são calculadas na gravação e pela migração de schema
+	(functions/migracoes.py); a lista retornada é somente leitura.
+	"""
+	return repositorio_mapas.listar()
 
 def obter_unidades_do_lote(lote_id):
 	lotes = carregar_lotes()
@@ -377,24 +318,94 @@ def obter_unidades_do_lote(lote_id):
 	return unidades_do_lote
 
 def obter_mapas_do_lote(lote_id, mes=None, ano=None):
-	mapas = carregar_mapas()
-	mapas_lote = [m for m in mapas if m['lote_id'] == lote_id]
+	mapas_lote = repositorio_mapas.mapas_do_lote(lote_id)
 	if mes is not None:
 		mapas_lote = [m for m in mapas_lote if m['mes'] == mes]
 	if ano is not None:
 		mapas_lote = [m for m in mapas_lote if m['ano'] == ano]
 	return mapas_lote
 
+def consultar_mapas_lote(lote_id, inicio=None, fim=None, unidades=None):
+	"""
+	Mapas do lote cujo mês cruza o período [inicio, fim] (datas) e cuja unidade
+	casa com alguma das informadas (mesma regra do filtro da página: igual ou
+	contida, sem diferenciar maiúsculas). Ordenados por (ano, mês, unidade).
+	"""
+	mes_inicio = (inicio.year, inicio.month) if inicio else None
+	mes_fim = (fim.year, fim.month) if fim else None
+	filtro_unidades = [u.strip().lower() for u in (unidades or []) if u.strip()]
+	mapas = []
+	for mapa in repositorio_mapas.mapas_do_lote(lote_id):
+		periodo = (mapa.get('ano') or 0, mapa.get('mes') or 0)
+		if mes_inicio and periodo < mes_inicio:
+			continue
+		if mes_fim and periodo > mes_fim:
+			continue
+		if filtro_unidades:
+			nome = (mapa.get('nome_unidade') or '').strip().lower()
+			if not any(nome == u or u in nome or nome in u for u in filtro_unidades):
+				continue
+		mapas.append(mapa)
+	mapas.sort(key=chave_ordem_mapa)
+	return mapas
+
+def chave_ordem_mapa(mapa):
+	return (mapa.get('ano') or 0, mapa.get('mes') or 0, mapa.get('nome_unidade') or '')
+
+def codificar_cursor(mapa):
+	chave = json.dumps(list(chave_ordem_mapa(mapa)), ensure_ascii=False)
+	return base64.urlsafe_b64encode(chave.encode('utf-8')).decode('ascii')
+
+def decodificar_cursor(cursor):
+	"""Chave (ano, mes, nome_unidade) do último mapa da página anterior; ValueError se inválido."""
+	try:
+		ano, mes, nome_unidade = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+	except Exception:
+		raise ValueError('cursor inválido')
+	return (ano, mes, nome_unidade)
+
+def paginar_mapas(mapas, cursor=None, limite=50):
+	"""
+	Página de mapas já ordenados por chave_ordem_mapa, começando depois do cursor.
+	Retorna (pagina, proximo_cursor), com proximo_cursor None na última página.
+	"""
+	inicio = 0
+	if cursor:
+		inicio = bisect.bisect_right([chave_ordem_mapa(m) for m in mapas], decodificar_cursor(cursor))
+	pagina = mapas[inicio:inicio + limite]
+	if inicio + limite < len(mapas):
+		return pagina, codificar_cursor(pagina[-1])
+	return pagina, None
+
+def _id_inteiro(usuario):
+	"""Campo 'id' do usuário como inteiro (aceita '12'), ou None."""
+	id_usuario = usuario.get('id')
+	if isinstance(id_usuario, str) and id_usuario.strip().isdigit():
+		return int(id_usuario)
+	return id_usuario if isinstance(id_usuario, int) and not isinstance(id_usuario, bool) else None
+
+def _maior_id_usuario():
+	"""
+	Maior id da coleção 'usuarios', pelo campo 'id' e pelo id do documento.
+	Usado na criação do contador contadores/usuarios e quando ele está atrasado.
+	"""
+	from .firestore_utils import db
+	maior = 0
+	for doc in db.collection('usuarios').stream():
+		for id_usuario in (_id_inteiro(doc.to_dict()), _id_inteiro({'id': doc.id})):
+			if id_usuario is not None and id_usuario > maior:
+				maior = id_usuario
+	return maior
+
+# Tentativas de cadastro quando o id do contador já está em uso
+TENTATIVAS_ID_USUARIO = 5
+
 def adicionar_usuario(dados_usuario):
 	"""
-	Adiciona um novo usuário na coleção 'usuarios' do Firestore.
+	Adiciona um novo usuário na coleção 'usuarios' do Firestore, no documento
+	str(id), com o id alocado pelo contador contadores/usuarios.
 	"""
-	usuarios = carregar_usuarios()
-	# Garante que só ids inteiros sejam usados para calcular o próximo id
-	ids_validos = [u.get('id', 0) for u in usuarios if isinstance(u.get('id', 0), int)]
-	proximo_id = (max(ids_validos) if ids_validos else 0) + 1
-	novo_usuario = {
-		'id': proximo_id,
+	campos = {
 		'nome': dados_usuario.get('nome', '').strip(),
 		'email': dados_usuario.get('email', '').strip().lower(),
 		'cpf': dados_usuario.get('cpf', '').strip(),
@@ -409,45 +420,73 @@ def adicionar_usuario(dados_usuario):
 		'data_cadastro': datetime.now().isoformat() + 'Z',
 		'acesso': False
 	}
-	# Salva diretamente no Firestore
-	ids = salvar_firestore('usuarios', novo_usuario)
-	if ids:
-		novo_usuario['firestore_id'] = ids[0]
-		return novo_usuario
+	# create() nunca sobrescreve: se o contador ficou atrás dos dados, ele é
+	# adiantado até o maior id existente e o cadastro tenta o próximo
+	for _ in range(TENTATIVAS_ID_USUARIO):
+		proximo_id = proximo_valor_contador('usuarios', _maior_id_usuario)
+		novo_usuario = {'id': proximo_id, **campos}
+		try:
+			criado = criar_firestore('usuarios', str(proximo_id), novo_usuario)
+		except Exception as e:
+			print(f"❌ Erro ao salvar usuário {proximo_id}: {e}")
+			return None
+		if criado:
+			invalidar_cache_usuarios()
+			novo_usuario['firestore_id'] = str(proximo_id)
+			indice_usuarios.registrar(novo_usuario)
+			return novo_usuario
+		print(f"⚠️ Id de usuário {proximo_id} já em uso: adiantando o contador")
+		elevar_valor_contador('usuarios', _maior_id_usuario())
+	print("❌ Não foi possível alocar um id para o novo usuário")
 	return None
 
 def buscar_usuario_por_email_ou_usuario(identificador):
 	"""
-	Busca usuário por email ou nome de usuário na coleção 'usuarios' do Firestore.
+	Busca usuário por email ou nome de usuário na coleção 'usuarios' do Firestore,
+	com consultas indexadas (limit 1) nos campos 'email' e 'usuario', gravados em
+	minúsculas por adicionar_usuario e salvar_usuarios. Usuários encontrados ficam em cache por
+	TTL_CACHE_USUARIOS segundos.
 	"""
-	usuarios = carregar_usuarios()
 	identificador = identificador.lower().strip()
-	return next((u for u in usuarios if 
-				u.get('email', '').lower() == identificador or 
-				u.get('usuario', '').lower() == identificador), None)
+	if not identificador:
+		return None
+	agora = time.monotonic()
+	with _cache_usuarios_lock:
+		item = _cache_usuarios.get(identificador)
+		if item is not None and item[0] > agora:
+			return dict(item[1])
+	usuario = None
+	for campo in CAMPOS_LOGIN:
+		encontrados = buscar_firestore('usuarios', campo, identificador)
+		if encontrados:
+			usuario = encontrados[0]
+			break
+	if usuario is None:
+		return None
+	with _cache_usuarios_lock:
+		if len(_cache_usuarios) >= _MAX_CACHE_USUARIOS:
+			for chave in [c for c, (expira_em, _) in _cache_usuarios.items() if expira_em <= agora]:
+				del _cache_usuarios[chave]
+			if len(_cache_usuarios) >= _MAX_CACHE_USUARIOS:
+				_cache_usuarios.clear()
+		_cache_usuarios[identificador] = (agora + TTL_CACHE_USUARIOS, usuario)
+	return dict(usuario)
 
 def validar_dados_unicos(dados_usuario, usuario_id=None):
 	"""
-	Valida dados únicos do usuário na coleção 'usuarios' do Firestore.
+	Valida dados únicos do usuário pelo índice em memória da coleção 'usuarios'
+	(functions/indice_usuarios.py), ignorando o próprio usuario_id.
 	"""
-	usuarios = carregar_usuarios()
 	erros = []
-	if usuario_id:
-		usuarios = [u for u in usuarios if u.get('id') != usuario_id]
-	email = dados_usuario.get('email', '').strip().lower()
-	if email and any(u.get('email', '').lower() == email for u in usuarios):
+	if indice_usuarios.existe('email', dados_usuario.get('email'), usuario_id):
 		erros.append('Este email já está cadastrado no sistema!')
-	cpf = dados_usuario.get('cpf', '').strip()
-	if cpf and any(u.get('cpf', '').strip() == cpf for u in usuarios):
+	if indice_usuarios.existe('cpf', dados_usuario.get('cpf'), usuario_id):
 		erros.append('Este CPF já está cadastrado no sistema!')
-	usuario = dados_usuario.get('usuario', '').strip().lower()
-	if usuario and any(u.get('usuario', '').lower() == usuario for u in usuarios):
+	if indice_usuarios.existe('usuario', dados_usuario.get('usuario'), usuario_id):
 		erros.append('Este nome de usuário já existe! Escolha outro.')
-	matricula = dados_usuario.get('matricula', '').strip()
-	if matricula and any(u.get('matricula', '').strip() == matricula for u in usuarios):
+	if indice_usuarios.existe('matricula', dados_usuario.get('matricula'), usuario_id):
 		erros.append('Esta matrícula já está cadastrada no sistema!')
-	telefone = dados_usuario.get('telefone', '').strip()
-	if telefone and any(u.get('telefone', '').strip() == telefone for u in usuarios):
+	if indice_usuarios.existe('telefone', dados_usuario.get('telefone'), usuario_id):
 		erros.append('Este telefone já está cadastrado no sistema!')
 	return erros
 
@@ -463,8 +502,10 @@ def atualizar_acesso_usuario(user_id, acesso):
 	if doc:
 		doc_ref = colecao_ref.document(doc.id)
 		doc_ref.update({'acesso': acesso})
+		invalidar_cache_usuarios()
 		usuario = doc.to_dict()
 		usuario['acesso'] = acesso
 		usuario['firestore_id'] = doc.id
+		indice_usuarios.registrar(usuario)
 		return usuario
 	return None
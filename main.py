@@ -1,13 +1,13 @@
 # ===== IMPORTS NECESSÁRIOS =====
-from flask import Flask, request, send_file, render_template, flash, redirect, url_for, session, jsonify
-import io
+from flask import Flask, request, send_file, render_template, flash, redirect, url_for, session, jsonify, Response
 import os
 import json
+import hashlib
+import shutil
+import click
 import calendar
 from datetime import datetime
 from functions.utils import (
-    carregar_dados_json,
-    salvar_dados_json,
     carregar_usuarios,
     salvar_usuarios,
     carregar_lotes,
@@ -18,18 +18,24 @@ from functions.utils import (
     migrar_dados_existentes,
     calcular_colunas_siisp,
     salvar_mapas_atualizados,
-    carregar_mapas,
     obter_unidades_do_lote,
-    obter_mapas_do_lote,
     adicionar_usuario,
     buscar_usuario_por_email_ou_usuario,
     validar_dados_unicos,
     atualizar_acesso_usuario,
-    filtro_mapa,
-    int_to_roman,
-    data_br_to_iso,
-    calcular_conformidade_lote
+    consultar_mapas_lote,
+    paginar_mapas
 )
+from functions.repositorio_mapas import repositorio_mapas
+from functions.migracoes import migrar_mapas, importar_json_para_sqlite
+from functions.indicadores import calcular_indicadores_lotes, resumo_dashboard
+from functions.resumos import resumos_mapas
+from functions.colunar import CAMPOS_SIISP, diferencas_siisp
+from functions.indice_usuarios import indice_usuarios
+from functions.exportacao import exportar_tabela_lote, ErroExportacao, MIMETYPE_XLSX
+from functions.tarefas_exportacao import fila_exportacoes
+from functions.exportacao_lotes import exportar_lotes_zip, MIMETYPE_ZIP
+from functions.exportacao_dados import exportar_csv_lote, exportar_parquet_lote, MIMETYPE_CSV, MIMETYPE_PARQUET
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
@@ -57,550 +63,137 @@ def exportar_tabela():
     data_fim = request.args.get('data_fim')
     unidades = request.args.get('unidades')
     unidades_list = unidades.split(',') if unidades else []
+    formato = request.args.get('formato', 'xlsx').lower()
+    if formato not in ('xlsx', 'csv', 'parquet'):
+        return ("Formato inválido: use xlsx, csv ou parquet.", 400)
 
-    # Carregar mapas do lote
-    mapas = carregar_dados_json('mapas.json').get('mapas', [])
-    lotes = carregar_lotes()
-    lote = next((l for l in lotes if l['id'] == lote_id), None)
-    precos = lote.get('precos', {}) if lote else {}
-
-    # Filtrar mapas conforme filtros
-    mapas_filtrados = [m for m in mapas if filtro_mapa(m, lote_id, unidades_list, data_inicio, data_fim)]
-
-    # Gerar Excel
-    from openpyxl import load_workbook
-    # Carregar modelo.xlsx
-    modelo_path = os.path.join(DADOS_DIR, 'modelo.xlsx')
-    wb = load_workbook(modelo_path)
-    # Seleciona a planilha COMPARATIVO
-    if 'COMPARATIVO' in wb.sheetnames:
-        ws1 = wb['COMPARATIVO']
-    else:
-        ws1 = wb.active
-        ws1.title = 'COMPARATIVO'
-
-    # Copiar conteúdo da planilha RESUMO do modelo.xlsx para a saída
-    if 'RESUMO' in wb.sheetnames:
-        # Preenche B8 com o número do contrato do lote
-        contrato_numero = lote.get('contrato', '') if lote else ''
-        ws_resumo_saida = wb['RESUMO']
-        ws_resumo_saida['B8'] = f"CONTRATO : {contrato_numero}"
-        ws_resumo_saida = wb['RESUMO']
-        # Preenche B7 com o texto dinâmico solicitado
-        empresa_nome = lote.get('empresa', '') if lote else ''
-        mes = None
-        ano = None
-        if mapas_filtrados:
-            mes = mapas_filtrados[0].get('mes')
-            ano = mapas_filtrados[0].get('ano')
-        # Mês em português
-        meses_pt = [
-            '', 'JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
-            'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO'
-        ]
-        mes_nome = meses_pt[mes] if mes and 1 <= mes <= 12 else ''
-        # Lote em romano
-        lote_romano = int_to_roman(lote_id) if lote_id else ''
-        texto_resumo = f"RESUMO FINAL LOTE {lote_romano} - EMPRESA {empresa_nome} - {mes_nome} {ano}".upper()
-        ws_resumo_saida['B7'] = texto_resumo
-
-        # Desmesclar todas as células mescladas que envolvem linha 13 ou abaixo nas colunas B a K (2 a 11)
-        for merged_range in list(ws_resumo_saida.merged_cells.ranges):
-            min_col = merged_range.min_col
-            max_col = merged_range.max_col
-            min_row = merged_range.min_row
-            max_row = merged_range.max_row
-            # Se QUALQUER parte do range está em linha 13 ou abaixo E coluna B a K
-            if max_row >= 13 and min_col >= 2 and max_col <= 11:
-                ws_resumo_saida.unmerge_cells(str(merged_range))
-        # Inserir linhas e preencher valores conforme quantidade de unidades filtradas
-        quantidade_unidades = len(unidades_list) if unidades_list else len(obter_unidades_do_lote(lote_id))
-        valores = list(range(1, quantidade_unidades + 1))
-        from copy import copy
-        estilo_b11 = ws_resumo_saida['B11']
-        if unidades_list:
-            nomes_unidades = unidades_list
-        else:
-            unidades_lote = obter_unidades_do_lote(lote_id)
-            # Se for lista de dicts, extrai nome; se for lista de strings, usa direto
-            if unidades_lote and isinstance(unidades_lote[0], dict):
-                nomes_unidades = [u.get('nome', '') for u in unidades_lote]
-            else:
-                nomes_unidades = unidades_lote
-        if quantidade_unidades == 1:
-            # B11: número, C11: nome da unidade
-            # Preencher B11:K11 com valores e estilo de B9
-            cell_b = ws_resumo_saida['B11']
-            cell_b.value = 1
-            cell_b.font = copy(estilo_b11.font)
-            cell_b.border = copy(estilo_b11.border)
-            cell_b.alignment = copy(estilo_b11.alignment)
-            cell_b.number_format = estilo_b11.number_format
-            cell_b.protection = copy(estilo_b11.protection)
-
-            # C11: nome da unidade
-            cell_c = ws_resumo_saida['C11']
-            cell_c.value = nomes_unidades[0] if nomes_unidades else ''
-            cell_c.font = copy(estilo_b11.font)
-            cell_c.border = copy(estilo_b11.border)
-            cell_c.alignment = copy(estilo_b11.alignment)
-            cell_c.number_format = estilo_b11.number_format
-            cell_c.protection = copy(estilo_b11.protection)
-
-            # D11: quantidade de café dos internos e E-K: refeições
-            colunas_refeicoes = [
-                ('cafe_interno', 'D'),
-                ('cafe_funcionario', 'E'),
-                ('almoco_interno', 'F'),
-                ('almoco_funcionario', 'G'),
-                ('lanche_interno', 'H'),
-                ('lanche_funcionario', 'I'),
-                ('jantar_interno', 'J'),
-                ('jantar_funcionario', 'K')
-            ]
-            for campo, col in colunas_refeicoes:
-                valor_ref = 0
-                if mapas_filtrados:
-                    nome_unidade = nomes_unidades[0] if nomes_unidades else ''
-                    mapa_ref = next((m for m in mapas_filtrados if m.get('nome_unidade') == nome_unidade), None)
-                    if mapa_ref:
-                        valor_ref = sum(mapa_ref.get(campo, []) or [])
-                cell = ws_resumo_saida[f'{col}11']
-                cell.value = valor_ref
-                cell.font = copy(estilo_b11.font)
-                cell.border = copy(estilo_b11.border)
-                cell.alignment = copy(estilo_b11.alignment)
-                cell.number_format = estilo_b11.number_format
-                cell.protection = copy(estilo_b11.protection)
-
-            # Remesclar células de B13 até B16
-            linha_inicio_merge = 13
-            ws_resumo_saida.merge_cells(start_row=linha_inicio_merge, start_column=2, end_row=linha_inicio_merge+3, end_column=2)
-
-            # Preencher preços do lote na linha correta (D13-K13 para 1 unidade)
-            precos_ordem_resumo = [
-                ('cafe', 'interno'),
-                ('cafe', 'funcionario'),
-                ('almoco', 'interno'),
-                ('almoco', 'funcionario'),
-                ('lanche', 'interno'),
-                ('lanche', 'funcionario'),
-                ('jantar', 'interno'),
-                ('jantar', 'funcionario')
-            ]
-            linha_precos = 13  # Para 1 unidade
-            for col_offset, (ref, tipo) in enumerate(precos_ordem_resumo):
-                col_precos = 4 + col_offset  # D=4, E=5, ..., K=11
-                valor_preco = precos.get(ref, {}).get(tipo, None)
-                cell = ws_resumo_saida.cell(row=linha_precos, column=col_precos, value=valor_preco)
-                cell_modelo = ws_resumo_saida.cell(row=13, column=4)
-                from copy import copy
-                cell.font = copy(cell_modelo.font)
-                cell.border = copy(cell_modelo.border)
-                cell.alignment = copy(cell_modelo.alignment)
-                cell.number_format = cell_modelo.number_format
-                cell.protection = copy(cell_modelo.protection)
-
-            # Preencher soma total de cada tipo de refeição nas colunas D-K na linha 14
-            colunas_refeicoes = [
-                ('cafe_interno', 4),
-                ('cafe_funcionario', 5),
-                ('almoco_interno', 6),
-                ('almoco_funcionario', 7),
-                ('lanche_interno', 8),
-                ('lanche_funcionario', 9),
-                ('jantar_interno', 10),
-                ('jantar_funcionario', 11)
-            ]
-            for campo, col_idx in colunas_refeicoes:
-                soma_total = 0
-                for nome_unidade in nomes_unidades:
-                    mapa_ref = next((m for m in mapas_filtrados if m.get('nome_unidade') == nome_unidade), None)
-                    if mapa_ref:
-                        soma_total += sum(mapa_ref.get(campo, []) or [])
-                cell_soma = ws_resumo_saida.cell(row=14, column=col_idx, value=soma_total)
-                cell_modelo = ws_resumo_saida.cell(row=14, column=col_idx)
-                from copy import copy
-                cell_soma.font = copy(cell_modelo.font)
-                cell_soma.border = copy(cell_modelo.border)
-                cell_soma.alignment = copy(cell_modelo.alignment)
-                cell_soma.number_format = cell_modelo.number_format
-                cell_soma.protection = copy(cell_modelo.protection)
-
-            # Preencher D15:K15 com o produto das células de D13:K13 (preços) e D14:K14 (somas)
-            for col_idx in range(4, 12):  # D=4, ..., K=11
-                preco = ws_resumo_saida.cell(row=13, column=col_idx).value
-                soma = ws_resumo_saida.cell(row=14, column=col_idx).value
-                produto = (preco if preco else 0) * (soma if soma else 0)
-                cell_produto = ws_resumo_saida.cell(row=15, column=col_idx, value=produto)
-                cell_modelo = ws_resumo_saida.cell(row=15, column=4)
-                cell_produto.font = copy(cell_modelo.font)
-                cell_produto.border = copy(cell_modelo.border)
-                cell_produto.alignment = copy(cell_modelo.alignment)
-                cell_produto.number_format = cell_modelo.number_format
-                cell_produto.protection = copy(cell_modelo.protection)
-
-            # Mesclar D16:K16 e preencher D16 com a soma de D15:K15
-            ws_resumo_saida.merge_cells('D16:K16')
-            soma_produtos = sum(ws_resumo_saida.cell(row=15, column=col_idx).value or 0 for col_idx in range(4, 12))
-            cell_soma_merged = ws_resumo_saida['D16']
-            cell_modelo = ws_resumo_saida.cell(row=16, column=4)
-            cell_soma_merged.value = soma_produtos
-            cell_soma_merged.font = copy(cell_modelo.font)
-            cell_soma_merged.border = copy(cell_modelo.border)
-            cell_soma_merged.alignment = copy(cell_modelo.alignment)
-            cell_soma_merged.number_format = cell_modelo.number_format
-            cell_soma_merged.protection = copy(cell_modelo.protection)
-        else:
-            ws_resumo_saida.insert_rows(11, amount=len(valores)-1)
-            for idx, valor in enumerate(valores):
-                # B: número
-                cell_b = ws_resumo_saida[f'B{11 + idx}']
-                cell_b.value = valor
-                cell_b.font = copy(estilo_b11.font)
-                cell_b.border = copy(estilo_b11.border)
-                cell_b.alignment = copy(estilo_b11.alignment)
-                cell_b.number_format = estilo_b11.number_format
-                cell_b.protection = copy(estilo_b11.protection)
-
-                # C: nome da unidade
-                cell_c = ws_resumo_saida[f'C{11 + idx}']
-                cell_c.value = nomes_unidades[idx] if idx < len(nomes_unidades) else ''
-                cell_c.font = copy(estilo_b11.font)
-                cell_c.border = copy(estilo_b11.border)
-                cell_c.alignment = copy(estilo_b11.alignment)
-                cell_c.number_format = estilo_b11.number_format
-                cell_c.protection = copy(estilo_b11.protection)
-
-                # D: quantidade de café dos internos e E-K: refeições
-                colunas_refeicoes = [
-                    ('cafe_interno', 'D'),
-                    ('cafe_funcionario', 'E'),
-                    ('almoco_interno', 'F'),
-                    ('almoco_funcionario', 'G'),
-                    ('lanche_interno', 'H'),
-                    ('lanche_funcionario', 'I'),
-                    ('jantar_interno', 'J'),
-                    ('jantar_funcionario', 'K')
-                ]
-                for campo, col in colunas_refeicoes:
-                    valor_ref = 0
-                    if mapas_filtrados:
-                        nome_unidade = nomes_unidades[idx] if idx < len(nomes_unidades) else ''
-                        mapa_ref = next((m for m in mapas_filtrados if m.get('nome_unidade') == nome_unidade), None)
-                        if mapa_ref:
-                            valor_ref = sum(mapa_ref.get(campo, []) or [])
-                    cell = ws_resumo_saida[f'{col}{11 + idx}']
-                    cell.value = valor_ref
-                    cell.font = copy(estilo_b11.font)
-                    cell.border = copy(estilo_b11.border)
-                    cell.alignment = copy(estilo_b11.alignment)
-                    cell.number_format = estilo_b11.number_format
-                    cell.protection = copy(estilo_b11.protection)
-
-            # Remesclar células de B16 até B19 (B16 = B13 + len(valores) - 1)
-            linha_inicio_merge = 13 + len(valores) - 1
-            ws_resumo_saida.merge_cells(start_row=linha_inicio_merge, start_column=2, end_row=linha_inicio_merge+3, end_column=2)
-
-            # Preencher preços do lote na linha correta (D14-K14 para 2 unidades, D15-K15 para 3, ...)
-            precos_ordem_resumo = [
-                ('cafe', 'interno'),
-                ('cafe', 'funcionario'),
-                ('almoco', 'interno'),
-                ('almoco', 'funcionario'),
-                ('lanche', 'interno'),
-                ('lanche', 'funcionario'),
-                ('jantar', 'interno'),
-                ('jantar', 'funcionario')
-            ]
-            linha_precos = 13 + (quantidade_unidades - 1)
-            for col_offset, (ref, tipo) in enumerate(precos_ordem_resumo):
-                col_precos = 4 + col_offset  # D=4, E=5, ..., K=11
-                valor_preco = precos.get(ref, {}).get(tipo, None)
-                cell = ws_resumo_saida.cell(row=linha_precos, column=col_precos, value=valor_preco)
-                cell_modelo = ws_resumo_saida.cell(row=13 + (quantidade_unidades - 1), column=4)
-                from copy import copy
-                cell.font = copy(cell_modelo.font)
-                cell.border = copy(cell_modelo.border)
-                cell.alignment = copy(cell_modelo.alignment)
-                cell.number_format = cell_modelo.number_format
-                cell.protection = copy(cell_modelo.protection)
-
-            # Preencher soma total de cada tipo de refeição nas colunas D-K na linha correta
-            linha_soma = 13 + quantidade_unidades  # D14 para 1 unidade, D15 para 2, ...
-            colunas_refeicoes = [
-                ('cafe_interno', 4),
-                ('cafe_funcionario', 5),
-                ('almoco_interno', 6),
-                ('almoco_funcionario', 7),
-                ('lanche_interno', 8),
-                ('lanche_funcionario', 9),
-                ('jantar_interno', 10),
-                ('jantar_funcionario', 11)
-            ]
-            for campo, col_idx in colunas_refeicoes:
-                soma_total = 0
-                for nome_unidade in nomes_unidades:
-                    mapa_ref = next((m for m in mapas_filtrados if m.get('nome_unidade') == nome_unidade), None)
-                    if mapa_ref:
-                        soma_total += sum(mapa_ref.get(campo, []) or [])
-                cell_soma = ws_resumo_saida.cell(row=linha_soma, column=col_idx, value=soma_total)
-                cell_modelo = ws_resumo_saida.cell(row=14 + quantidade_unidades - 1, column=col_idx)
-                from copy import copy
-                cell_soma.font = copy(cell_modelo.font)
-                cell_soma.border = copy(cell_modelo.border)
-                cell_soma.alignment = copy(cell_modelo.alignment)
-                cell_soma.number_format = cell_modelo.number_format
-                cell_soma.protection = copy(cell_modelo.protection)
-            
-            # Preencher Dn:Kn com o produto das células de Dn-1:Kn-1 (preços) e D14n-2:K14n-2 (somas)
-            for col_idx in range(4, 12):  # D=4, ..., K=11
-                preco = ws_resumo_saida.cell(row=13+quantidade_unidades-1, column=col_idx).value
-                soma = ws_resumo_saida.cell(row=14+quantidade_unidades-1, column=col_idx).value
-                produto = (preco if preco else 0) * (soma if soma else 0)
-                cell_produto = ws_resumo_saida.cell(row=15+quantidade_unidades-1, column=col_idx, value=produto)
-                cell_modelo = ws_resumo_saida.cell(row=15 + quantidade_unidades - 1, column=col_idx)
-                cell_produto.font = copy(cell_modelo.font)
-                cell_produto.border = copy(cell_modelo.border)
-                cell_produto.alignment = copy(cell_modelo.alignment)
-                cell_produto.number_format = cell_modelo.number_format
-                cell_produto.protection = copy(cell_modelo.protection)
-            
-            # Mesclar Dn:Kn e preencher Dn com a soma de Dn-1:Kn-1
-            cell_init = f'D{16 + quantidade_unidades - 1}'
-            cell_end = f'K{16 + quantidade_unidades - 1}'
-            ws_resumo_saida.merge_cells(f'{cell_init}:{cell_end}')
-            soma_produtos = sum(ws_resumo_saida.cell(row=15 + quantidade_unidades - 1, column=col_idx).value or 0 for col_idx in range(4, 12))
-            cell_soma_merged = ws_resumo_saida[cell_init]
-            cell_modelo = ws_resumo_saida.cell(row=16 + quantidade_unidades - 1, column=4)
-            cell_soma_merged.value = soma_produtos
-            cell_soma_merged.font = copy(cell_modelo.font)
-            cell_soma_merged.border = copy(cell_modelo.border)
-            cell_soma_merged.alignment = copy(cell_modelo.alignment)
-            cell_soma_merged.number_format = cell_modelo.number_format
-            cell_soma_merged.protection = copy(cell_modelo.protection)
-
-    # Preencher preços do lote nas células M6 até T6
-    # Ordem: Café Interno, Café Func., Almoço Interno, Almoço Func., Lanche Interno, Lanche Func., Jantar Interno, Jantar Func.
-    precos_ordem = [
-        ('cafe', 'interno'),
-        ('cafe', 'funcionario'),
-        ('almoco', 'interno'),
-        ('almoco', 'funcionario'),
-        ('lanche', 'interno'),
-        ('lanche', 'funcionario'),
-        ('jantar', 'interno'),
-        ('jantar', 'funcionario')
-    ]
-    col_inicio = 13  # M = 13
-    from copy import copy
-    for idx, (ref, tipo) in enumerate(precos_ordem):
-        col = col_inicio + idx
-        valor_preco = precos.get(ref, {}).get(tipo, None)
-        cell_preco = ws1.cell(row=6, column=col, value=valor_preco)
-        # Copiar formatação da célula original
-        cell_modelo = ws1.cell(row=6, column=col)
-        cell_preco.font = copy(cell_modelo.font)
-        cell_preco.border = copy(cell_modelo.border)
-        cell_preco.alignment = copy(cell_modelo.alignment)
-        cell_preco.number_format = 'General'
-        cell_preco.protection = copy(cell_modelo.protection)
-
-    # Buscar cabeçalho 'LOCAÇÃO' nas primeiras 20 linhas
-    header = None
-    idx_locacao = None
-    header_row = None
-    for r in range(1, 21):
-        row_values = [cell.value for cell in ws1[r]]
-        if row_values and 'LOCAÇÃO' in row_values:
-            header = row_values
-            idx_locacao = row_values.index('LOCAÇÃO')
-            header_row = r
-            break
-
-    if header is None:
-        # Não encontrou cabeçalho, aborta preenchimento
-        return ("Cabeçalho LOCAÇÃO não encontrado no modelo.", 400)
-    # Se não houver dados filtrados, retorna mensagem
-    tem_dados = False
-
-    # Preencher linhas a partir da linha 12 (após cabeçalho mesclado B9:B11)
-    linha = 12
-    lote_nome = f"LOTE {lote_id}"
-    # Captura o estilo da primeira célula das colunas LOCAÇÃO e UNIDADE
-    from copy import copy
-    locacao_col = idx_locacao + 1
-    primeira_locacao = ws1.cell(row=header_row, column=locacao_col)
-    locacao_style = {
-        'font': copy(primeira_locacao.font),
-        'border': copy(primeira_locacao.border),
-        'alignment': copy(primeira_locacao.alignment),
-        'number_format': primeira_locacao.number_format,
-        'protection': copy(primeira_locacao.protection)
-    }
-
-    # Detectar índice da coluna UNIDADE
-    idx_unidade = None
-    for i, col_name in enumerate(header):
-        if col_name and str(col_name).strip().upper() == 'UNIDADE':
-            idx_unidade = i
-            break
-    unidade_style = None
-    if idx_unidade is not None:
-        unidade_col = idx_unidade + 1
-        primeira_unidade = ws1.cell(row=header_row, column=unidade_col)
-        unidade_style = {
-            'font': copy(primeira_unidade.font),
-            'border': copy(primeira_unidade.border),
-            'alignment': copy(primeira_unidade.alignment),
-            'number_format': primeira_unidade.number_format,
-            'protection': copy(primeira_unidade.protection)
-        }
-
-    # Preencher LOCAÇÃO, UNIDADE e SIISP (coluna C) a partir da linha 12
-    linha = 12
-    tem_dados = False
-    # Copiar formatação da célula A12
-    a12 = ws1.cell(row=12, column=1)
-    style_a12 = {
-        'font': copy(a12.font),
-        'border': copy(a12.border),
-        'alignment': copy(a12.alignment),
-        'number_format': a12.number_format,
-        'protection': copy(a12.protection)
-    }
-
-    for mapa in mapas_filtrados:
-        unidade_nome = mapa.get('nome_unidade', '')
-        lote_nome = f"LOTE {lote_id}"
-        n_siisp = mapa.get('n_siisp', [])
-        datas = mapa.get('data', [])
-        # Aplica filtro de unidade
-        if unidades_list and unidade_nome not in unidades_list:
-            continue
-        for i, valor in enumerate(n_siisp):
-            # Aplica filtro de data
-            if i < len(datas):
-                data_iso = data_br_to_iso(datas[i])
-                if data_inicio and data_fim:
-                    if not (data_inicio <= data_iso <= data_fim):
-                        continue
-            # LOCAÇÃO (coluna idx_locacao+1), UNIDADE (coluna idx_unidade+1), SIISP (coluna 3)
-            if idx_locacao is not None:
-                cell_locacao = ws1.cell(row=linha, column=idx_locacao+1, value=lote_nome)
-                cell_locacao.font = style_a12['font']
-                cell_locacao.border = style_a12['border']
-                cell_locacao.alignment = style_a12['alignment']
-                cell_locacao.number_format = style_a12['number_format']
-                cell_locacao.protection = style_a12['protection']
-            if idx_unidade is not None:
-                cell_unidade = ws1.cell(row=linha, column=idx_unidade+1, value=unidade_nome)
-                cell_unidade.font = style_a12['font']
-                cell_unidade.border = style_a12['border']
-                cell_unidade.alignment = style_a12['alignment']
-                cell_unidade.number_format = style_a12['number_format']
-                cell_unidade.protection = style_a12['protection']
-            cell_siisp = ws1.cell(row=linha, column=3, value=valor)
-            cell_siisp.font = style_a12['font']
-            cell_siisp.border = style_a12['border']
-            cell_siisp.alignment = style_a12['alignment']
-            cell_siisp.number_format = 'General'
-            cell_siisp.protection = style_a12['protection']
-
-            # Preencher coluna D (Data) com formatação de A12, salvando como data
-            data_val = datas[i] if i < len(datas) else ''
-            cell_data = ws1.cell(row=linha, column=4, value=data_val)
-            cell_data.font = style_a12['font']
-            cell_data.border = style_a12['border']
-            cell_data.alignment = style_a12['alignment']
-            cell_data.number_format = 'DD/MM/YYYY'  # Formato de data brasileiro
-            cell_data.protection = style_a12['protection']
-
-            # Preencher colunas E-L com dados das refeições, todos como números
-            colunas_refeicoes = [
-                ('cafe_interno', 5),
-                ('cafe_funcionario', 6),
-                ('almoco_interno', 7),
-                ('almoco_funcionario', 8),
-                ('lanche_interno', 9),
-                ('lanche_funcionario', 10),
-                ('jantar_interno', 11),
-                ('jantar_funcionario', 12)
-            ]
-            for campo, col in colunas_refeicoes:
-                valor_refeicao = mapa.get(campo, [])[i] if i < len(mapa.get(campo, [])) else None
-                cell_refeicao = ws1.cell(row=linha, column=col, value=valor_refeicao)
-                cell_refeicao.font = style_a12['font']
-                cell_refeicao.border = style_a12['border']
-                cell_refeicao.alignment = style_a12['alignment']
-                cell_refeicao.number_format = 'General'
-                cell_refeicao.protection = style_a12['protection']
-
-            linha += 1
-            tem_dados = True
-
-    if not tem_dados:
-        return ("Nenhum dado SIISP encontrado para os filtros selecionados.", 404)
-
-    # Copiar fórmulas de M12:T12 para as linhas de dados preenchidas
-    linhas_preenchidas = linha - 12  # linha é incrementada após cada preenchimento
-    for offset in range(1, linhas_preenchidas):
-        target_row = 12 + offset
-        for col in range(13, 21):  # M=13, T=20
-            formula_or_value = ws1.cell(row=12, column=col).value
-            if ws1.cell(row=12, column=col).data_type == 'f':
-                # Se for fórmula, ajustar referência de linha
-                import re
-                def ajusta_formula(formula, linha_origem, linha_destino):
-                    return re.sub(r'(\D)'+str(linha_origem)+r'(\D|$)', lambda m: m.group(1)+str(linha_destino)+m.group(2), formula)
-                formula_ajustada = ajusta_formula(formula_or_value, 12, target_row)
-                ws1.cell(row=target_row, column=col, value=formula_ajustada)
-                ws1.cell(row=target_row, column=col).data_type = 'f'
-            else:
-                ws1.cell(row=target_row, column=col, value=formula_or_value)
-            # Copiar formatação
-            cell_modelo = ws1.cell(row=12, column=col)
-            cell_dest = ws1.cell(row=target_row, column=col)
-            from copy import copy
-            cell_dest.font = copy(cell_modelo.font)
-            cell_dest.border = copy(cell_modelo.border)
-            cell_dest.alignment = copy(cell_modelo.alignment)
-            cell_dest.number_format = cell_modelo.number_format
-            cell_dest.protection = copy(cell_modelo.protection)
-
-    # Copiar regras de formatação condicional de M12:T12 para as linhas de dados preenchidas
-    for col in range(13, 21):  # M=13, T=20
-        cell_coord = ws1.cell(row=12, column=col).coordinate
-        # Coletar regras relevantes sem modificar durante iteração
-        regras_para_copiar = []
-        for cf_rule in ws1.conditional_formatting:
-            if cell_coord in cf_rule.cells:
-                for rule in cf_rule.rules:
-                    regras_para_copiar.append(rule)
-        # Agora replica as regras para as células de destino
-        for rule in regras_para_copiar:
-            for target_row in range(13, linha):
-                target_coord = ws1.cell(row=target_row, column=col).coordinate
-                ws1.conditional_formatting.add(target_coord, rule)
-
-    # Salvar em memória e retornar arquivo
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    # Nome do arquivo
-    nome_arquivo = f"tabela_lote_{lote_id}"
-    if data_inicio and data_fim:
-        nome_arquivo += f"_{data_inicio}_a_{data_fim}"
-    nome_arquivo += ".xlsx"
+    try:
+        if formato == 'csv':
+            # Dados brutos, enviados linha a linha sem montar o arquivo
+            linhas, nome_arquivo = exportar_csv_lote(lote_id, data_inicio, data_fim, unidades_list)
+            return Response(
+                linhas,
+                mimetype=MIMETYPE_CSV,
+                headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"'}
+            )
+        if formato == 'parquet':
+            arquivo, nome_arquivo = exportar_parquet_lote(lote_id, data_inicio, data_fim, unidades_list)
+            return send_file(arquivo, mimetype=MIMETYPE_PARQUET, as_attachment=True, download_name=nome_arquivo)
+        # Planilha gerada em modo streaming (functions/exportacao.py)
+        arquivo, nome_arquivo = exportar_tabela_lote(lote_id, data_inicio, data_fim, unidades_list)
+    except ErroExportacao as e:
+        return (str(e), e.status)
 
     return send_file(
-        output,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        arquivo,
+        mimetype=MIMETYPE_XLSX,
         as_attachment=True,
         download_name=nome_arquivo
     )
 
+# ===== EXPORTAÇÃO EM MASSA (VÁRIOS LOTES E MESES) =====
+def lotes_da_query(valor):
+    """'1,2,3' -> [1, 2, 3]; vazio -> [] (todos os lotes)"""
+    return [int(v) for v in valor.split(',') if v.strip()] if valor else []
+
+@app.route('/exportar-lotes', methods=['GET', 'POST'])
+def exportar_lotes():
+    """
+    Cria em segundo plano o ZIP com uma planilha por lote e mês do período (lotes=1,2,3
+    opcional; data_inicio e data_fim obrigatórios). Retorna a tarefa, como /api/exportacoes.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    try:
+        lote_ids = lotes_da_query(request.values.get('lotes'))
+    except ValueError:
+        return jsonify({'error': 'lotes deve ser uma lista de IDs separados por vírgula'}), 400
+    
+    try:
+        tarefa = fila_exportacoes.enviar_lotes(
+            lote_ids,
+            request.values.get('data_inicio'),
+            request.values.get('data_fim'),
+            usuario_id=session.get('usuario_id')
+        )
+    except ErroExportacao as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify(estado_exportacao(tarefa)), 202
+
+# ===== EXPORTAÇÃO EM SEGUNDO PLANO =====
+def estado_exportacao(tarefa):
+    """Dados públicos da tarefa de exportação (sem chave de cache nem usuário)"""
+    resposta = {
+        'id': tarefa['id'],
+        'status': tarefa['status'],
+        'nome_arquivo': tarefa['nome_arquivo'],
+        'erro': tarefa['erro'],
+        'url_status': url_for('api_status_exportacao', tarefa_id=tarefa['id'])
+    }
+    if tarefa['status'] == 'concluida':
+        resposta['url_download'] = url_for('api_baixar_exportacao', tarefa_id=tarefa['id'])
+    return resposta
+
+def tarefa_do_usuario(tarefa_id):
+    tarefa = fila_exportacoes.consultar(tarefa_id)
+    if tarefa is None or tarefa['usuario_id'] != session.get('usuario_id'):
+        return None
+    return tarefa
+
+@app.route('/api/exportacoes', methods=['POST'])
+def api_criar_exportacao():
+    """Cria uma exportação em segundo plano (mesmos filtros de /exportar-tabela) e retorna o id da tarefa"""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    dados = request.get_json(silent=True) or request.form
+    try:
+        lote_id = int(dados.get('lote_id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'lote_id é obrigatório e deve ser um número'}), 400
+    unidades = dados.get('unidades') or []
+    if isinstance(unidades, str):
+        unidades = unidades.split(',')
+    
+    tarefa = fila_exportacoes.enviar(
+        lote_id,
+        dados.get('data_inicio') or None,
+        dados.get('data_fim') or None,
+        [u for u in unidades if u],
+        usuario_id=session.get('usuario_id')
+    )
+    return jsonify(estado_exportacao(tarefa)), 202
+
+@app.route('/api/exportacoes/<tarefa_id>')
+def api_status_exportacao(tarefa_id):
+    """Status de uma exportação: pendente, processando, concluida ou erro"""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    tarefa = tarefa_do_usuario(tarefa_id)
+    if tarefa is None:
+        return jsonify({'error': 'Exportação não encontrada'}), 404
+    return jsonify(estado_exportacao(tarefa))
+
+@app.route('/api/exportacoes/<tarefa_id>/arquivo')
+def api_baixar_exportacao(tarefa_id):
+    """Download do arquivo de uma exportação concluída"""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    tarefa = tarefa_do_usuario(tarefa_id)
+    if tarefa is None:
+        return jsonify({'error': 'Exportação não encontrada'}), 404
+    if tarefa['status'] != 'concluida':
+        return jsonify({'error': 'Exportação ainda não concluída', 'status': tarefa['status']}), 409
+    resultado = fila_exportacoes.arquivo(tarefa_id)
+    if resultado is None:
+        return jsonify({'error': 'Arquivo expirado, solicite a exportação novamente'}), 410
+    caminho, nome_arquivo = resultado
+    mimetype = MIMETYPE_ZIP if tarefa.get('formato') == 'zip' else MIMETYPE_XLSX
+    return send_file(caminho, mimetype=mimetype, as_attachment=True, download_name=nome_arquivo)
+
 # Dados simulados temporários (até criarmos os JSONs)
 
 # ===== ROTAS DA APLICAÇÃO =====
@@ -747,9 +340,8 @@ def dashboard():
     # Capturar flag de login_sucesso antes de limpar
     mostrar_sucesso = session.pop('login_sucesso', False)
     
-    # Carregar lotes e mapas do arquivo JSON
+    # Carregar lotes; os números do resumo vêm de /api/dashboard/resumo
     lotes = carregar_lotes()
-    mapas = carregar_mapas()
     
     # Dados para o dashboard
     context = {
@@ -758,8 +350,7 @@ def dashboard():
         'lotes': lotes,
         'total_lotes': len(lotes),
         'lotes_ativos': len([l for l in lotes if l.get('ativo', False)]),
-        'total_unidades': sum(len(l.get('unidades', [])) for l in lotes),
-        'mapas_dados': mapas  # Passar dados dos mapas para o frontend
+        'total_unidades': sum(len(l.get('unidades', [])) for l in lotes)
     }
     
     return render_template('dashboard.html', **context)
@@ -771,91 +362,8 @@ def lotes():
         flash('Acesso negado. Faça login primeiro.', 'warning')
         return redirect(url_for('login'))
     
-    # Carregar lotes do arquivo JSON
-    lotes = carregar_lotes()
-    mapas = carregar_mapas()
-
-
-    # Atualiza cada lote com conformidade calculada
-    for lote in lotes:
-        # Inicialização de variáveis para todos os cálculos
-        lote_id = lote.get('id')
-        mapas_lote = [m for m in mapas if m.get('lote_id') == lote_id]
-        meses_distintos = set()
-        precos = lote.get('precos', {})
-
-        # Cálculo de desvio/mês
-        valor_desvio_total = 0
-        for mapa in mapas_lote:
-            for campo, preco in [
-                ('cafe_interno_siisp', precos.get('cafe', {}).get('interno', 0)),
-                ('cafe_funcionario_siisp', precos.get('cafe', {}).get('funcionario', 0)),
-                ('almoco_interno_siisp', precos.get('almoco', {}).get('interno', 0)),
-                ('almoco_funcionario_siisp', precos.get('almoco', {}).get('funcionario', 0)),
-                ('lanche_interno_siisp', precos.get('lanche', {}).get('interno', 0)),
-                ('lanche_funcionario_siisp', precos.get('lanche', {}).get('funcionario', 0)),
-                ('jantar_interno_siisp', precos.get('jantar', {}).get('interno', 0)),
-                ('jantar_funcionario_siisp', precos.get('jantar', {}).get('funcionario', 0)),
-            ]:
-                valores = mapa.get(campo, [])
-                valor_desvio_total += sum([v for v in valores if v > 0]) * preco if valores else 0
-            # Adiciona mês/ano do mapa
-            mes = mapa.get('mes')
-            ano = mapa.get('ano')
-            if mes and ano:
-                meses_distintos.add(f"{mes:02d}/{ano}")
-        # Cálculo de meses cadastrados
-        lote['meses_cadastrados'] = len(meses_distintos)
-        if meses_distintos:
-            lote['desvio_mes'] = round(valor_desvio_total / len(meses_distintos), 2)
-        else:
-            lote['desvio_mes'] = 0
-
-        conf = calcular_conformidade_lote(lote)
-        lote['conformidade'] = conf if conf is not None else 'N/A'
-
-        # Cálculo de refeições/mês
-        total_refeicoes = 0
-        for mapa in mapas_lote:
-            for campo in [
-                'cafe_interno', 'cafe_funcionario',
-                'almoco_interno', 'almoco_funcionario',
-                'lanche_interno', 'lanche_funcionario',
-                'jantar_interno', 'jantar_funcionario'
-            ]:
-                valores = mapa.get(campo, [])
-                total_refeicoes += sum(valores) if valores else 0
-            # Adiciona mês/ano do mapa
-            mes = mapa.get('mes')
-            ano = mapa.get('ano')
-            if mes and ano:
-                meses_distintos.add(f"{mes:02d}/{ano}")
-        # Calcula refeições/mês
-        if meses_distintos:
-            lote['refeicoes_mes'] = int(total_refeicoes / len(meses_distintos))
-        else:
-            lote['refeicoes_mes'] = 0
-
-        # Cálculo de custo/mês
-        precos = lote.get('precos', {})
-        valor_total = 0
-        for mapa in mapas_lote:
-            for campo, preco in [
-                ('cafe_interno', precos.get('cafe', {}).get('interno', 0)),
-                ('cafe_funcionario', precos.get('cafe', {}).get('funcionario', 0)),
-                ('almoco_interno', precos.get('almoco', {}).get('interno', 0)),
-                ('almoco_funcionario', precos.get('almoco', {}).get('funcionario', 0)),
-                ('lanche_interno', precos.get('lanche', {}).get('interno', 0)),
-                ('lanche_funcionario', precos.get('lanche', {}).get('funcionario', 0)),
-                ('jantar_interno', precos.get('jantar', {}).get('interno', 0)),
-                ('jantar_funcionario', precos.get('jantar', {}).get('funcionario', 0)),
-            ]:
-                valores = mapa.get(campo, [])
-                valor_total += sum(valores) * preco if valores else 0
-        if meses_distintos:
-            lote['custo_mes'] = round(valor_total / len(meses_distintos), 2)
-        else:
-            lote['custo_mes'] = 0
+    # Carregar lotes e calcular os indicadores de todos eles numa única passada pelos mapas
+    lotes = calcular_indicadores_lotes(carregar_lotes())
 
     empresas = sorted(set(lote.get('empresa', '').strip() for lote in lotes if lote.get('empresa')))
     context = {
@@ -883,13 +391,10 @@ def lote_detalhes(lote_id):
     # Obter unidades do lote com join dos dados
     unidades_lote = obter_unidades_do_lote(lote_id)
     
-    # Obter TODOS os mapas do lote (todos os meses disponíveis)
-    mapas_lote = obter_mapas_do_lote(lote_id)
-    
+    # Os mapas do período selecionado são buscados pela página em /api/lote/<id>/mapas
     context = {
         'lote': lote,
-        'unidades_lote': unidades_lote,
-        'mapas_lote': mapas_lote
+        'unidades_lote': unidades_lote
     }
     
     return render_template('lote-detalhes.html', **context)
@@ -956,6 +461,27 @@ def revogar_usuario(user_id):
     
     return jsonify({'error': 'Usuário não encontrado'}), 404
 
+@app.route('/admin/cache')
+def admin_cache():
+    """Estatísticas do cache em memória dos mapas (hits/misses)"""
+    if 'usuario_id' not in session or session.get('usuario_id') != 1:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    return jsonify({
+        'mapas': repositorio_mapas.estatisticas(),
+        'resumos': resumos_mapas.estatisticas(),
+        'exportacoes': fila_exportacoes.estatisticas()
+    })
+
+@app.route('/admin/resumos/reconstruir', methods=['POST'])
+def admin_reconstruir_resumos():
+    """Recalcula todos os resumos dos mapas a partir dos dados em disco (os demais workers, na próxima consulta)"""
+    if 'usuario_id' not in session or session.get('usuario_id') != 1:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    total = resumos_mapas.reconstruir()
+    return jsonify({'success': True, 'total_resumos': total})
+
 # ===== ROTAS DE API (JSON) =====
 
 @app.route('/api/adicionar-dados', methods=['POST'])
@@ -1006,35 +532,11 @@ def api_adicionar_dados():
         except ValueError:
             return jsonify({'error': 'Lote ID, mês e ano devem ser números'}), 400
         
-        # Carregar dados existentes do arquivo mapas.json
-        dados_mapas = carregar_dados_json('mapas.json')
-        if 'mapas' not in dados_mapas:
-            dados_mapas['mapas'] = []
-        
         # Verificar se já existe registro para esta unidade, mês, ano e lote
-        registro_existente_index = None
-        for i, registro in enumerate(dados_mapas['mapas']):
-            if (registro.get('nome_unidade') == nome_unidade and 
-                registro.get('mes') == mes and 
-                registro.get('ano') == ano and
-                registro.get('lote_id') == lote_id):
-                registro_existente_index = i
-                break
-        
-        # Se existe registro para esta unidade/mês/ano/lote, usar o mesmo ID
-        if registro_existente_index is not None:
-            # Manter o ID do registro existente
-            id_a_usar = dados_mapas['mapas'][registro_existente_index].get('id', 1)
-            # Remover o registro antigo
-            dados_mapas['mapas'].pop(registro_existente_index)
+        # (o repositório mantém o ID existente ou gera maior ID + 1 ao salvar)
+        if repositorio_mapas.obter(lote_id, ano, mes, nome_unidade) is not None:
             print(f"🔄 Substituindo registro existente para {nome_unidade} - {mes}/{ano} (Lote {lote_id})")
         else:
-            # Gerar novo ID único (baseado no maior ID existente + 1)
-            maior_id = 0
-            for registro in dados_mapas['mapas']:
-                if 'id' in registro and registro['id'] > maior_id:
-                    maior_id = registro['id']
-            id_a_usar = maior_id + 1
             print(f"✨ Criando novo registro para {nome_unidade} - {mes}/{ano} (Lote {lote_id})")
         
         # Gerar lista de datas do mês
@@ -1087,7 +589,7 @@ def api_adicionar_dados():
         
         # SE DADOS VÁLIDOS, PREPARAR E SALVAR
         novo_registro = {
-            'id': id_a_usar,
+            'id': None,
             'lote_id': lote_id,
             'mes': mes,
             'ano': ano,
@@ -1119,11 +621,8 @@ def api_adicionar_dados():
         # Usar a função para calcular as colunas SIISP
         novo_registro = calcular_colunas_siisp(novo_registro)
         
-        # Adicionar novo registro
-        dados_mapas['mapas'].append(novo_registro)
-        
-        # Salvar no arquivo mapas.json
-        if salvar_dados_json('mapas.json', dados_mapas):
+        # Inserir ou substituir o registro e salvar no arquivo mapas.json
+        if repositorio_mapas.salvar_mapa(novo_registro) is not None:
             print(f"✅ Dados salvos com sucesso em mapas.json:")
             print(f"   Lote ID: {lote_id}")
             print(f"   Mês: {mes}, Ano: {ano} ({dias_esperados} dias)")
@@ -1187,23 +686,8 @@ def api_excluir_dados():
         except ValueError:
             return jsonify({'error': 'Lote ID, mês e ano devem ser números'}), 400
         
-        # Carregar dados existentes do arquivo mapas.json
-        dados_mapas = carregar_dados_json('mapas.json')
-        if 'mapas' not in dados_mapas:
-            dados_mapas['mapas'] = []
-        
-        # Procurar pelo registro específico para excluir
-        registro_encontrado = None
-        registro_index = None
-        
-        for i, registro in enumerate(dados_mapas['mapas']):
-            if (registro.get('nome_unidade') == nome_unidade and 
-                registro.get('mes') == mes and 
-                registro.get('ano') == ano and
-                registro.get('lote_id') == lote_id):
-                registro_encontrado = registro
-                registro_index = i
-                break
+        # Remover o registro específico e salvar dados atualizados
+        registro_encontrado = repositorio_mapas.excluir_mapa(lote_id, ano, mes, nome_unidade)
         
         # Verificar se o registro foi encontrado
         if registro_encontrado is None:
@@ -1213,18 +697,14 @@ def api_excluir_dados():
                 'error': f'Registro não encontrado para {nome_unidade} em {mes}/{ano}'
             }), 404
         
-        # Remover o registro da lista
-        dados_mapas['mapas'].pop(registro_index)
-        
-        # Salvar dados atualizados
-        sucesso_salvamento = salvar_dados_json('mapas.json', dados_mapas)
+        sucesso_salvamento = registro_encontrado is not False
         
         if sucesso_salvamento:
             print(f"✅ Registro excluído com sucesso:")
             print(f"   Lote ID: {lote_id}")
             print(f"   Período: {mes}/{ano}")
             print(f"   Unidade: {nome_unidade}")
-            print(f"   Total de registros restantes: {len(dados_mapas['mapas'])}")
+            print(f"   Total de registros restantes: {len(repositorio_mapas.listar())}")
             
             return jsonify({
                 'success': True,
@@ -1280,35 +760,11 @@ def api_entrada_manual():
         except ValueError:
             return jsonify({'error': 'Lote ID, mês e ano devem ser números'}), 400
         
-        # Carregar dados existentes do arquivo mapas.json
-        dados_mapas = carregar_dados_json('mapas.json')
-        if 'mapas' not in dados_mapas:
-            dados_mapas['mapas'] = []
-        
         # Verificar se já existe registro para esta unidade, mês, ano e lote
-        registro_existente_index = None
-        for i, registro in enumerate(dados_mapas['mapas']):
-            if (registro.get('nome_unidade') == nome_unidade and 
-                registro.get('mes') == mes and 
-                registro.get('ano') == ano and
-                registro.get('lote_id') == lote_id):
-                registro_existente_index = i
-                break
-        
-        # Se existe registro para esta unidade/mês/ano/lote, usar o mesmo ID
-        if registro_existente_index is not None:
-            # Manter o ID do registro existente
-            id_a_usar = dados_mapas['mapas'][registro_existente_index].get('id', 1)
-            # Remover o registro antigo
-            dados_mapas['mapas'].pop(registro_existente_index)
+        # (o repositório mantém o ID existente ou gera maior ID + 1 ao salvar)
+        if repositorio_mapas.obter(lote_id, ano, mes, nome_unidade) is not None:
             print(f"🔄 Substituindo registro existente para {nome_unidade} - {mes}/{ano} (Lote {lote_id})")
         else:
-            # Gerar novo ID único (baseado no maior ID existente + 1)
-            maior_id = 0
-            for registro in dados_mapas['mapas']:
-                if 'id' in registro and registro['id'] > maior_id:
-                    maior_id = registro['id']
-            id_a_usar = maior_id + 1
             print(f"✨ Criando novo registro para {nome_unidade} - {mes}/{ano} (Lote {lote_id})")
         
         # Gerar lista de datas do mês automaticamente (formato DD/MM/YYYY)
@@ -1350,7 +806,7 @@ def api_entrada_manual():
         
         # Criar novo registro
         novo_registro = {
-            'id': id_a_usar,
+            'id': None,
             'lote_id': lote_id,
             'mes': mes,
             'ano': ano,
@@ -1372,11 +828,8 @@ def api_entrada_manual():
         print(f"🔢 Calculando colunas SIISP automaticamente com lista de zeros...")
         novo_registro = calcular_colunas_siisp(novo_registro)
         
-        # Adicionar novo registro
-        dados_mapas['mapas'].append(novo_registro)
-        
-        # Salvar no arquivo mapas.json
-        if salvar_dados_json('mapas.json', dados_mapas):
+        # Inserir ou substituir o registro e salvar no arquivo mapas.json
+        if repositorio_mapas.salvar_mapa(novo_registro) is not None:
             print(f"✅ Entrada manual salva com sucesso em mapas.json:")
             print(f"   Lote ID: {lote_id}")
             print(f"   Mês: {mes}, Ano: {ano} ({dias_esperados} dias)")
@@ -1463,23 +916,8 @@ def api_adicionar_siisp():
                 'error': f'Quantidade de números SIISP ({len(numeros_siisp)}) não confere com os dias do mês {mes}/{ano} ({dias_esperados} dias).'
             }), 400
         
-        # Carregar dados existentes do arquivo mapas.json
-        dados_mapas = carregar_dados_json('mapas.json')
-        if 'mapas' not in dados_mapas:
-            dados_mapas['mapas'] = []
-        
         # Procurar pelo registro específico para adicionar SIISP
-        registro_encontrado = None
-        registro_index = None
-        
-        for i, registro in enumerate(dados_mapas['mapas']):
-            if (registro.get('nome_unidade') == nome_unidade and 
-                registro.get('mes') == mes and 
-                registro.get('ano') == ano and
-                registro.get('lote_id') == lote_id):
-                registro_encontrado = registro
-                registro_index = i
-                break
+        registro_encontrado = repositorio_mapas.obter(lote_id, ano, mes, nome_unidade)
         
         # Verificar se o registro foi encontrado
         if registro_encontrado is None:
@@ -1490,43 +928,28 @@ def api_adicionar_siisp():
         
         print(f"📊 Registro encontrado para {nome_unidade} - {mes}/{ano} (Lote {lote_id})")
         
-        # Atualizar o registro com os números SIISP
+        # Atualizar uma cópia do registro com os números SIISP (o cache não é alterado no lugar)
+        registro_encontrado = dict(registro_encontrado)
         registro_encontrado['n_siisp'] = numeros_siisp
         
         # Calcular automaticamente as colunas SIISP (diferenças)
         print(f"🔢 Calculando colunas SIISP automaticamente...")
         
-        campos_refeicoes = [
-            'cafe_interno', 'cafe_funcionario',
-            'almoco_interno', 'almoco_funcionario', 
-            'lanche_interno', 'lanche_funcionario',
-            'jantar_interno', 'jantar_funcionario'
-        ]
-        
-        # Para cada tipo de refeição, calcular diferença: valor_refeicao - n_siisp
-        for campo in campos_refeicoes:
-            campo_siisp = f"{campo}_siisp"
-            valores_refeicoes = registro_encontrado.get(campo, [])
-            
-            if valores_refeicoes and len(valores_refeicoes) == len(numeros_siisp):
-                # Calcular diferenças para cada dia
-                diferencas = []
-                for j in range(len(numeros_siisp)):
-                    diferenca = valores_refeicoes[j] - numeros_siisp[j]
-                    diferencas.append(diferenca)
-                
-                registro_encontrado[campo_siisp] = diferencas
-                print(f"   ✅ {campo_siisp}: calculado {len(diferencas)} valores")
+        # Para cada tipo de refeição, diferença valor_refeicao - n_siisp (matriz em cache, functions/colunar.py)
+        diferencas = diferencas_siisp(registro_encontrado)
+        for campo_siisp in CAMPOS_SIISP:
+            # Se não há dados compatíveis, manter vazio
+            registro_encontrado[campo_siisp] = diferencas.get(campo_siisp, [])
+            if registro_encontrado[campo_siisp]:
+                print(f"   ✅ {campo_siisp}: calculado {len(registro_encontrado[campo_siisp])} valores")
             else:
-                # Se não há dados compatíveis, manter vazio
-                registro_encontrado[campo_siisp] = []
                 print(f"   ⚠️ {campo_siisp}: dados incompatíveis, mantido vazio")
         
         # Atualizar timestamp de modificação
         registro_encontrado['data_atualizacao_siisp'] = datetime.now().isoformat()
         
         # Salvar dados atualizados
-        if salvar_dados_json('mapas.json', dados_mapas):
+        if repositorio_mapas.salvar_mapa(registro_encontrado) is not None:
             print(f"✅ Números SIISP adicionados com sucesso:")
             print(f"   Lote ID: {lote_id}")
             print(f"   Período: {mes}/{ano} ({dias_esperados} dias)")
@@ -1541,7 +964,7 @@ def api_adicionar_siisp():
                 'estatisticas': {
                     'total_dias': dias_esperados,
                     'numeros_adicionados': len(numeros_siisp),
-                    'colunas_calculadas': len(campos_refeicoes)
+                    'colunas_calculadas': len(CAMPOS_SIISP)
                 }
             })
         else:
@@ -1557,6 +980,57 @@ def api_lotes():
     lotes = carregar_lotes()
     return jsonify(lotes)
 
+@app.route('/api/lote/<int:lote_id>/mapas')
+def api_mapas_lote(lote_id):
+    """
+    API paginada dos mapas de um lote.
+    Parâmetros: inicio/fim (YYYY-MM-DD), unidades (separadas por vírgula),
+    cursor (da página anterior) e limite (1 a 200, padrão 50).
+    Responde com ETag; If-None-Match com a mesma versão dos dados retorna 304.
+    """
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    try:
+        inicio = datetime.strptime(request.args['inicio'], '%Y-%m-%d').date() if request.args.get('inicio') else None
+        fim = datetime.strptime(request.args['fim'], '%Y-%m-%d').date() if request.args.get('fim') else None
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato YYYY-MM-DD'}), 400
+    unidades = [u for u in request.args.get('unidades', '').split(',') if u.strip()]
+    cursor = request.args.get('cursor') or None
+    limite = min(max(request.args.get('limite', 50, type=int), 1), 200)
+    
+    # A ETag depende só da versão dos dados e da consulta: dá para responder 304 sem montar a página
+    etag = hashlib.sha1(f"{repositorio_mapas.versao()}|{lote_id}|{request.query_string.decode()}".encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        resposta = app.response_class(status=304)
+    else:
+        mapas = consultar_mapas_lote(lote_id, inicio, fim, unidades)
+        try:
+            pagina, proximo_cursor = paginar_mapas(mapas, cursor, limite)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        resposta = jsonify({
+            'mapas': pagina,
+            'proximo_cursor': proximo_cursor,
+            'total': len(mapas)
+        })
+    resposta.set_etag(etag)
+    # Sempre revalidar: o navegador reaproveita a resposta em cache quando o servidor responde 304
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+@app.route('/api/dashboard/resumo')
+def api_dashboard_resumo():
+    """API com os números agregados do dashboard (filtros opcionais: mes, ano, lote_id)"""
+    if 'usuario_id' not in session:
+        return jsonify({'error': 'Acesso negado'}), 401
+    
+    mes = request.args.get('mes', type=int) or None
+    ano = request.args.get('ano', type=int) or None
+    lote_id = request.args.get('lote_id', type=int) or None
+    return jsonify(resumo_dashboard(carregar_lotes(), mes=mes, ano=ano, lote_id=lote_id))
+
 @app.route('/api/usuarios')
 def api_usuarios():
     """API para listar usuários (apenas para admins)"""
@@ -1583,31 +1057,16 @@ def validar_campo_unico():
         if not campo or not valor:
             return jsonify({'valido': True})
         
-        usuarios = carregar_usuarios()
-        
-        # Validações específicas por campo
-        existe = False
-        mensagem = ''
-        
-        if campo == 'email':
-            valor = valor.lower()
-            existe = any(u.get('email', '').lower() == valor for u in usuarios)
-            mensagem = 'Este email já está em uso!'
-        elif campo == 'cpf':
-            existe = any(u.get('cpf', '') == valor for u in usuarios)
-            mensagem = 'Este CPF já está cadastrado!'
-        elif campo == 'usuario':
-            valor = valor.lower()
-            existe = any(u.get('usuario', '').lower() == valor for u in usuarios)
-            mensagem = 'Este nome de usuário já existe!'
-        elif campo == 'matricula':
-            if valor:  # Matrícula é opcional
-                existe = any(u.get('matricula', '') == valor for u in usuarios)
-                mensagem = 'Esta matrícula já está em uso!'
-        elif campo == 'telefone':
-            if valor:  # Telefone é opcional
-                existe = any(u.get('telefone', '') == valor for u in usuarios)
-                mensagem = 'Este telefone já está cadastrado!'
+        # Validações específicas por campo (índice em memória, sem ler a coleção)
+        mensagens = {
+            'email': 'Este email já está em uso!',
+            'cpf': 'Este CPF já está cadastrado!',
+            'usuario': 'Este nome de usuário já existe!',
+            'matricula': 'Esta matrícula já está em uso!',
+            'telefone': 'Este telefone já está cadastrado!'
+        }
+        existe = campo in mensagens and indice_usuarios.existe(campo, valor)
+        mensagem = mensagens.get(campo, '')
         
         return jsonify({
             'valido': not existe,
@@ -1666,6 +1125,43 @@ def erro_interno(error):
     """Página de erro 500"""
     return render_template('index.html'), 500
 
+# ===== COMANDOS DE LINHA DE COMANDO =====
+
+@app.cli.command('migrar-dados')
+def comando_migrar_dados():
+    """Executa as migrações pendentes dos arquivos de dados"""
+    migrar_dados_existentes()
+    migrar_mapas()
+
+@app.cli.command('importar-sqlite')
+def comando_importar_sqlite():
+    """Importa os arquivos JSON de dados/ para o banco SQLite (dados/sgmrp.db)"""
+    importar_json_para_sqlite()
+
+@app.cli.command('reconstruir-resumos')
+def comando_reconstruir_resumos():
+    """Recalcula os resumos por lote/unidade/mês a partir dos mapas em disco"""
+    total = resumos_mapas.reconstruir()
+    print(f"✅ {total} resumos de mapas reconstruídos; os processos do servidor em execução se reconstroem na próxima consulta")
+
+@app.cli.command('exportar-lotes')
+@click.option('--inicio', required=True, help='Data inicial (AAAA-MM-DD)')
+@click.option('--fim', required=True, help='Data final (AAAA-MM-DD)')
+@click.option('--lotes', default='', help='IDs separados por vírgula (padrão: todos)')
+@click.option('--saida', default=None, help='Arquivo ZIP de saída')
+@click.option('--processos', default=None, type=int, help='Processos em paralelo')
+def comando_exportar_lotes(inicio, fim, lotes, saida, processos):
+    """Gera o ZIP de fechamento com uma planilha por lote e mês do período"""
+    opcoes = {'max_processos': processos} if processos else {}
+    try:
+        arquivo, nome_arquivo, total = exportar_lotes_zip(lotes_da_query(lotes), inicio, fim, **opcoes)
+    except ErroExportacao as e:
+        raise click.ClickException(str(e))
+    saida = saida or nome_arquivo
+    with arquivo, open(saida, 'wb') as f:
+        shutil.copyfileobj(arquivo, f)
+    print(f"✅ {total} planilhas exportadas em {saida}")
+
 # ===== INICIALIZAÇÃO DA APLICAÇÃO =====
 
 if __name__ == '__main__':
@@ -1681,6 +1177,7 @@ if __name__ == '__main__':
     # Executar migração de dados se necessário
     print("🔄 Verificando migração de dados...")
     migrar_dados_existentes()
+    migrar_mapas()
     
     print("🔗 Acesse: http://localhost:5000")
     print("📝 Cadastros de usuários salvos no Firestore (coleção 'usuarios')")
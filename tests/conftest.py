@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from firestore_falso import FirestoreFalso
+
+# Instalado antes de qualquer import de functions.utils (que importaria o Firebase real)
+firestore_falso = FirestoreFalso()
+firestore_falso.instalar()
+
+@pytest.fixture
+def firestore():
+	from functions import utils
+	firestore_falso.limpar()
+	utils.invalidar_cache_usuarios()
+	yield firestore_falso
+	utils.invalidar_cache_usuarios()
@@ -0,0 +1,113 @@
+# Substituto em memória da API de functions/firestore_utils.py, para testes sem Firestore
+import sys
+import copy
+import types
+import itertools
+
+class _Documento:
+	def __init__(self, doc_id, dados):
+		self.id = doc_id
+		self._dados = dados
+
+	def to_dict(self):
+		return copy.deepcopy(self._dados)
+
+class _Colecao:
+	"""Só o que utils usa de db.collection(...): document().id e stream()."""
+
+	def __init__(self, falso, nome):
+		self._falso = falso
+		self._nome = nome
+
+	def document(self):
+		return types.SimpleNamespace(id=f'auto{next(self._falso._ids)}')
+
+	def stream(self):
+		self._falso.leituras['carregar'] += 1
+		return [_Documento(doc_id, dados) for doc_id, dados in list(self._falso.colecao(self._nome).items())]
+
+class _Cliente:
+	def __init__(self, falso):
+		self._falso = falso
+
+	def collection(self, nome):
+		return _Colecao(self._falso, nome)
+
+class FirestoreFalso:
+	"""Coleções como {nome: {doc_id: dados}}; conta as leituras por tipo de operação."""
+
+	def __init__(self):
+		self.colecoes = {}
+		self.leituras = {'carregar': 0, 'buscar': 0}
+		self._ids = itertools.count(1)
+		self.db = _Cliente(self)
+
+	def colecao(self, nome):
+		return self.colecoes.setdefault(nome, {})
+
+	def _para_dict(self, doc_id, dados):
+		# Mesmo formato de firestore_utils._documento_para_dict
+		return {'id': doc_id} | copy.deepcopy(dados) | {'firestore_id': doc_id}
+
+	def carregar_firestore(self, nome_colecao):
+		self.leituras['carregar'] += 1
+		return [self._para_dict(doc_id, dados) for doc_id, dados in self.colecao(nome_colecao).items()]
+
+	def buscar_firestore(self, nome_colecao, campo, valor, limite=1):
+		self.leituras['buscar'] += 1
+		encontrados = [
+			self._para_dict(doc_id, dados)
+			for doc_id, dados in self.colecao(nome_colecao).items()
+			if dados.get(campo) == valor
+		]
+		return encontrados[:limite]
+
+	def gravar_em_massa(self, nome_colecao, gravacoes=(), exclusoes=(), max_paralelos=1):
+		colecao = self.colecao(nome_colecao)
+		resultados = []
+		for doc_id, dados in gravacoes:
+			doc_id = doc_id or f'auto{next(self._ids)}'
+			colecao[doc_id] = copy.deepcopy(dados)
+			resultados.append({'id': doc_id, 'erro': None})
+		for doc_id in exclusoes:
+			colecao.pop(doc_id, None)
+			resultados.append({'id': doc_id, 'erro': None})
+		return resultados
+
+	def salvar_firestore(self, nome_colecao, dados):
+		itens = dados if isinstance(dados, list) else [dados]
+		return [r['id'] for r in self.gravar_em_massa(nome_colecao, [(None, item) for item in itens])]
+
+	def criar_firestore(self, nome_colecao, doc_id, dados):
+		colecao = self.colecao(nome_colecao)
+		if doc_id in colecao:
+			return False
+		colecao[doc_id] = copy.deepcopy(dados)
+		return True
+
+	def proximo_valor_contador(self, nome, valor_inicial=0):
+		contadores = self.colecao('contadores')
+		if nome not in contadores:
+			contadores[nome] = {'valor': valor_inicial() if callable(valor_inicial) else valor_inicial}
+		contadores[nome]['valor'] += 1
+		return contadores[nome]['valor']
+
+	def elevar_valor_contador(self, nome, minimo):
+		contador = self.colecao('contadores').setdefault(nome, {'valor': minimo})
+		contador['valor'] = max(contador['valor'], minimo)
+
+	def instalar(self):
+		"""Registra este substituto como functions.firestore_utils (antes de importar functions.utils)."""
+		modulo = types.ModuleType('functions.firestore_utils')
+		modulo.db = self.db
+		for nome in (
+			'carregar_firestore', 'buscar_firestore', 'gravar_em_massa', 'salvar_firestore',
+			'criar_firestore', 'proximo_valor_contador', 'elevar_valor_contador'
+		):
+			setattr(modulo, nome, getattr(self, nome))
+		sys.modules['functions.firestore_utils'] = modulo
+		return modulo
+
+	def limpar(self):
+		self.colecoes.clear()
+		self.leituras = {'carregar': 0, 'buscar': 0}
@@ -0,0 +1,77 @@
+from unittest import mock
+from functions import utils
+
+def _cadastrar(firestore, doc_id, **campos):
+	firestore.colecao('usuarios')[doc_id] = campos
+
+def test_busca_por_email(firestore):
+	_cadastrar(firestore, '1', id=1, email='admin@seap.gov.br', usuario='admin', senha='x')
+	usuario = utils.buscar_usuario_por_email_ou_usuario('  Admin@SEAP.gov.br ')
+	assert usuario['id'] == 1
+	assert usuario['firestore_id'] == '1'
+	assert firestore.leituras == {'carregar': 0, 'buscar': 1}
+
+def test_busca_por_nome_de_usuario(firestore):
+	_cadastrar(firestore, '2', id=2, email='maria@seap.gov.br', usuario='maria')
+	usuario = utils.buscar_usuario_por_email_ou_usuario('MARIA')
+	assert usuario['id'] == 2
+	# Consulta por email (sem resultado) e depois por usuário
+	assert firestore.leituras['buscar'] == 2
+	assert firestore.leituras['carregar'] == 0
+
+def test_usuario_inexistente(firestore):
+	_cadastrar(firestore, '1', id=1, email='admin@seap.gov.br', usuario='admin')
+	assert utils.buscar_usuario_por_email_ou_usuario('ninguem') is None
+	assert utils.buscar_usuario_por_email_ou_usuario('   ') is None
+	# Falhas não ficam em cache
+	assert utils.buscar_usuario_por_email_ou_usuario('ninguem') is None
+	assert firestore.leituras['buscar'] == 4
+
+def test_cache_evita_nova_consulta(firestore):
+	_cadastrar(firestore, '1', id=1, email='admin@seap.gov.br', usuario='admin')
+	utils.buscar_usuario_por_email_ou_usuario('admin')
+	leituras = firestore.leituras['buscar']
+	usuario = utils.buscar_usuario_por_email_ou_usuario('admin')
+	assert usuario['id'] == 1
+	assert firestore.leituras['buscar'] == leituras
+	# O chamador recebe uma cópia: alterá-la não altera o cache
+	usuario['senha'] = 'alterada'
+	assert 'senha' not in utils.buscar_usuario_por_email_ou_usuario('admin')
+
+def test_cache_expira(firestore):
+	_cadastrar(firestore, '1', id=1, email='admin@seap.gov.br', usuario='admin', acesso=False)
+	with mock.patch.object(utils.time, 'monotonic', return_value=1000.0):
+		assert utils.buscar_usuario_por_email_ou_usuario('admin')['acesso'] is False
+	firestore.colecao('usuarios')['1']['acesso'] = True
+	with mock.patch.object(utils.time, 'monotonic', return_value=1000.0 + utils.TTL_CACHE_USUARIOS / 2):
+		assert utils.buscar_usuario_por_email_ou_usuario('admin')['acesso'] is False
+	with mock.patch.object(utils.time, 'monotonic', return_value=1000.0 + utils.TTL_CACHE_USUARIOS + 1):
+		assert utils.buscar_usuario_por_email_ou_usuario('admin')['acesso'] is True
+
+def test_invalidacao_do_cache(firestore):
+	_cadastrar(firestore, '1', id=1, email='admin@seap.gov.br', usuario='admin', senha='antiga')
+	assert utils.buscar_usuario_por_email_ou_usuario('admin')['senha'] == 'antiga'
+	firestore.colecao('usuarios')['1']['senha'] = 'nova'
+	utils.invalidar_cache_usuarios()
+	assert utils.buscar_usuario_por_email_ou_usuario('admin')['senha'] == 'nova'
+
+def test_invalidacao_ao_cadastrar(firestore):
+	assert utils.buscar_usuario_por_email_ou_usuario('joao') is None
+	novo = utils.adicionar_usuario({'nome': 'João', 'email': 'Joao@SEAP.gov.br', 'usuario': 'Joao', 'senha': 's'})
+	usuario = utils.buscar_usuario_por_email_ou_usuario('joao@seap.gov.br')
+	assert usuario['id'] == novo['id']
+	assert usuario['usuario'] == 'joao'
+
+def test_salvar_usuarios_normaliza_login(firestore):
+	utils.salvar_usuarios([{'id': 1, 'email': ' Admin@SEAP.gov.br', 'usuario': 'Admin ', 'nome': 'Admin'}])
+	gravado = firestore.colecao('usuarios')['1']
+	assert gravado['email'] == 'admin@seap.gov.br'
+	assert gravado['usuario'] == 'admin'
+	assert gravado['nome'] == 'Admin'
+	assert utils.buscar_usuario_por_email_ou_usuario('ADMIN')['id'] == 1
+
+def test_salvar_usuarios_invalida_cache(firestore):
+	utils.salvar_usuarios([{'id': 1, 'email': 'admin@seap.gov.br', 'usuario': 'admin', 'acesso': False}])
+	assert utils.buscar_usuario_por_email_ou_usuario('admin')['acesso'] is False
+	utils.salvar_usuarios([{'id': 1, 'email': 'admin@seap.gov.br', 'usuario': 'admin', 'acesso': True}])
+	assert utils.buscar_usuario_por_email_ou_usuario('admin')['acesso'] is True